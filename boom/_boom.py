@@ -32,11 +32,33 @@ manual page for information on using the command line interface.
 """
 from __future__ import print_function
 
-from os.path import exists as path_exists, isabs, isdir, join as path_join
-from errno import ENOENT
-from os import listdir
+from os.path import (exists as path_exists, isabs, isdir, join as path_join,
+                     dirname)
+from errno import ENOENT, EACCES, EAGAIN, EROFS
+from os import listdir, stat, fdopen, rename, unlink, fsync, fdatasync, close
+from os import open as os_open, O_RDONLY, O_RDWR, O_CREAT
+from stat import S_IMODE
+
+# os.scandir() is available from Python 3.5.
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+# Advisory locking is only available on POSIX platforms.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from tempfile import mkstemp
+from time import time, sleep
 import logging
+import json
 import string
+import re
+import fnmatch
+import sys
+from threading import RLock
 
 #: The location of the system ``/boot`` directory.
 DEFAULT_BOOT_PATH = "/boot"
@@ -55,6 +77,12 @@ BOOM_CONFIG_FILE = "boom.conf"
 DEFAULT_BOOM_CONFIG_PATH = path_join(DEFAULT_BOOM_PATH, BOOM_CONFIG_FILE)
 __boom_config_path = DEFAULT_BOOM_CONFIG_PATH
 
+#: The name of the lock file in the boom configuration directory.
+BOOM_LOCK_FILE = "boom.lock"
+
+#: The default time in seconds to wait for the boom lock.
+DEFAULT_LOCK_TIMEOUT = 30
+
 #: Kernel version string, in ``uname -r`` format.
 FMT_VERSION = "version"
 #: LVM2 root logical volume in ``vg/lv`` format.
@@ -125,10 +153,12 @@ BOOM_DEBUG_PROFILE = 1
 BOOM_DEBUG_ENTRY = 2
 BOOM_DEBUG_REPORT = 4
 BOOM_DEBUG_COMMAND = 8
+BOOM_DEBUG_PERF = 16
 BOOM_DEBUG_ALL = (BOOM_DEBUG_PROFILE |
                   BOOM_DEBUG_ENTRY |
                   BOOM_DEBUG_REPORT |
-                  BOOM_DEBUG_COMMAND)
+                  BOOM_DEBUG_COMMAND |
+                  BOOM_DEBUG_PERF)
 
 __debug_mask = 0
 
@@ -205,6 +235,380 @@ def set_debug_mask(mask):
     __debug_mask = mask
 
 
+#: Performance phase names
+PERF_CONFIG_LOAD = "config_load"
+PERF_PROFILE_LOAD = "profile_load"
+PERF_HOST_LOAD = "host_load"
+PERF_ENTRY_LOAD = "entry_load"
+PERF_MATCH = "match"
+PERF_REPORT_BUILD = "report_build"
+PERF_REPORT_SORT = "report_sort"
+PERF_REPORT_OUTPUT = "report_output"
+PERF_WRITE = "write"
+PERF_LEGACY_SYNC = "legacy_sync"
+
+#: Performance counter names
+PERF_FILES_OPENED = "files_opened"
+PERF_REGEX_COMPILED = "regexes_compiled"
+PERF_SHA_COMPUTED = "sha1s_computed"
+PERF_TEMPLATE_RENDERED = "templates_rendered"
+PERF_WRITES_ELIDED = "writes_elided"
+
+__perf_times = {}
+__perf_counts = {}
+
+
+def perf_enabled():
+    """Test whether performance metrics are being recorded.
+
+        Metrics are recorded when the ``BOOM_DEBUG_PERF`` bit is set
+        in the boom debug mask.
+
+        :returns: ``True`` if metrics are enabled or ``False`` otherwise.
+        :returntype: bool
+    """
+    return bool(__debug_mask & BOOM_DEBUG_PERF)
+
+
+def perf_count(counter, count=1):
+    """Increment a performance counter.
+
+        :param counter: The name of the counter to increment.
+        :param count: The amount to add to the counter.
+        :returntype: None
+    """
+    if __debug_mask & BOOM_DEBUG_PERF:
+        __perf_counts[counter] = __perf_counts.get(counter, 0) + count
+
+
+def perf_add_time(phase, elapsed):
+    """Add wall clock time to a performance phase.
+
+        :param phase: The name of the phase.
+        :param elapsed: The time to add, in seconds.
+        :returntype: None
+    """
+    if __debug_mask & BOOM_DEBUG_PERF:
+        __perf_times[phase] = __perf_times.get(phase, 0.0) + elapsed
+
+
+class PerfTimer(object):
+    """Context manager that adds the wall clock time spent in a block
+        to a performance phase.
+
+        Timers for nested phases are inclusive: time spent loading
+        profiles during an entry load is counted in both phases.
+    """
+
+    def __init__(self, phase):
+        """Initialise a new ``PerfTimer`` for ``phase``.
+
+            :param phase: The name of the phase to time.
+        """
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        if perf_enabled():
+            self.start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            perf_add_time(self.phase, time() - self.start)
+            self.start = None
+        return False
+
+
+def reset_perf_metrics():
+    """Reset all performance timers and counters.
+
+        :returntype: None
+    """
+    __perf_times.clear()
+    __perf_counts.clear()
+
+
+def get_perf_metrics():
+    """Return the current performance metrics.
+
+        :returns: A dictionary with a ``"times"`` member mapping phase
+                  names to seconds and a ``"counters"`` member mapping
+                  counter names to counts.
+        :returntype: dict
+    """
+    return {
+        "times": dict(__perf_times),
+        "counters": dict(__perf_counts)
+    }
+
+
+def format_perf_metrics():
+    """Format the current performance metrics as a human readable
+        summary.
+
+        :returns: A multi-line summary string.
+        :returntype: str
+    """
+    lines = ["Performance summary:"]
+    for phase in sorted(__perf_times):
+        lines.append("  %-20s %10.3fms" %
+                     (phase, __perf_times[phase] * 1000.0))
+    for counter in sorted(__perf_counts):
+        lines.append("  %-20s %10d" % (counter, __perf_counts[counter]))
+    for op in IO_OPS:
+        lines.append("  %-20s %10d" % ("io_" + op, __io_counts[op]))
+    return "\n".join(lines)
+
+
+#: Filesystem I/O operation names
+IO_OPEN = "open"
+IO_STAT = "stat"
+IO_READ = "read"
+IO_WRITE = "write"
+IO_FSYNC = "fsync"
+IO_RENAME = "rename"
+IO_UNLINK = "unlink"
+
+IO_OPS = [
+    IO_OPEN, IO_STAT, IO_READ, IO_WRITE, IO_FSYNC, IO_RENAME, IO_UNLINK
+]
+
+__io_counts = dict((op, 0) for op in IO_OPS)
+
+
+def get_io_counts():
+    """Return the filesystem operation counts recorded since the last
+        call to ``reset_io_counts()``.
+
+        Boom modules perform filesystem access via the ``io_*``
+        functions, which record the number of opens (including
+        directory listings and temporary file creation), stats,
+        files read and written, fsyncs, renames and unlinks.
+
+        :returns: A dictionary mapping ``IO_*`` operation names to
+                  counts.
+        :returntype: dict
+    """
+    return dict(__io_counts)
+
+
+def reset_io_counts():
+    """Reset all filesystem operation counts to zero.
+
+        :returntype: None
+    """
+    for op in IO_OPS:
+        __io_counts[op] = 0
+
+
+def io_open(path, mode="r"):
+    """Open the file at ``path`` and record the operation.
+
+        :param path: The path to open.
+        :param mode: The file mode string.
+        :returns: A new file object.
+    """
+    __io_counts[IO_OPEN] += 1
+    if "r" in mode or "+" in mode:
+        __io_counts[IO_READ] += 1
+    if "w" in mode or "a" in mode or "+" in mode:
+        __io_counts[IO_WRITE] += 1
+    perf_count(PERF_FILES_OPENED)
+    return open(path, mode)
+
+
+def io_mkstemp(prefix, dir):
+    """Create and open a new temporary file for writing in ``dir``.
+
+        :param prefix: The temporary file name prefix.
+        :param dir: The directory in which to create the file.
+        :returns: A ``(fd, path)`` tuple as returned by ``mkstemp()``.
+    """
+    __io_counts[IO_OPEN] += 1
+    __io_counts[IO_WRITE] += 1
+    return mkstemp(prefix=prefix, dir=dir)
+
+
+def io_listdir(path):
+    """List the directory at ``path`` and record the operation.
+
+        :param path: The directory to list.
+        :returns: A list of directory entry names.
+    """
+    __io_counts[IO_OPEN] += 1
+    return listdir(path)
+
+
+def io_list_files(path, suffix=""):
+    """List the non-directory entries in ``path`` ending in ``suffix``
+        and record the operation.
+
+        If ``os.scandir()`` is available the file type returned by the
+        directory read is used to skip sub-directories without calling
+        ``stat()``. Otherwise all matching names are returned.
+
+        :param path: The directory to list.
+        :param suffix: An optional file name suffix to match.
+        :returns: A list of file names.
+    """
+    __io_counts[IO_OPEN] += 1
+    if not scandir:
+        return [name for name in listdir(path) if name.endswith(suffix)]
+    return [d.name for d in scandir(path)
+            if d.name.endswith(suffix) and not d.is_dir()]
+
+
+def io_stat(path):
+    """Stat ``path`` and record the operation.
+
+        :param path: The path to stat.
+        :returns: An ``os.stat_result``.
+        :raises: ``OSError`` if the path cannot be accessed.
+    """
+    __io_counts[IO_STAT] += 1
+    return stat(path)
+
+
+def io_exists(path):
+    """Test whether ``path`` exists and record the operation.
+
+        :param path: The path to test.
+        :returns: ``True`` if ``path`` exists or ``False`` otherwise.
+        :returntype: bool
+    """
+    __io_counts[IO_STAT] += 1
+    return path_exists(path)
+
+
+def io_fsync(fd, data_only=False):
+    """Synchronise the file open at ``fd`` to disk and record the
+        operation.
+
+        :param fd: The file descriptor to synchronise.
+        :param data_only: Use ``fdatasync()`` instead of ``fsync()``.
+        :returntype: None
+    """
+    __io_counts[IO_FSYNC] += 1
+    if data_only:
+        fdatasync(fd)
+    else:
+        fsync(fd)
+
+
+def io_sync_dir(dir_path):
+    """Synchronise directory metadata to disk.
+
+        Call ``fsync()`` on the directory at ``dir_path`` to ensure
+        that any renames and unlinks of the files that it contains
+        are persistent.
+
+        :param dir_path: The path to the directory to synchronise.
+        :returntype: None
+    """
+    __io_counts[IO_OPEN] += 1
+    dir_fd = os_open(dir_path, O_RDONLY)
+    try:
+        io_fsync(dir_fd)
+    finally:
+        close(dir_fd)
+
+
+def io_rename(src, dst):
+    """Rename ``src`` to ``dst`` and record the operation.
+
+        :param src: The path to rename.
+        :param dst: The new path.
+        :returntype: None
+    """
+    __io_counts[IO_RENAME] += 1
+    rename(src, dst)
+
+
+def io_unlink(path):
+    """Unlink ``path`` and record the operation.
+
+        :param path: The path to unlink.
+        :returntype: None
+    """
+    __io_counts[IO_UNLINK] += 1
+    unlink(path)
+
+
+def io_elide_write(path, data, mode=None):
+    """Test whether a write of ``data`` to ``path`` can be skipped.
+
+        Boom replaces files by writing a temporary file, synchronising
+        it to disk and renaming it into place. If the file at ``path``
+        already contains exactly ``data`` (and, if ``mode`` is given,
+        has those permission bits) the write is unnecessary. The file
+        size is checked first, so that a file of a different length is
+        never read.
+
+        Elided writes are logged and counted by the ``writes_elided``
+        performance counter.
+
+        :param path: The path of the file to be replaced.
+        :param data: The complete new file content.
+        :param mode: The optional permission bits of the new file.
+        :returns: ``True`` if the file is unchanged and the write can be
+                  skipped, or ``False`` otherwise.
+        :returntype: bool
+    """
+    size = len(data if isinstance(data, bytes) else data.encode("utf8"))
+    try:
+        st = io_stat(path)
+        if st.st_size != size:
+            return False
+        if mode is not None and S_IMODE(st.st_mode) != mode:
+            return False
+        with io_open(path, "r") as f:
+            if f.read() != data:
+                return False
+    except (IOError, OSError):
+        return False
+    perf_count(PERF_WRITES_ELIDED)
+    _log_debug("Skipping write of unchanged file '%s'" % path)
+    return True
+
+
+#
+# String interning
+#
+
+# Python2 vs. Python3 string types
+try:
+    # Py2
+    _string_types = (str, unicode)
+except NameError:
+    # Py3
+    _string_types = (str,)
+
+#: Interned strings, as a table for each string type.
+__interned = {}
+
+
+def intern_string(value):
+    """Return a shared copy of the string ``value``.
+
+        Values such as machine identifiers, kernel versions and option
+        strings repeat across large numbers of boot entries: interning
+        them stores a single copy of each distinct value. Values that
+        are not strings (including ``None``) are returned unchanged.
+
+        Unlike the ``intern()`` built-in this accepts both ``str`` and
+        ``unicode`` values on Python 2, and never changes the type of
+        ``value``.
+
+        :param value: The string to intern.
+        :returns: An equal string shared with other callers.
+    """
+    if not isinstance(value, _string_types):
+        return value
+    table = __interned.setdefault(type(value), {})
+    return table.setdefault(value, value)
+
+
 class BoomConfig(object):
     """Class representing boom persistent configuration values.
     """
@@ -218,6 +622,10 @@ class BoomConfig(object):
     legacy_format = "grub1"
     legacy_sync = True
 
+    lock_timeout = DEFAULT_LOCK_TIMEOUT
+
+    entry_roots = None
+
     def __str__(self):
         """Return a string representation of this ``BoomConfig`` in
             boom.conf (INI) notation.
@@ -246,7 +654,8 @@ class BoomConfig(object):
         return cstr
 
     def __init__(self, boot_path=None, boom_path=None, legacy_enable=None,
-                 legacy_format=None, legacy_sync=None):
+                 legacy_format=None, legacy_sync=None, lock_timeout=None,
+                 entry_roots=None):
         """Initialise a new ``BoomConfig`` object with the supplied
             configuration values, or defaults for any unset arguments.
 
@@ -255,12 +664,20 @@ class BoomConfig(object):
             :param legacy_enable: enable legacy bootloader support
             :param legacy_format: the legacy bootlodaer format to write
             :param legacy_sync: the legacy sync mode
+            :param lock_timeout: the time in seconds to wait for the
+                                 boom directory lock
+            :param entry_roots: a list of file systems containing BLS
+                                boot entries, or ``None`` to use only
+                                the boot file system
         """
         self.boot_path = boot_path or self.boot_path
         self.boom_path = boom_path or self.boom_path
         self.legacy_enable = legacy_enable or self.legacy_enable
         self.legacy_format = legacy_format or self.legacy_format
         self.legacy_sync = legacy_sync or self.legacy_sync
+        if lock_timeout is not None:
+            self.lock_timeout = lock_timeout
+        self.entry_roots = entry_roots or self.entry_roots
 
 
 __config = BoomConfig()
@@ -380,6 +797,45 @@ def set_boom_path(boom_path):
     __config.boom_path = boom_path
     set_boom_config_path(__config.boom_path)
 
+
+def get_entry_roots():
+    """Return the file systems that contain BLS boot entries.
+
+        The Boot Loader Specification allows entries to be stored on
+        both the EFI system partition and an extended boot loader
+        (XBOOTLDR) partition. Each entry root contains entries in its
+        ``loader/entries`` directory. New entries are written to the
+        first root.
+
+        If no entry roots are configured, only the boot file system
+        is used. Relative paths are taken to be relative to the boot
+        file system.
+
+        :returns: A list of absolute entry root paths.
+        :returntype: list
+    """
+    if not __config.entry_roots:
+        return [__config.boot_path]
+    return [path_join(__config.boot_path, root)
+            for root in __config.entry_roots]
+
+
+def set_entry_roots(entry_roots):
+    """Set the file systems that contain BLS boot entries.
+
+        :param entry_roots: A list of entry root paths, or ``None`` to
+                            use only the boot file system.
+        :returns: ``None``
+        :raises: ValueError if an entry root does not exist.
+    """
+    global __config
+    for root in entry_roots or []:
+        if not path_exists(path_join(__config.boot_path, root)):
+            raise ValueError("Entry root %s does not exist" % root)
+    __config.entry_roots = list(entry_roots) if entry_roots else None
+    _log_debug("Set entry roots to: %s" % entry_roots)
+
+
 def get_boom_config_path():
     """Return the currently configured boom configuration file path.
 
@@ -404,6 +860,446 @@ def set_boom_config_path(path):
     _log_debug("set boom_config_path to '%s'" % path)
 
 
+def _set_context_config(config, config_path):
+    """Install the configuration of a newly activated ``BoomContext``.
+    """
+    global __boom_config_path
+    set_boom_config(config)
+    __boom_config_path = config_path
+
+
+#
+# Boom contexts
+#
+
+#: Lock serialising access to the module state managed by ``BoomContext``.
+__context_lock = RLock()
+
+#: Registered context state as a list of ``(module, names, reset_fn)``.
+__context_state = []
+
+#: The stack of active ``(BoomContext, saved_state)`` pairs.
+__context_stack = []
+
+
+def _register_context_state(module_name, names, reset_fn=None):
+    """Register module global state to be managed by ``BoomContext``.
+
+        Each time a context is activated the current values of the
+        globals ``names`` in module ``module_name`` are saved, and the
+        values belonging to the context are installed in their place.
+        A context that has not previously been active (or that was
+        created before the module was imported) is initialised by
+        calling ``reset_fn``.
+
+        :param module_name: The name of the module owning the state.
+        :param names: A list of module global names.
+        :param reset_fn: A function to reset the globals to their
+                         initial state, or ``None``.
+        :returns: None
+    """
+    __context_state.append((module_name, names, reset_fn))
+
+
+def _get_context_state():
+    """Return the current values of all registered context state.
+
+        :returns: A dictionary mapping ``(module, name)`` to values.
+        :returntype: dict
+    """
+    state = {}
+    for (module_name, names, reset_fn) in __context_state:
+        module = sys.modules[module_name]
+        for name in names:
+            state[(module_name, name)] = getattr(module, name)
+    return state
+
+
+def _set_context_state(state):
+    """Install the context state values in ``state``.
+
+        Registered modules with no values in ``state`` are reset to
+        their initial state.
+
+        :param state: A dictionary mapping ``(module, name)`` to values.
+        :returns: None
+    """
+    for (module_name, names, reset_fn) in __context_state:
+        module = sys.modules[module_name]
+        if not all((module_name, name) in state for name in names):
+            if reset_fn:
+                reset_fn()
+            continue
+        for name in names:
+            setattr(module, name, state[(module_name, name)])
+
+
+def _enter_context(context):
+    """Activate ``context`` in the calling thread.
+    """
+    __context_lock.acquire()
+    try:
+        if any(ctx is context for (ctx, saved) in __context_stack):
+            raise ValueError("BoomContext is already active")
+        saved = _get_context_state()
+        _set_context_state(context._state or {})
+        if not context._state:
+            _set_context_config(context.config, context.config_path)
+    except Exception:
+        __context_lock.release()
+        raise
+    __context_stack.append((context, saved))
+
+
+def _exit_context(context):
+    """Deactivate ``context`` and restore the previously active state.
+    """
+    (ctx, saved) = __context_stack.pop()
+    context._state = _get_context_state()
+    _set_context_state(saved)
+    __context_lock.release()
+
+
+def _acquire_context_lock():
+    """Take the process-wide context lock without changing the active
+        context.
+    """
+    __context_lock.acquire()
+
+
+def _release_context_lock():
+    """Release the context lock taken by ``_acquire_context_lock()``.
+    """
+    __context_lock.release()
+
+
+def get_boom_context():
+    """Return the active ``BoomContext``, or ``None`` if the module
+        global (default) context is in use.
+
+        :returns: The active context or ``None``.
+        :returntype: ``BoomContext``
+    """
+    return __context_stack[-1][0] if __context_stack else None
+
+
+class BoomContext(object):
+    """A ``BoomContext`` holds the complete state used by boom to manage
+        one boot file system: the boot and boom paths, the active
+        ``BoomConfig``, and the in-memory ``OsProfile``, ``HostProfile``
+        and ``BootEntry`` lists and caches.
+
+        A context is activated with the ``with`` statement: while it is
+        active all boom APIs operate on the context's boot file system,
+        and any profiles and entries loaded are retained by the context
+        when it is deactivated::
+
+            ctx = BoomContext(boot_path="/srv/images/vm0/boot")
+            with ctx:
+                entries = find_entries()
+
+        When no context is active boom uses its module globals as the
+        default context.
+
+        Activating a context takes a process-wide lock that is held
+        until the context is deactivated: contexts may be used from
+        several threads, but only one thread operates on boom state
+        at a time. To manage several boot file systems in parallel
+        use one context per worker process.
+
+        The default context shares the same lock through ``BoomLock``:
+        every ``BoomLock`` also holds the context lock, so that boom
+        commands, ``boom.aio`` calls and all operations that modify boom
+        data wait for a context active in another thread to be
+        deactivated. Other boom calls made without an active context
+        are not protected: a thread that uses the default context while
+        other threads use contexts must hold a ``BoomLock`` around its
+        boom calls, or else it may operate on another thread's context
+        state.
+    """
+    #: The ``BoomConfig`` used by this context.
+    config = None
+    #: The path to the boom configuration file for this context.
+    config_path = None
+
+    #: Saved module state, or ``None`` if never activated.
+    _state = None
+
+    def __init__(self, boot_path=None, boom_path=None, config=None,
+                 config_path=None):
+        """Initialise a new ``BoomContext``.
+
+            The context configuration is taken from ``config`` if set,
+            or else a new ``BoomConfig`` is created using ``boot_path``
+            and ``boom_path``. If ``boom_path`` is not given it defaults
+            to the 'boom/' sub-directory of ``boot_path``.
+
+            :param boot_path: The path to the boot file system.
+            :param boom_path: The path to the boom configuration
+                              directory.
+            :param config: An optional ``BoomConfig`` object to use.
+            :param config_path: The path to the boom configuration
+                                file.
+            :returns: A new ``BoomContext`` object.
+            :returntype: ``BoomContext``
+            :raises: ValueError if neither ``config`` nor an absolute
+                     ``boot_path`` is given.
+        """
+        if not config:
+            if not boot_path or not isabs(boot_path):
+                raise ValueError("BoomContext requires a config or an "
+                                 "absolute boot_path")
+            boom_path = boom_path or path_join(boot_path, DEFAULT_BOOM_DIR)
+            config = BoomConfig(boot_path=boot_path, boom_path=boom_path)
+        self.config = config
+        self.config_path = config_path or path_join(config.boom_path,
+                                                    BOOM_CONFIG_FILE)
+
+    def __str__(self):
+        return "BoomContext(boot_path=%s, boom_path=%s)" % (
+            self.config.boot_path, self.config.boom_path
+        )
+
+    def __repr__(self):
+        return "BoomContext(boot_path=%s, boom_path=%s, config_path=%s)" % (
+            repr(self.config.boot_path), repr(self.config.boom_path),
+            repr(self.config_path)
+        )
+
+    def __enter__(self):
+        _enter_context(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _exit_context(self)
+        return False
+
+    @property
+    def boot_path(self):
+        """The boot file system path of this context.
+        """
+        return self.config.boot_path
+
+    @property
+    def boom_path(self):
+        """The boom configuration path of this context.
+        """
+        return self.config.boom_path
+
+    @property
+    def active(self):
+        """``True`` if this context is currently active.
+        """
+        return get_boom_context() is self
+
+
+_register_context_state(__name__, ["__config", "__boom_config_path"])
+
+
+#
+# Boom directory locking
+#
+
+#: Interval in seconds between attempts to take a contended lock.
+_LOCK_POLL_INTERVAL = 0.05
+
+#: Locks held by this process: a map of lock file paths to
+#: ``[fd, modes]`` pairs, where ``modes`` is the stack of nested lock
+#: requests (``True`` for exclusive).
+__locks = {}
+
+
+class BoomLockError(BoomError):
+    """Raised when the boom lock cannot be obtained within the lock
+        timeout.
+    """
+    pass
+
+
+def _flock(fd, path, exclusive, timeout, upgrade=False):
+    """Apply a shared or exclusive ``flock()`` to ``fd``, waiting for
+        up to ``timeout`` seconds for a contended lock.
+
+        On Linux a failed ``flock()`` conversion releases the lock that
+        was already held: an upgrade is not atomic. When ``upgrade`` is
+        set the shared lock is re-taken without blocking after each
+        failed attempt, so that a timed out upgrade normally leaves the
+        caller holding the shared lock it started with. If another
+        process takes an exclusive lock in the window between the two
+        calls the shared lock cannot be re-taken before the deadline:
+        ``BoomLockError`` is then raised and the caller no longer holds
+        any lock on ``fd``.
+
+        :param fd: The lock file descriptor.
+        :param path: The lock file path (used in error messages).
+        :param exclusive: ``True`` to take an exclusive lock.
+        :param timeout: The time in seconds to wait, or a negative
+                        value to wait indefinitely.
+        :param upgrade: ``True`` if ``fd`` already holds a shared lock
+                        that is being converted to an exclusive lock.
+        :returns: None
+        :raises: BoomLockError if the lock is not obtained in time.
+    """
+    operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if timeout < 0:
+        fcntl.flock(fd, operation)
+        return
+    deadline = time() + timeout
+    while True:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return
+        except (IOError, OSError) as e:
+            if e.errno not in (EAGAIN, EACCES):
+                raise
+            if upgrade:
+                try:
+                    _flock(fd, path, False, max(deadline - time(), 0))
+                except BoomLockError:
+                    raise BoomLockError("Timed out waiting for exclusive "
+                                        "lock on '%s': shared lock lost" %
+                                        path)
+        if time() >= deadline:
+            raise BoomLockError("Timed out waiting for %s lock on '%s'" %
+                                ("exclusive" if exclusive else "shared",
+                                 path))
+        sleep(_LOCK_POLL_INTERVAL)
+
+
+def _open_lock_file(path, exclusive):
+    """Open the lock file at ``path``, creating it if necessary.
+
+        A shared lock may use an existing lock file that is not
+        writable by the caller.
+
+        :returns: A file descriptor, or ``None`` if the lock file
+                  cannot be opened.
+    """
+    try:
+        return os_open(path, O_RDWR | O_CREAT, BOOT_CONFIG_MODE)
+    except OSError as e:
+        if e.errno not in (EACCES, EROFS, ENOENT):
+            raise
+        err = e
+    if not exclusive:
+        try:
+            return os_open(path, O_RDONLY)
+        except OSError as e:
+            err = e
+    log = _log_debug if not exclusive else _log_warn
+    log("Not locking boom directory: %s" % err)
+    return None
+
+
+def _acquire_lock(exclusive, timeout):
+    """Take the boom lock for the active boom path.
+
+        :returns: The lock file path, or ``None`` if no lock was taken.
+    """
+    if not fcntl:
+        return None
+    if timeout is None:
+        timeout = getattr(__config, "lock_timeout", DEFAULT_LOCK_TIMEOUT)
+    path = path_join(__config.boom_path, BOOM_LOCK_FILE)
+    if path in __locks:
+        (fd, modes) = __locks[path]
+        if exclusive and not any(modes):
+            _flock(fd, path, True, timeout, upgrade=True)
+        modes.append(exclusive)
+        return path
+
+    fd = _open_lock_file(path, exclusive)
+    if fd is None:
+        return None
+    try:
+        _flock(fd, path, exclusive, timeout)
+    except Exception:
+        close(fd)
+        raise
+    _log_debug("Took %s lock on '%s'" %
+               ("exclusive" if exclusive else "shared", path))
+    __locks[path] = [fd, [exclusive]]
+    return path
+
+
+def _release_lock(path):
+    """Release one level of the boom lock at ``path``.
+    """
+    (fd, modes) = __locks[path]
+    exclusive = modes.pop()
+    if not modes:
+        del __locks[path]
+        close(fd)
+        _log_debug("Released lock on '%s'" % path)
+    elif exclusive and not any(modes):
+        # Downgrade to the shared lock held by the enclosing request.
+        fcntl.flock(fd, fcntl.LOCK_SH)
+
+
+def _have_exclusive_lock():
+    """Return ``True`` if this process holds the exclusive boom lock
+        for the active boom path.
+
+        :returntype: bool
+    """
+    path = path_join(__config.boom_path, BOOM_LOCK_FILE)
+    return path in __locks and any(__locks[path][1])
+
+
+class BoomLock(object):
+    """Context manager holding an advisory lock on the active boom
+        configuration directory.
+
+        A shared lock is used for operations that only read boom data,
+        and an exclusive lock for operations that modify entries,
+        profiles or legacy boot loader configuration: any number of
+        readers may run concurrently, while a writer excludes all other
+        readers and writers.
+
+        Locks are recursive within a process: a request for an
+        exclusive lock while a shared lock is held upgrades the lock
+        until the inner request is released. Because ``flock()`` locks
+        are shared by all threads of a process, a ``BoomLock`` also
+        holds the process-wide ``BoomContext`` lock: only one thread
+        holds a ``BoomLock`` or an active context at a time.
+
+        If the lock file cannot be opened (for example because the boom
+        directory is read-only) the operation proceeds without locking.
+    """
+
+    def __init__(self, exclusive=False, timeout=None):
+        """Initialise a new ``BoomLock``.
+
+            :param exclusive: ``True`` for an exclusive lock, or
+                              ``False`` for a shared lock.
+            :param timeout: The time in seconds to wait for the lock,
+                            or ``None`` to use the configured
+                            ``lock_timeout``. A negative value waits
+                            indefinitely.
+        """
+        self.exclusive = exclusive
+        self.timeout = timeout
+        self._path = None
+
+    def __enter__(self):
+        _acquire_context_lock()
+        try:
+            self._path = _acquire_lock(self.exclusive, self.timeout)
+        except Exception:
+            _release_context_lock()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self._path:
+                _release_lock(self._path)
+                self._path = None
+        finally:
+            _release_context_lock()
+        return False
+
+
 def parse_btrfs_subvol(subvol):
     """Parse a BTRFS subvolume string.
 
@@ -428,6 +1324,327 @@ def parse_btrfs_subvol(subvol):
     return subvol
 
 
+#
+# Selection expressions
+#
+
+#: Selection attributes that match by prefix rather than exact value.
+_PREFIX_ATTRS = frozenset(["boot_id", "os_id", "host_id"])
+
+#: Characters that cause a selection expression value to match as a
+#: shell-style glob pattern.
+_GLOB_CHARS = frozenset("*?[")
+
+#: Selection expression keywords.
+_EXPR_KEYWORDS = frozenset(["and", "or", "not", "in"])
+
+#: Selection expression token pattern: punctuation and operators
+#: (group 1), single or double quoted values (groups 2 and 3), or
+#: bare words (group 4).
+_EXPR_TOKEN = re.compile(r"\s*(?:(\(|\)|,|!=|=~|!~|=)|'([^']*)'|\"([^\"]*)\"|"
+                         r"([^\s()=!~,'\"]+))")
+
+
+def _tokenize_expr(expr):
+    """Split a selection expression into a list of tokens.
+
+        Each token is a ``(kind, text)`` tuple where ``kind`` is one of
+        ``"op"`` for punctuation and operators, ``"value"`` for quoted
+        strings, or ``"word"`` for bare words.
+
+        :param expr: The selection expression string.
+        :returns: A list of ``(kind, text)`` tuples.
+        :returntype: list
+        :raises: ValueError if ``expr`` contains an invalid token.
+    """
+    tokens = []
+    pos = 0
+    end = len(expr.rstrip())
+    while pos < end:
+        match = _EXPR_TOKEN.match(expr, pos)
+        if not match:
+            raise ValueError("Invalid selection expression at '%s'" %
+                             expr[pos:].strip())
+        (op, squote, dquote, word) = match.groups()
+        if op is not None:
+            tokens.append(("op", op))
+        elif word is not None:
+            tokens.append(("word", word))
+        else:
+            tokens.append(("value", squote if squote is not None else dquote))
+        pos = match.end()
+    return tokens
+
+
+def _value_matcher(attr, op, values):
+    """Build a function testing an attribute value against a condition.
+
+        :param attr: The ``Selection`` attribute name.
+        :param op: The comparison operator.
+        :param values: A list of values to compare against.
+        :returns: A function accepting an attribute value and returning
+                  ``True`` if the condition holds.
+    """
+    if op in ("=~", "!~"):
+        try:
+            patterns = [re.compile(v) for v in values]
+        except re.error as e:
+            raise ValueError("Invalid regular expression for %s: %s" %
+                             (attr, e))
+
+        def match(value):
+            return any(p.search(value) for p in patterns)
+    else:
+        exact = set(v for v in values if not _GLOB_CHARS.intersection(v))
+        patterns = [re.compile(fnmatch.translate(v)) for v in values
+                    if _GLOB_CHARS.intersection(v)]
+        if attr in _PREFIX_ATTRS:
+            prefixes = tuple(exact)
+
+            def match(value):
+                return (value.startswith(prefixes) or
+                        any(p.match(value) for p in patterns))
+        else:
+            def match(value):
+                return (value in exact or
+                        any(p.match(value) for p in patterns))
+
+    negate = op in ("!=", "!~")
+
+    def match_value(value):
+        if value is None:
+            return negate
+        if not isinstance(value, str):
+            value = str(value)
+        return match(value) != negate
+    return match_value
+
+
+class SelectionExpr(object):
+    """SelectionExpr(expr)
+        A compiled selection expression.
+
+        A selection expression combines conditions on ``Selection``
+        attributes using ``and``, ``or``, ``not`` and parentheses. Each
+        condition has the form ``attr OP value`` or
+        ``attr in (value, ...)``, where ``OP`` is one of:
+
+            ``=``   the value matches exactly (or by prefix for the
+                    ``boot_id``, ``os_id`` and ``host_id`` attributes).
+                    Values containing ``*``, ``?`` or ``[`` match as
+                    shell-style glob patterns.
+            ``!=``  the value does not match.
+            ``=~``  the value matches a regular expression.
+            ``!~``  the value does not match a regular expression.
+
+        An ``in`` list matches if any of its values matches as for
+        ``=``. Values containing white space or punctuation must be
+        quoted using single or double quotes. For example::
+
+            version=4.1[68].* and lvm_root_lv in (vg/lv0, vg/lv1)
+
+        The expression is parsed once: a predicate function is then
+        built for each type of object tested, using a map of attribute
+        accessor functions for that type. Predicates use three valued
+        logic: conditions on attributes that have no accessor are
+        unknown, and a predicate returns ``None`` if its result depends
+        on unknown conditions.
+    """
+
+    #: The original expression string
+    expr = None
+
+    #: The set of ``Selection`` attributes used by this expression
+    attrs = None
+
+    def __init__(self, expr):
+        """Parse a selection expression.
+
+            :param expr: The selection expression string.
+            :returns: A new ``SelectionExpr`` object.
+            :returntype: ``SelectionExpr``
+            :raises: ValueError if ``expr`` is not a valid expression.
+        """
+        self.expr = expr
+        self.attrs = set()
+        self._predicates = {}
+        self._tokens = _tokenize_expr(expr)
+        self._pos = 0
+        if not self._tokens:
+            raise ValueError("Empty selection expression")
+        self._tree = self.__parse_or()
+        if self._pos != len(self._tokens):
+            raise ValueError("Unexpected '%s' in selection expression" %
+                             self._tokens[self._pos][1])
+        del self._tokens
+
+    def __str__(self):
+        return self.expr
+
+    def __repr__(self):
+        return "SelectionExpr(%s)" % repr(self.expr)
+
+    def __getstate__(self):
+        """Return the state of this ``SelectionExpr`` for pickling.
+
+            Compiled predicates are closures that cannot be pickled:
+            only the source expression is stored.
+
+            :returns: The selection expression string.
+            :returntype: string
+        """
+        return self.expr
+
+    def __setstate__(self, state):
+        """Restore an unpickled ``SelectionExpr`` by parsing the
+            stored expression again.
+
+            :param state: The string returned by ``__getstate__()``.
+        """
+        self.__init__(state)
+
+    def __peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, None)
+
+    def __next(self, what):
+        if self._pos >= len(self._tokens):
+            raise ValueError("Selection expression ended, expected %s" %
+                             what)
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def __keyword(self, keyword):
+        (kind, text) = self.__peek()
+        if kind == "word" and text.lower() == keyword:
+            self._pos += 1
+            return True
+        return False
+
+    def __expect(self, op):
+        (kind, text) = self.__next("'%s'" % op)
+        if kind != "op" or text != op:
+            raise ValueError("Expected '%s' in selection expression, "
+                             "found '%s'" % (op, text))
+
+    def __value(self):
+        (kind, text) = self.__next("value")
+        if kind == "op":
+            raise ValueError("Expected value in selection expression, "
+                             "found '%s'" % text)
+        return text
+
+    def __parse_or(self):
+        terms = [self.__parse_and()]
+        while self.__keyword("or"):
+            terms.append(self.__parse_and())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def __parse_and(self):
+        terms = [self.__parse_not()]
+        while self.__keyword("and"):
+            terms.append(self.__parse_not())
+        return terms[0] if len(terms) == 1 else ("and", terms)
+
+    def __parse_not(self):
+        if self.__keyword("not"):
+            return ("not", self.__parse_not())
+        if self.__peek() == ("op", "("):
+            self._pos += 1
+            node = self.__parse_or()
+            self.__expect(")")
+            return node
+        return self.__parse_cond()
+
+    def __parse_cond(self):
+        (kind, attr) = self.__next("attribute name")
+        if kind != "word" or attr.lower() in _EXPR_KEYWORDS:
+            raise ValueError("Expected attribute name in selection "
+                             "expression, found '%s'" % attr)
+        if attr not in Selection.all_attrs:
+            raise ValueError("Unknown selection attribute: %s" % attr)
+        self.attrs.add(attr)
+
+        if self.__keyword("in"):
+            self.__expect("(")
+            values = [self.__value()]
+            while self.__peek() == ("op", ","):
+                self._pos += 1
+                values.append(self.__value())
+            self.__expect(")")
+            return ("cond", attr, _value_matcher(attr, "=", values))
+
+        (kind, op) = self.__next("operator")
+        if kind != "op" or op not in ("=", "!=", "=~", "!~"):
+            raise ValueError("Expected operator after '%s' in selection "
+                             "expression, found '%s'" % (attr, op))
+        return ("cond", attr, _value_matcher(attr, op, [self.__value()]))
+
+    def __compile(self, node, getters):
+        kind = node[0]
+        if kind == "cond":
+            (attr, match) = node[1:]
+            get = getters.get(attr)
+            if not get:
+                return lambda obj: None
+            return lambda obj: match(get(obj))
+
+        if kind == "not":
+            term = self.__compile(node[1], getters)
+
+            def _not(obj):
+                result = term(obj)
+                return None if result is None else not result
+            return _not
+
+        terms = [self.__compile(n, getters) for n in node[1]]
+        # The value that decides an 'and' or an 'or' on its own.
+        decisive = (kind == "or")
+
+        def _and_or(obj):
+            result = not decisive
+            for term in terms:
+                value = term(obj)
+                if value is decisive:
+                    return decisive
+                if value is None:
+                    result = None
+            return result
+        return _and_or
+
+    def predicate(self, getters):
+        """Return a predicate function testing objects of one type.
+
+            The ``getters`` argument maps ``Selection`` attribute names
+            to functions returning the corresponding value for an
+            object. Predicates are cached for each ``getters`` map, so
+            the map should be a long-lived object.
+
+            :param getters: A dictionary of attribute accessor functions.
+            :returns: A function returning ``True``, ``False``, or
+                      ``None`` (unknown) for an object.
+        """
+        key = id(getters)
+        if key not in self._predicates:
+            self._predicates[key] = (getters,
+                                     self.__compile(self._tree, getters))
+        return self._predicates[key][1]
+
+    def match(self, obj, getters):
+        """Test an object against this expression.
+
+            :param obj: The object to test.
+            :param getters: A dictionary of attribute accessor functions
+                            for the type of ``obj``.
+            :returns: ``False`` if ``obj`` does not match, or ``True``
+                      if it matches or the result is unknown.
+            :returntype: bool
+        """
+        return self.predicate(getters)(obj) is not False
+
+
 #
 # Selection criteria class
 #
@@ -437,46 +1654,30 @@ class Selection(object):
         Selection criteria for boom BootEntry, OsProfile and BootParams.
 
         Selection criteria specified as a simple boolean AND of all
-        criteria with a non-None value.
-    """
-
-    # BootEntry fields
-    boot_id = None
-    title = None
-    version = None
-    machine_id = None
-    linux = None
-    initrd = None
-    efi = None
-    options = None
-    devicetree = None
-
-    # BootParams fields
-    root_device = None
-    lvm_root_lv = None
-    btrfs_subvol_path = None
-    btrfs_subvol_id = None
-
-    # OsProfile fields
-    os_id = None
-    os_name = None
-    os_short_name = None
-    os_version = None
-    os_version_id = None
-    os_uname_pattern = None
-    os_kernel_pattern = None
-    os_initramfs_pattern = None
-    os_root_opts_lvm2 = None
-    os_root_opts_btrfs = None
-    os_options = None
-
-    # HostProfile fields
-    host_id = None
-    host_name = None
-    host_label = None
-    host_short_name = None
-    host_add_opts = None
-    host_del_opts = None
+        criteria with a non-None value, and an optional selection
+        expression (see ``SelectionExpr``).
+    """
+
+    __slots__ = (
+        # BootEntry fields
+        "boot_id", "title", "version", "machine_id", "linux", "initrd",
+        "efi", "options", "devicetree",
+
+        # BootParams fields
+        "root_device", "lvm_root_lv", "btrfs_subvol_path", "btrfs_subvol_id",
+
+        # OsProfile fields
+        "os_id", "os_name", "os_short_name", "os_version", "os_version_id",
+        "os_uname_pattern", "os_kernel_pattern", "os_initramfs_pattern",
+        "os_root_opts_lvm2", "os_root_opts_btrfs", "os_options",
+
+        # HostProfile fields
+        "host_id", "host_name", "host_label", "host_short_name",
+        "host_add_opts", "host_del_opts",
+
+        # Selection expression
+        "expr"
+    )
 
     #: Selection criteria applying to BootEntry objects
     entry_attrs = [
@@ -516,6 +1717,8 @@ class Selection(object):
         tail = ", "
         for attr in set(attrs):
             strval += "%s='%s'%s" % (attr, getattr(self, attr), tail)
+        if self.expr:
+            strval += "expr=%s%s" % (repr(str(self.expr)), tail)
         return strval.rstrip(tail)
 
     def __repr__(self):
@@ -530,7 +1733,26 @@ class Selection(object):
         """
         return "Selection(" + str(self) + ")"
 
-    def __init__(self, boot_id=None, title=title, version=version,
+    def __getstate__(self):
+        """Return the state of this ``Selection`` for pickling.
+
+            A class with ``__slots__`` has no ``__dict__``, and cannot
+            be pickled using protocols 0 and 1 without these methods.
+
+            :returns: A tuple of the ``Selection`` attribute values.
+            :returntype: tuple
+        """
+        return tuple(getattr(self, attr, None) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        """Restore the state of an unpickled ``Selection``.
+
+            :param state: A tuple returned by ``__getstate__()``.
+        """
+        for (attr, value) in zip(self.__slots__, state):
+            setattr(self, attr, value)
+
+    def __init__(self, boot_id=None, title=None, version=None,
                  machine_id=None, linux=None, initrd=None,
                  efi=None, root_device=None, lvm_root_lv=None,
                  btrfs_subvol_path=None, btrfs_subvol_id=None,
@@ -539,7 +1761,7 @@ class Selection(object):
                  os_uname_pattern=None, os_kernel_pattern=None,
                  os_initramfs_pattern=None, host_id=None,
                  host_name=None, host_label=None, host_short_name=None,
-                 host_add_opts=None, host_del_opts=None):
+                 host_add_opts=None, host_del_opts=None, expr=None):
         """Initialise a new Selection object.
 
             Initialise a new Selection object with the specified selection
@@ -571,8 +1793,11 @@ class Selection(object):
             :param host_short_name: The host short name to match
             :param host_add_opts: Host add options to match
             :param host_del_opts: Host del options to match
+            :param expr: A selection expression string or
+                         ``SelectionExpr`` to match
             :returns: A new Selection instance
             :returntype: Selection
+            :raises: ValueError if ``expr`` is not a valid expression
         """
         self.boot_id = boot_id
         self.title = title
@@ -581,6 +1806,8 @@ class Selection(object):
         self.linux = linux
         self.initrd = initrd
         self.efi = efi
+        self.options = None
+        self.devicetree = None
         self.root_device = root_device
         self.lvm_root_lv = lvm_root_lv
         self.btrfs_subvol_path = btrfs_subvol_path
@@ -594,12 +1821,32 @@ class Selection(object):
         self.os_uname_pattern = os_uname_pattern
         self.os_kernel_pattern = os_kernel_pattern
         self.os_initramfs_pattern = os_initramfs_pattern
+        self.os_root_opts_lvm2 = None
+        self.os_root_opts_btrfs = None
         self.host_id = host_id
         self.host_name = host_name
         self.host_label = host_label
         self.host_short_name = host_short_name
         self.host_add_opts = host_add_opts
         self.host_del_opts = host_del_opts
+        if expr and not isinstance(expr, SelectionExpr):
+            expr = SelectionExpr(expr)
+        self.expr = expr
+
+    @classmethod
+    def from_expr(cls, expr):
+        """Initialise Selection from a selection expression.
+
+            Construct a new ``Selection`` object that matches objects
+            using the selection expression in ``expr``. See
+            ``SelectionExpr`` for the expression syntax.
+
+            :param expr: A selection expression string.
+            :returns: A new Selection instance
+            :returntype: Selection
+            :raises: ValueError if ``expr`` is not a valid expression
+        """
+        return Selection(expr=SelectionExpr(expr))
 
     @classmethod
     def from_cmd_args(cls, args):
@@ -640,7 +1887,7 @@ class Selection(object):
                       os_version_id=args.os_version_id,
                       os_options=args.os_options,
                       os_uname_pattern=args.uname_pattern,
-                      host_id=args.host_profile)
+                      host_id=args.host_profile, expr=args.select)
 
         _log_debug("Initialised %s from arguments" % repr(s))
         return s
@@ -686,8 +1933,10 @@ class Selection(object):
         if host:
             valid_attrs += self.host_attrs
 
+        expr_attrs = self.expr.attrs if self.expr else set()
         for attr in self.all_attrs:
-            if self.__attr_has_value(attr) and attr not in valid_attrs:
+            in_use = self.__attr_has_value(attr) or attr in expr_attrs
+            if in_use and attr not in valid_attrs:
                 invalid_attrs.append(attr)
 
         if invalid_attrs:
@@ -706,7 +1955,7 @@ class Selection(object):
         """
         all_attrs = self.all_attrs
         attrs = [attr for attr in all_attrs if self.__attr_has_value(attr)]
-        return not any(attrs)
+        return not any(attrs) and not self.expr
 
 #
 # Generic routines for parsing name-value pairs.
@@ -726,6 +1975,49 @@ def blank_or_comment(line):
     return not line.strip() or line.lstrip().startswith('#')
 
 
+#: Characters permitted in the name of a name value pair.
+_VALID_NAME_CHARS = frozenset(string.ascii_letters + string.digits +
+                              "_-,.'\"")
+
+#: Compiled line patterns for ``tokenize_name_values()``, indexed by
+#: separator. Each pattern matches a blank line, a whole-line comment
+#: (group 1), or a name (group 2) and value (group 3). The value group
+#: starts immediately after the separator, as with ``str.split()``.
+_NAME_VALUE_LINE = {
+    "=": re.compile(r"\s*(?:(#.*)|([^=]*)=(.*))?$", re.S),
+    None: re.compile(r"\s*(?:(#.*)|(\S+)\s+(\S.*))?$", re.S)
+}
+
+
+def _check_name_value(nvp, name, value):
+    """Validate and clean up the parts of a split name value pair.
+
+        :param nvp: The original name value pair string.
+        :param name: The name part of ``nvp``.
+        :param value: The value part of ``nvp``.
+        :returns: A ``(name, value)`` tuple.
+        :returntype: (string, string) tuple.
+    """
+    # Value cannot start with '='
+    if value.startswith('='):
+        raise ValueError("Malformed name/value pair: %s" % nvp)
+
+    name = name.strip()
+    value = value.lstrip()
+
+    if "#" in value:
+        value, comment = value.split("#", 1)
+
+    if not _VALID_NAME_CHARS.issuperset(name):
+        bad_chars = [c for c in name if c not in _VALID_NAME_CHARS]
+        raise ValueError("Invalid characters in name: %s (%s)" %
+                         (name, bad_chars))
+
+    if value.startswith('"') or value.startswith("'"):
+        value = value[1:-1]
+    return (name, value)
+
+
 def parse_name_value(nvp, separator="="):
     """Parse a name value pair string.
 
@@ -741,33 +2033,65 @@ def parse_name_value(nvp, separator="="):
         :returns: A ``(name, value)`` tuple.
         :returntype: (string, string) tuple.
     """
-    val_err = ValueError("Malformed name/value pair: %s" % nvp)
     try:
         # Only strip newlines: values may contain embedded
         # whitespace anywhere within the string.
         name, value = nvp.rstrip('\n').split(separator, 1)
     except:
-        raise val_err
+        raise ValueError("Malformed name/value pair: %s" % nvp)
 
-    # Value cannot start with '='
-    if value.startswith('='):
-        raise val_err
+    return _check_name_value(nvp, name, value)
 
-    name = name.strip()
-    value = value.lstrip()
 
-    if "#" in value:
-        value, comment = value.split("#", 1)
+def tokenize_name_values(data, separator="="):
+    """Split a block of name value pair data into tokens.
 
-    valid_name_chars = string.ascii_letters + string.digits + "_-,.'\""
-    bad_chars = [c for c in name if c not in valid_name_chars]
-    if any(bad_chars):
-        raise ValueError("Invalid characters in name: %s (%s)" %
-                         (name, bad_chars))
+        Parse the name value pairs contained in the string ``data``,
+        applying the same rules as ``parse_name_value()`` to each line,
+        and return a list of ``(name, value, comment)`` tuples. The
+        ``comment`` element contains any blank and comment lines that
+        immediately precede the pair, or the empty string if there are
+        none. Blank and comment lines following the last pair are
+        discarded.
 
-    if value.startswith('"') or value.startswith("'"):
-        value = value[1:-1]
-    return (name, value)
+        :param data: A string containing name value pair lines.
+        :param separator: The separator character used in this data,
+                          either ``"="`` or ``None`` to split on white
+                          space.
+        :returns: A list of ``(name, value, comment)`` tuples.
+        :returntype: list
+    """
+    match_line = _NAME_VALUE_LINE[separator].match
+    tokens = []
+    comment = ""
+    for line in data.split("\n"):
+        match = match_line(line)
+        if not match:
+            raise ValueError("Malformed name/value pair: %s" % line)
+        (name, value) = match.group(2, 3)
+        if name is None:
+            comment += line + "\n"
+            continue
+        (name, value) = _check_name_value(line, name, value)
+        tokens.append((name, value, comment))
+        comment = ""
+    return tokens
+
+
+def read_name_values(path, separator="="):
+    """Read and tokenize a file containing name value pairs.
+
+        The file is read in a single call and the data split using
+        ``tokenize_name_values()``.
+
+        :param path: The path to the file to read.
+        :param separator: The separator character used in the file.
+        :returns: A list of ``(name, value, comment)`` tuples.
+        :returntype: list
+    """
+    with io_open(path, "r") as f:
+        data = f.read()
+    return tokenize_name_values(data, separator=separator)
 
 
 def find_minimum_sha_prefix(shas, min_prefix):
@@ -823,21 +2147,194 @@ def _get_machine_id():
         :returns: The ``machine_id`` as a string
         :returntype: str
     """
-    if path_exists(_MACHINE_ID):
-        path = _MACHINE_ID
-    elif path_exists(_DBUS_MACHINE_ID):
-        path = _DBUS_MACHINE_ID
-    else:
+    for path in (_MACHINE_ID, _DBUS_MACHINE_ID):
+        try:
+            f = io_open(path, "r")
+        except IOError as e:
+            if e.errno == ENOENT:
+                continue
+            raise
+        with f:
+            try:
+                machine_id = f.read().strip()
+            except Exception as e:
+                _log_error("Could not read machine-id from '%s': %s" %
+                           (path, e))
+                machine_id = None
+        return machine_id
+    return None
+
+#: Profile snapshot file extension
+PROFILE_SNAPSHOT_EXT = "snapshot"
+
+#: Profile snapshot format version
+PROFILE_SNAPSHOT_VERSION = 1
+
+
+def _snapshot_path(profiles_path):
+    """Return the path to the profile snapshot for ``profiles_path``.
+
+        The snapshot is stored alongside the profile directory, for
+        example ``/boot/boom/profiles.snapshot``.
+
+        :param profiles_path: Path to the on-disk profile directory.
+        :returns: The path to the snapshot file.
+        :returntype: str
+    """
+    return "%s.%s" % (profiles_path.rstrip("/"), PROFILE_SNAPSHOT_EXT)
+
+
+def _snapshot_stats(profiles_path, profile_ext):
+    """Return the directory modification time and the list of file
+        stats used to validate a profile snapshot.
+
+        :param profiles_path: Path to the on-disk profile directory.
+        :param profile_ext: Extension of profile files.
+        :returns: A ``(dir_mtime, files)`` tuple, where ``files`` is a
+                  list of ``[name, size, mtime, ino]`` lists sorted by
+                  file name.
+        :returntype: tuple
+    """
+    files = []
+    for pf in sorted(io_listdir(profiles_path)):
+        if not pf.endswith(".%s" % profile_ext):
+            continue
+        st = io_stat(path_join(profiles_path, pf))
+        files.append([pf, st.st_size, st.st_mtime, st.st_ino])
+    return (io_stat(profiles_path).st_mtime, files)
+
+
+def _snapshot_str(value):
+    """Convert unicode strings in decoded snapshot data to ``str``.
+
+        On Python 2 the ``json`` module returns all strings as
+        ``unicode``: convert them to native strings to match values
+        parsed from profile files.
+    """
+    if isinstance(value, dict):
+        return dict((_snapshot_str(k), _snapshot_str(v))
+                    for (k, v) in value.items())
+    if isinstance(value, list):
+        return [_snapshot_str(v) for v in value]
+    if not isinstance(value, str) and hasattr(value, "encode"):
+        return value.encode("utf8")
+    return value
+
+
+def _read_profile_snapshot(snapshot_path, dir_mtime, files):
+    """Read and validate a profile snapshot.
+
+        :param snapshot_path: The path to the snapshot file.
+        :param dir_mtime: The current profile directory mtime.
+        :param files: The current profile file stats.
+        :returns: The list of snapshot profile records, or ``None`` if
+                  the snapshot is missing, corrupt, or out of date.
+        :returntype: list
+    """
+    try:
+        with io_open(snapshot_path, "r") as sf:
+            snapshot = _snapshot_str(json.load(sf))
+    except (IOError, OSError, ValueError) as e:
+        if getattr(e, "errno", None) != ENOENT:
+            _log_info("Ignoring profile snapshot '%s': %s" %
+                      (snapshot_path, e))
         return None
 
-    with open(path, "r") as f:
-        try:
-            machine_id = f.read().strip()
-        except Exception as e:
-            _log_error("Could not read machine-id from '%s': %s" %
-                       (_MACHINE_ID, e))
-            machine_id = None
-    return machine_id
+    try:
+        if snapshot["version"] != PROFILE_SNAPSHOT_VERSION:
+            return None
+        if snapshot["dir_mtime"] != dir_mtime:
+            return None
+        if snapshot["files"] != files:
+            return None
+        return snapshot["profiles"]
+    except (KeyError, TypeError):
+        _log_info("Ignoring malformed profile snapshot '%s'" % snapshot_path)
+        return None
+
+
+def _write_profile_snapshot(snapshot_path, dir_mtime, files, profiles):
+    """Write a profile snapshot.
+
+        The snapshot is written to a temporary file and renamed into
+        place. Failure to write a snapshot is not an error: profiles
+        will be parsed from the profile directory on the next load.
+
+        :param snapshot_path: The path to the snapshot file.
+        :param dir_mtime: The profile directory mtime.
+        :param files: The profile file stats.
+        :param profiles: A list of ``(profile_file, profile)`` tuples.
+        :returns: None
+    """
+    snapshot = {
+        "version": PROFILE_SNAPSHOT_VERSION,
+        "dir_mtime": dir_mtime,
+        "files": files,
+        "profiles": [{
+            "file": pf,
+            "data": profile._profile_data,
+            "comments": profile._comments or {}
+        } for (pf, profile) in profiles]
+    }
+
+    tmp_path = None
+    try:
+        (tmp_fd, tmp_path) = io_mkstemp(prefix="%s." % PROFILE_SNAPSHOT_EXT,
+                                        dir=dirname(snapshot_path))
+        with fdopen(tmp_fd, "w") as f:
+            json.dump(snapshot, f, sort_keys=True)
+        io_rename(tmp_path, snapshot_path)
+    except (IOError, OSError) as e:
+        _log_info("Could not write profile snapshot '%s': %s" %
+                  (snapshot_path, e))
+        if tmp_path:
+            try:
+                io_unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def _have_profile_snapshot(profiles_path):
+    """Test whether a profile snapshot exists for ``profiles_path``.
+
+        The snapshot is not read or validated.
+
+        :param profiles_path: Path to the on-disk profile directory.
+        :returns: ``True`` if a snapshot file exists or ``False``
+                  otherwise.
+        :returntype: bool
+    """
+    return io_exists(_snapshot_path(profiles_path))
+
+
+def _find_profile_file(profiles_path, profile_id, profile_ext):
+    """Find the on-disk file for a single profile.
+
+        Profile files are named beginning with the full profile
+        identifier followed by a '-' character (for e.g.
+        ``BOOM_OS_PROFILE_FORMAT``): the file for ``profile_id`` is
+        found by listing ``profiles_path`` without opening or parsing
+        any profile file.
+
+        :param profiles_path: Path to the on-disk profile directory.
+        :param profile_id: The full identifier of the profile to find.
+        :param profile_ext: Extension of profile files.
+        :returns: The path to the profile file, or ``None`` if no file
+                  name matches ``profile_id``.
+        :returntype: str
+    """
+    prefix = profile_id + "-"
+    try:
+        file_names = io_list_files(profiles_path, "." + profile_ext)
+    except OSError as e:
+        _log_debug("Could not list profiles in '%s': %s" %
+                   (profiles_path, e))
+        return None
+    for file_name in sorted(file_names):
+        if file_name.startswith(prefix):
+            return path_join(profiles_path, file_name)
+    return None
+
 
 def load_profiles_for_class(profile_class, profile_type,
                             profiles_path, profile_ext):
@@ -853,6 +2350,15 @@ def load_profiles_for_class(profile_class, profile_type,
         specified to describe the profile type in error messages.
         If ``type`` is unset the class name is used instead.
 
+        If a valid snapshot of the profile directory exists it is
+        used in place of parsing the individual profile files. The
+        snapshot is validated against the directory modification
+        time and the size, mtime and inode of each profile file:
+        the profile files themselves remain authoritative. A new
+        snapshot is written when they are parsed while the exclusive
+        boom lock is held, so that commands that only read boom data
+        never modify the boom directory.
+
         This function is intended for use by profile implementations
         that share common on-disk profile handling.
 
@@ -863,18 +2369,43 @@ def load_profiles_for_class(profile_class, profile_type,
 
         :returns: None
     """
-    profile_files = listdir(profiles_path)
     _log_info("Loading %s profiles from %s" % (profile_type, profiles_path))
-    for pf in profile_files:
-        if not pf.endswith(".%s" % profile_ext):
-            continue
+    (dir_mtime, files) = _snapshot_stats(profiles_path, profile_ext)
+    snapshot_path = _snapshot_path(profiles_path)
+
+    snapshot = _read_profile_snapshot(snapshot_path, dir_mtime, files)
+    if snapshot is not None:
+        _log_debug("Loading %s profiles from snapshot '%s'" %
+                   (profile_type, snapshot_path))
+        try:
+            for record in snapshot:
+                profile_class._from_snapshot(record["data"],
+                                             record["comments"])
+            return
+        except (KeyError, TypeError, ValueError) as e:
+            # Discard any partially loaded state and re-parse.
+            _log_warn("Failed to load %s profiles from snapshot '%s': %s" %
+                      (profile_type, snapshot_path, e))
+            profile_class._drop_snapshot_profiles()
+
+    profiles = []
+    failed = False
+    for (pf, _, _, _) in files:
         pf_path = path_join(profiles_path, pf)
         try:
             profile = profile_class(profile_file=pf_path)
         except Exception as e:
             _log_warn("Failed to load %s from '%s': %s" %
                       (profile_class.__name__, pf_path, e))
+            failed = True
             continue
+        profiles.append((pf, profile))
+
+    # Do not snapshot a partial load: a profile that failed to load may
+    # become valid without any change to its own directory (for e.g. a
+    # HostProfile whose OsProfile is created later).
+    if not failed and _have_exclusive_lock():
+        _write_profile_snapshot(snapshot_path, dir_mtime, files, profiles)
 
 
 __all__ = [
@@ -901,13 +2432,16 @@ __all__ = [
     'FORMAT_KEYS',
 
     # API Classes
-    'BoomConfig', 'Selection',
+    'BoomConfig', 'Selection', 'SelectionExpr',
+    'BoomContext',
 
     # Path configuration
     'get_boot_path',
     'get_boom_path',
     'set_boot_path',
     'set_boom_path',
+    'get_entry_roots',
+    'set_entry_roots',
     'set_boom_config_path',
     'get_boom_config_path',
 
@@ -915,9 +2449,19 @@ __all__ = [
     'set_boom_config',
     'get_boom_config',
 
+    # String interning
+    'intern_string',
+
+    # Boom contexts
+    'get_boom_context',
+
     # boom exception base class
     'BoomError',
 
+    # Boom directory locking
+    'BOOM_LOCK_FILE', 'DEFAULT_LOCK_TIMEOUT',
+    'BoomLock', 'BoomLockError',
+
     # Boom logger class (used by test suite)
     'BoomLogger',
     # Debug logging
@@ -927,11 +2471,46 @@ __all__ = [
     'BOOM_DEBUG_ENTRY',
     'BOOM_DEBUG_REPORT',
     'BOOM_DEBUG_COMMAND',
+    'BOOM_DEBUG_PERF',
     'BOOM_DEBUG_ALL',
 
+    # Performance metrics
+    'PERF_CONFIG_LOAD', 'PERF_PROFILE_LOAD', 'PERF_HOST_LOAD',
+    'PERF_ENTRY_LOAD', 'PERF_MATCH', 'PERF_REPORT_BUILD',
+    'PERF_REPORT_SORT', 'PERF_REPORT_OUTPUT', 'PERF_WRITE',
+    'PERF_LEGACY_SYNC',
+    'PERF_FILES_OPENED', 'PERF_REGEX_COMPILED', 'PERF_SHA_COMPUTED',
+    'PERF_TEMPLATE_RENDERED', 'PERF_WRITES_ELIDED',
+    'PerfTimer',
+    'perf_enabled',
+    'perf_count',
+    'perf_add_time',
+    'reset_perf_metrics',
+    'get_perf_metrics',
+    'format_perf_metrics',
+
+    # Filesystem I/O accounting
+    'IO_OPEN', 'IO_STAT', 'IO_READ', 'IO_WRITE', 'IO_FSYNC', 'IO_RENAME',
+    'IO_UNLINK', 'IO_OPS',
+    'get_io_counts',
+    'reset_io_counts',
+    'io_open',
+    'io_mkstemp',
+    'io_listdir',
+    'io_list_files',
+    'io_stat',
+    'io_exists',
+    'io_fsync',
+    'io_sync_dir',
+    'io_rename',
+    'io_unlink',
+    'io_elide_write',
+
     # Utility routines
     'blank_or_comment',
     'parse_name_value',
+    'tokenize_name_values',
+    'read_name_values',
     'parse_btrfs_subvol',
     '_get_machine_id',
     'find_minimum_sha_prefix',
@@ -0,0 +1,276 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# aio.py - Boom asyncio interface
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+"""The ``boom.aio`` module provides asyncio equivalents of the boom
+entry, profile and legacy boot loader APIs.
+
+Each function in this module returns an awaitable future that resolves
+to the result of the corresponding synchronous boom call::
+
+    entries = await boom.aio.find_entries(Selection(version="4.16*"))
+
+Boom calls read and write files, call ``fdatasync()`` and may run the
+Grub1 shell. This module only moves these blocking calls off the event
+loop, so that it is never blocked: it does not make boom itself run
+concurrently.
+
+Boom keeps its profiles and entries in process-wide state, so all calls
+made through this module run in order on a single worker thread, and
+each call performs its file operations one after another. To create or
+edit many entries use ``create_entries()`` and ``edit_entries()``,
+which write all of the entries in a single batch with one
+synchronisation of the entries directory.
+
+Calls that modify boom data also take the exclusive boom directory lock
+(``BoomLock``), serialising them against other processes, while calls
+that only read data take the shared lock. Every function accepts an
+optional ``context`` argument: if set, the call runs with that
+``BoomContext`` active, allowing one event loop to manage several boot
+file systems.
+
+This module requires Python 3.4 or later.
+"""
+from __future__ import print_function
+
+from boom import *
+from boom.osprofile import find_profiles as _find_profiles
+from boom.hostprofile import find_host_profiles as _find_host_profiles
+from boom.bootloader import (load_entries as _load_entries,
+                             find_entries as _find_entries)
+from boom.command import (create_entry as _create_entry,
+                          create_entries as _create_entries,
+                          delete_entries as _delete_entries,
+                          clone_entry as _clone_entry,
+                          edit_entry as _edit_entry,
+                          edit_entries as _edit_entries)
+from boom.legacy import (write_legacy_loader as _write_legacy_loader,
+                         clear_legacy_loader as _clear_legacy_loader,
+                         sync_legacy_loader as _sync_legacy_loader,
+                         BOOM_LOADER_GRUB1)
+
+import logging
+
+# asyncio is available from Python 3.4.
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
+_log = logging.getLogger(__name__)
+
+_log_debug = _log.debug
+_log_info = _log.info
+_log_warn = _log.warning
+_log_error = _log.error
+
+#: The worker thread executor used for all boom calls.
+_executor = None
+
+
+def _get_executor():
+    """Return the boom worker executor, creating it if necessary.
+
+        :returns: The worker executor.
+        :returntype: ``ThreadPoolExecutor``
+    """
+    global _executor
+    if not _executor:
+        _executor = ThreadPoolExecutor(max_workers=1)
+    return _executor
+
+
+def shutdown(wait=True):
+    """Shut down the boom worker thread.
+
+        A new worker is started by the next call made through this
+        module.
+
+        :param wait: Wait for pending calls to complete.
+        :returns: None
+    """
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def _run(fn, args, kwargs, context=None, exclusive=False):
+    """Run ``fn(*args, **kwargs)`` on the boom worker thread.
+
+        :param fn: The boom function to call.
+        :param args: Positional arguments for ``fn``.
+        :param kwargs: Keyword arguments for ``fn``.
+        :param context: An optional ``BoomContext`` to activate.
+        :param exclusive: ``True`` if ``fn`` modifies boom data.
+        :returns: A future resolving to the result of ``fn``.
+        :returntype: ``asyncio.Future``
+        :raises: BoomError if asyncio is not available.
+    """
+    if not asyncio:
+        raise BoomError("boom.aio requires Python 3.4 or later")
+
+    def call():
+        with BoomLock(exclusive=exclusive):
+            return fn(*args, **kwargs)
+
+    def call_in_context():
+        with context:
+            return call()
+
+    _log_debug("Queueing %s call to %s()" %
+               ("exclusive" if exclusive else "shared", fn.__name__))
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(_get_executor(),
+                                call_in_context if context else call)
+
+
+#
+# Profile and entry queries
+#
+
+def find_profiles(selection=None, context=None):
+    """Asynchronous ``boom.osprofile.find_profiles()``.
+    """
+    return _run(_find_profiles, (), {"selection": selection}, context)
+
+
+def find_host_profiles(selection=None, context=None):
+    """Asynchronous ``boom.hostprofile.find_host_profiles()``.
+    """
+    return _run(_find_host_profiles, (), {"selection": selection}, context)
+
+
+def load_entries(machine_id=None, context=None):
+    """Asynchronous ``boom.bootloader.load_entries()``.
+    """
+    return _run(_load_entries, (), {"machine_id": machine_id}, context)
+
+
+def find_entries(selection=None, context=None):
+    """Asynchronous ``boom.bootloader.find_entries()``.
+    """
+    return _run(_find_entries, (), {"selection": selection}, context)
+
+
+#
+# Entry modification
+#
+
+def create_entry(*args, **kwargs):
+    """Asynchronous ``boom.command.create_entry()``.
+
+        Accepts the arguments of ``create_entry()`` and an optional
+        ``context`` keyword argument.
+    """
+    context = kwargs.pop("context", None)
+    return _run(_create_entry, args, kwargs, context, exclusive=True)
+
+
+def create_entries(specs, write=True, allow_no_dev=False, context=None):
+    """Asynchronous ``boom.command.create_entries()``.
+    """
+    kwargs = {"write": write, "allow_no_dev": allow_no_dev}
+    return _run(_create_entries, (specs,), kwargs, context, exclusive=True)
+
+
+def delete_entries(selection=None, context=None):
+    """Asynchronous ``boom.command.delete_entries()``.
+    """
+    return _run(_delete_entries, (), {"selection": selection}, context,
+                exclusive=True)
+
+
+def clone_entry(*args, **kwargs):
+    """Asynchronous ``boom.command.clone_entry()``.
+
+        Accepts the arguments of ``clone_entry()`` and an optional
+        ``context`` keyword argument.
+    """
+    context = kwargs.pop("context", None)
+    return _run(_clone_entry, args, kwargs, context, exclusive=True)
+
+
+def edit_entry(*args, **kwargs):
+    """Asynchronous ``boom.command.edit_entry()``.
+
+        Accepts the arguments of ``edit_entry()`` and an optional
+        ``context`` keyword argument.
+    """
+    context = kwargs.pop("context", None)
+    return _run(_edit_entry, args, kwargs, context, exclusive=True)
+
+
+def edit_entries(*args, **kwargs):
+    """Asynchronous ``boom.command.edit_entries()``.
+
+        Accepts the arguments of ``edit_entries()`` and an optional
+        ``context`` keyword argument.
+    """
+    context = kwargs.pop("context", None)
+    return _run(_edit_entries, args, kwargs, context, exclusive=True)
+
+
+#
+# Legacy boot loader synchronisation
+#
+
+def write_legacy_loader(selection=None, loader=BOOM_LOADER_GRUB1,
+                        cfg_path=None, context=None):
+    """Asynchronous ``boom.legacy.write_legacy_loader()``.
+    """
+    kwargs = {"selection": selection, "loader": loader, "cfg_path": cfg_path}
+    return _run(_write_legacy_loader, (), kwargs, context, exclusive=True)
+
+
+def clear_legacy_loader(loader=BOOM_LOADER_GRUB1, cfg_path=None,
+                        context=None):
+    """Asynchronous ``boom.legacy.clear_legacy_loader()``.
+    """
+    kwargs = {"loader": loader, "cfg_path": cfg_path}
+    return _run(_clear_legacy_loader, (), kwargs, context, exclusive=True)
+
+
+def sync_legacy_loader(selection=None, loader=BOOM_LOADER_GRUB1,
+                       cfg_path=None, context=None):
+    """Asynchronous ``boom.legacy.sync_legacy_loader()``.
+    """
+    kwargs = {"selection": selection, "loader": loader, "cfg_path": cfg_path}
+    return _run(_sync_legacy_loader, (), kwargs, context, exclusive=True)
+
+
+__all__ = [
+    # Worker management
+    'shutdown',
+
+    # Profile and entry queries
+    'find_profiles',
+    'find_host_profiles',
+    'load_entries',
+    'find_entries',
+
+    # Entry modification
+    'create_entry',
+    'create_entries',
+    'delete_entries',
+    'clone_entry',
+    'edit_entry',
+    'edit_entries',
+
+    # Legacy boot loader synchronisation
+    'write_legacy_loader',
+    'clear_legacy_loader',
+    'sync_legacy_loader'
+]
+
+# vim: set et ts=4 sw=4 :
@@ -41,13 +41,18 @@ from __future__ import print_function
 
 from boom import *
 from boom.osprofile import *
-from boom.hostprofile import find_host_profiles
+from boom.osprofile import _profile_expr_getters
+from boom._boom import _register_context_state
+from boom.hostprofile import (find_host_profiles, get_host_profile_by_host_id,
+                              HostProfile, BOOM_HOST_ID)
 
-from os.path import basename, exists as path_exists, join as path_join
-from tempfile import mkstemp
-from os import listdir, rename, fdopen, chmod, unlink, fdatasync, stat, dup
+from os.path import basename, dirname, join as path_join
+from os import fdopen, chmod, dup, close
 from stat import S_ISBLK
+from errno import ENOENT
 from hashlib import sha1
+from operator import attrgetter, itemgetter
+from threading import Thread
 import logging
 import re
 
@@ -60,6 +65,13 @@ BOOT_ENTRIES_FORMAT = "%s-%s-%s.conf"
 #: A regular expression matching the boom file name format.
 BOOT_ENTRIES_PATTERN = r"(\w*)-(\w{1,7})-([a-zA-Z0-9.\-_]*)"
 
+#: Compiled pattern matching a complete boom entry file name. Only
+#: names with a full seven digit hexadecimal boot_id field are matched,
+#: so that foreign BLS files such as ``<machine_id>-0-rescue.conf`` are
+#: never excluded by file name.
+_entry_file_name_re = re.compile(r"(\w*)-([0-9a-f]{7})-"
+                                 r"([a-zA-Z0-9.\-_]*)\.conf$")
+
 #: The file mode with which BLS entries should be created.
 BOOT_ENTRY_MODE = 0o644
 
@@ -124,6 +136,9 @@ def __make_map_key(key_map):
 #: Map BLS entry keys to Boom names
 MAP_KEY = __make_map_key(KEY_MAP)
 
+#: Entry keys whose values repeat across entries and are interned.
+_INTERN_KEYS = frozenset(k for k in ENTRY_KEYS if k != BOOM_ENTRY_TITLE)
+
 # Module logging configuration
 _log = logging.getLogger(__name__)
 _log.set_debug_mask(BOOM_DEBUG_ENTRY)
@@ -134,19 +149,42 @@ _log_info = _log.info
 _log_warn = _log.warning
 _log_error = _log.error
 
-#: The global list of boot entries.
+#: The global list of boot entries, or ``None`` if entries have not
+#: been loaded. An empty list means that the entries directory holds
+#: no entries.
 _entries = None
 
+#: Reverse index of loaded entries by ``os_id`` and ``host_id``.
+_profile_index = None
+
+#: The profile identifiers under which each entry is indexed.
+_profile_index_keys = {}
+
+#: Entry keys that may be rendered from profile templates.
+_PROFILE_KEYS = [BOOM_ENTRY_LINUX, BOOM_ENTRY_INITRD, BOOM_ENTRY_OPTIONS]
+
 #: Pattern for forming root device paths from LVM2 names.
 DEV_PATTERN = "/dev/%s"
 
+def boom_entries_paths():
+    """Return the paths to the boot entry directories of each entry
+        root returned by ``get_entry_roots()``.
+
+        :returns: A list of boot entry directory paths.
+        :returntype: list
+    """
+    return [path_join(root, ENTRIES_PATH) for root in get_entry_roots()]
+
+
 def boom_entries_path():
-    """Return the path to the boom profiles directory.
+    """Return the path to the boot entries directory to which new
+        entries are written: the entries directory of the first entry
+        root.
 
-        :returns: The boom profiles path.
+        :returns: The boom entries path.
         :returntype: str
     """
-    return path_join(get_boot_path(), ENTRIES_PATH)
+    return boom_entries_paths()[0]
 
 
 #: Private constants for Grub2 integration checks
@@ -165,17 +203,17 @@ def check_bootloader():
     boot_path = get_boot_path()
 
     grub_cfg = path_join(boot_path, __grub_cfg)
-    if not path_exists(grub_cfg):
+    if not io_exists(grub_cfg):
         _log_warn("No Grub2 configuration file found")
         return False
 
     boom_grub_d = path_join(boot_path, __etc_grub_d, __boom_grub_d)
-    if not path_exists(boom_grub_d):
+    if not io_exists(boom_grub_d):
         _log_warn("Boom grub2 script missing from '%s'" % __etc_grub_d)
         return False
 
     defaults_file = path_join(boot_path, __etc_default, __boom_defaults)
-    if not path_exists(defaults_file):
+    if not io_exists(defaults_file):
         _log_warn("Boom configuration file missing from '%s'" % defaults_file)
         return False
 
@@ -183,7 +221,7 @@ def check_bootloader():
         return val == "y" or val == "yes"
 
     submenu_enabled = False
-    with open(defaults_file, "r") as dfile:
+    with io_open(defaults_file, "r") as dfile:
         for line in dfile:
             (name, value) = parse_name_value(line)
             if name == "BOOM_ENABLE_GRUB" and not is_yes(value):
@@ -198,7 +236,7 @@ def check_bootloader():
     found_boom_grub = False
     found_bls = False
     blscfg = "blscfg"
-    with open(grub_cfg) as gfile:
+    with io_open(grub_cfg) as gfile:
         for line in gfile:
             words = line.split()
             if blscfg in line:
@@ -229,46 +267,225 @@ def check_root_device(dev):
         :raises: BoomRootDeviceError if ``dev`` is invalid.
         :returns: None
     """
-    if not path_exists(dev):
-        raise BoomRootDeviceError("Device '%s' not found." % dev)
-
-    st = stat(dev)
+    try:
+        st = io_stat(dev)
+    except OSError as e:
+        if e.errno == ENOENT:
+            raise BoomRootDeviceError("Device '%s' not found." % dev)
+        raise
     if not S_ISBLK(st.st_mode):
         raise BoomRootDeviceError("Path '%s' is not a block device." % dev)
 
 
-class BootParams(object):
-    """The ``BootParams`` class encapsulates the information needed to
-        boot an instance of the operating system: the kernel version,
-        root device, and root device options.
+def _opt_name(opt):
+    """Return the name of kernel option ``opt``: the part of a
+        ``name=value`` option before the first '='.
+    """
+    return opt.split("=", 1)[0]
 
-        A ``BootParams`` object is used to configure a ``BootEntry``
-        and to generate configuration keys for the entry based on an
-        attached OsProfile.
+
+class KernelCmdline(object):
+    """The ``KernelCmdline`` class represents a parsed kernel command
+        line: an ordered sequence of options of the form ``name`` or
+        ``name=value``.
+
+        Options are indexed by their full text and by name, so that
+        appending, testing for and removing an option, or all options
+        with a given name, take constant time regardless of the length
+        of the command line. Options are always kept in the order in
+        which they were added, and repeated options are preserved.
     """
-    #: The kernel version of the instance.
-    _version = None
+    __slots__ = (
+        # Map of sequence number to option: sequence numbers increase
+        # in command line order (collections.OrderedDict is not
+        # available on Python 2.6).
+        "_opts",
+        # Map of option to the set of its sequence numbers.
+        "_words",
+        # Map of option name to the set of its sequence numbers.
+        "_names",
+        # The next option sequence number.
+        "_seq"
+    )
+
+    def __init__(self, opts=None):
+        """Initialise a new ``KernelCmdline``.
+
+            :param opts: An optional space-separated option string, or
+                         list of option strings.
+            :returns: A new ``KernelCmdline`` object.
+            :returntype: KernelCmdline
+        """
+        self._opts = {}
+        self._words = {}
+        self._names = {}
+        self._seq = 0
+        if opts:
+            self.extend(opts.split() if hasattr(opts, "split") else opts)
+
+    def __str__(self):
+        """Format this ``KernelCmdline`` as a kernel command line.
+
+            :returns: A space-separated option string.
+            :returntype: str
+        """
+        return " ".join(self.__ordered())
+
+    def __repr__(self):
+        return 'KernelCmdline("%s")' % self
+
+    def __ordered(self):
+        """Return the options of this ``KernelCmdline`` in command line
+            order.
+
+            :returns: A list of option strings.
+            :returntype: list
+        """
+        return [self._opts[seq] for seq in sorted(self._opts)]
+
+    def __iter__(self):
+        return iter(self.__ordered())
+
+    def __len__(self):
+        return len(self._opts)
+
+    def __contains__(self, opt):
+        """Test whether the option ``opt`` is present.
+
+            :param opt: The complete option string to test for.
+            :returns: ``True`` if ``opt`` is present or ``False``
+                      otherwise.
+            :returntype: bool
+        """
+        return opt in self._words
+
+    def has_name(self, name):
+        """Test whether any option named ``name`` is present.
+
+            :param name: The option name to test for.
+            :returns: ``True`` if an option named ``name`` is present
+                      or ``False`` otherwise.
+            :returntype: bool
+        """
+        return name in self._names
+
+    def get(self, name):
+        """Return the options named ``name``.
+
+            :param name: The option name to look up.
+            :returns: A list of the matching options in command line
+                      order.
+            :returntype: list
+        """
+        return [self._opts[seq] for seq in sorted(self._names.get(name, ()))]
+
+    def append(self, opt):
+        """Append the option ``opt`` to this command line.
+
+            :param opt: The option string to append.
+            :returntype: None
+        """
+        seq = self._seq
+        self._seq += 1
+        self._opts[seq] = opt
+        self._words.setdefault(opt, set()).add(seq)
+        self._names.setdefault(_opt_name(opt), set()).add(seq)
+
+    def add(self, opt):
+        """Append the option ``opt`` if it is not already present.
+
+            :param opt: The option string to add.
+            :returntype: None
+        """
+        if opt not in self._words:
+            self.append(opt)
+
+    def extend(self, opts):
+        """Append each option in the list ``opts``.
+
+            :param opts: A list of option strings.
+            :returntype: None
+        """
+        for opt in opts:
+            self.append(opt)
+
+    def __discard(self, seqs):
+        """Remove the options with sequence numbers in ``seqs``.
+        """
+        for seq in seqs:
+            opt = self._opts.pop(seq)
+            for (index, key) in ((self._words, opt),
+                                 (self._names, _opt_name(opt))):
+                index[key].discard(seq)
+                if not index[key]:
+                    del index[key]
+
+    def remove(self, opt):
+        """Remove all occurrences of the option ``opt``.
+
+            :param opt: The complete option string to remove.
+            :returntype: None
+        """
+        if opt in self._words:
+            self.__discard(list(self._words[opt]))
 
-    #: The path to the root device
-    _root_device = None
+    def remove_name(self, name):
+        """Remove all options named ``name``, regardless of value.
 
-    #: The LVM2 logical volume containing the root file system
-    _lvm_root_lv = None
+            :param name: The option name to remove.
+            :returntype: None
+        """
+        if name in self._names:
+            self.__discard(list(self._names[name]))
+
+    def drop(self, spec):
+        """Drop options matching the drop specification ``spec``.
 
-    #: The BTRFS subvolume path to be used as the root file system.
-    _btrfs_subvol_path = None
+            A drop specification matches either a simple name, a name
+            and its full value (in which case both must match), or a
+            name followed by '=', indicating that the option should be
+            dropped regardless of its value::
 
-    #: The ID of the BTRFS subvolume to be used as the root file system.
-    _btrfs_subvol_id = None
+                <name>         drop name
+                <name>=        drop name and any value
+                <name>=<value> drop name only if its value == value
 
-    #: A list of additional kernel options to append
-    _add_opts = []
+            :param spec: The drop specification.
+            :returntype: None
+        """
+        if spec.endswith("="):
+            self.remove_name(spec[:-1])
+        else:
+            self.remove(spec)
 
-    #: A list of kernel options to drop
-    _del_opts = []
 
-    #: Generation counter for dirty detection
-    generation = 0
+class BootParams(object):
+    """The ``BootParams`` class encapsulates the information needed to
+        boot an instance of the operating system: the kernel version,
+        root device, and root device options.
+
+        A ``BootParams`` object is used to configure a ``BootEntry``
+        and to generate configuration keys for the entry based on an
+        attached OsProfile.
+    """
+    __slots__ = (
+        # The kernel version of the instance.
+        "_version",
+        # The path to the root device
+        "_root_device",
+        # The LVM2 logical volume containing the root file system
+        "_lvm_root_lv",
+        # The BTRFS subvolume path to be used as the root file system.
+        "_btrfs_subvol_path",
+        # The ID of the BTRFS subvolume to be used as the root file system.
+        "_btrfs_subvol_id",
+        # A list of additional kernel options to append
+        "_add_opts",
+        # A list of kernel options to drop
+        "_del_opts",
+        # Generation counter for dirty detection
+        "generation"
+    )
 
     def __str(self, quote=False, prefix="", suffix=""):
         """Format BootParams as a string.
@@ -330,6 +547,25 @@ class BootParams(object):
         """
         return self.__str(quote=True, prefix="BootParams(", suffix=")")
 
+    def __getstate__(self):
+        """Return the state of this ``BootParams`` for pickling.
+
+            :returns: A tuple of the ``BootParams`` values.
+            :returntype: tuple
+        """
+        return (self._version, self._root_device, self._lvm_root_lv,
+                self._btrfs_subvol_path, self._btrfs_subvol_id,
+                self._add_opts, self._del_opts, self.generation)
+
+    def __setstate__(self, state):
+        """Restore the state of an unpickled ``BootParams``.
+
+            :param state: A tuple returned by ``__getstate__()``.
+        """
+        (self._version, self._root_device, self._lvm_root_lv,
+         self._btrfs_subvol_path, self._btrfs_subvol_id,
+         self._add_opts, self._del_opts, self.generation) = state
+
     def __init__(self, version, root_device=None, lvm_root_lv=None,
                  btrfs_subvol_path=None, btrfs_subvol_id=None,
                  add_opts=None, del_opts=None):
@@ -381,6 +617,12 @@ class BootParams(object):
         if not version:
             raise ValueError("version argument is required.")
 
+        self.generation = 0
+        self._root_device = None
+        self._lvm_root_lv = None
+        self._btrfs_subvol_path = None
+        self._btrfs_subvol_id = None
+
         self.version = version
 
         if root_device:
@@ -420,7 +662,7 @@ class BootParams(object):
         """Set this ``BootParams`` object's version.
         """
         self.generation += 1
-        self._version = value
+        self._version = intern_string(value)
 
     @property
     def root_device(self):
@@ -433,7 +675,7 @@ class BootParams(object):
         """Set this ``BootParams`` object's root_device.
         """
         self.generation += 1
-        self._root_device = value
+        self._root_device = intern_string(value)
 
     @property
     def lvm_root_lv(self):
@@ -446,7 +688,7 @@ class BootParams(object):
         """Set this ``BootParams`` object's lvm_root_lv.
         """
         self.generation += 1
-        self._lvm_root_lv = value
+        self._lvm_root_lv = intern_string(value)
 
     @property
     def btrfs_subvol_path(self):
@@ -485,6 +727,8 @@ class BootParams(object):
         """Set this ``BootParams`` object's add_opts.
         """
         self.generation += 1
+        if value:
+            value = [intern_string(opt) for opt in value]
         self._add_opts = value
 
     @property
@@ -498,6 +742,8 @@ class BootParams(object):
         """Set this ``BootParams`` object's del_opts.
         """
         self.generation += 1
+        if value:
+            value = [intern_string(opt) for opt in value]
         self._del_opts = value
 
     def has_btrfs(self):
@@ -555,11 +801,11 @@ class BootParams(object):
                          len(opts_regexes))
         _log_debug_entry("Options regex list: %s" % str(opts_regexes))
 
-        opts_matched = []
+        words = be.options.split()
         for rgx_word in opts_regexes:
             (name, exp) = rgx_word
             value = ""
-            for word in be.options.split():
+            for word in words:
                 match = re.search(exp, word) if name else re.match(exp, word)
                 if match:
                     matches[word] = True
@@ -567,7 +813,10 @@ class BootParams(object):
                         value = match.group(1)
                         _log_debug_entry("Matched: '%s' (%s)" %
                                          (value, name))
-                    setattr(bp, name, value)
+                    # Only BootParams properties are recovered: other
+                    # named patterns (for e.g. kernel) are matched only.
+                    if isinstance(getattr(cls, name, None), property):
+                        setattr(bp, name, value)
                     continue
 
             # The root_device key is handled specially since it is required
@@ -577,11 +826,13 @@ class BootParams(object):
                           % be.boot_id)
                 setattr(bp, name, "")
 
+        matched = KernelCmdline(list(matches))
+
         def is_add(opt):
             """Return ``True`` if ``opt`` was appended to this options line,
                 and was not generated from an ``OsProfile`` template.
             """
-            return opt not in matches.keys()
+            return opt not in matched
 
         def is_del(opt):
             """Return ``True`` if the option regex `opt` has been deleted
@@ -598,15 +849,16 @@ class BootParams(object):
             """
             # Ignore optional boot parameters
             ignore_bp = ['rootflags', 'rd.lvm.lv', 'subvol', 'subvolid']
-            opt_name = opt.split('=')[0]
-            matched_opts = [k.split('=')[0] for k in matches.keys()]
-            if opt_name not in matched_opts and opt_name not in ignore_bp:
+            opt_name = _opt_name(opt)
+            if not matched.has_name(opt_name) and opt_name not in ignore_bp:
                 return True
             return False
 
-        # Compile list of unique non-template options
-        bp.add_opts = [opt for opt in be.options.split() if is_add(opt)]
-        bp.add_opts = list(set(bp.add_opts))
+        # Compile list of unique non-template options, in order
+        add_opts = KernelCmdline()
+        for opt in [opt for opt in words if is_add(opt)]:
+            add_opts.add(opt)
+        bp.add_opts = list(add_opts)
 
         # Compile list of deleted template options
         bp.del_opts = [o for o in [r[1] for r in opts_regexes] if is_del(o)]
@@ -618,22 +870,272 @@ class BootParams(object):
 def _add_entry(entry):
     """Add a new entry to the list of loaded on-disk entries.
 
+        If entries are not in memory the entry is not added: the next
+        load, or a search by ``boot_id``, ``machine_id`` or
+        ``version``, will read the new entry from disk. Registering a
+        new entry never requires the existing entries to be loaded.
+
         :param entry: The ``BootEntry`` to add.
     """
     global _entries
     if _entries is None:
-        load_entries()
+        # Adding the entry here would leave a partial list.
+        return
     if entry not in _entries:
         _entries.append(entry)
+    # The entry's profile may have changed since it was indexed.
+    _index_entry(entry)
 
 
 def _del_entry(entry):
     """Remove a ``BootEntry`` from the list of loaded entries.
 
+        Entries returned by a pruned ``find_entries()`` search are not
+        added to the list of loaded entries: removing an entry that is
+        not present is not an error.
+
         :param entry: The ``BootEntry`` to remove.
     """
     global _entries
-    _entries.remove(entry)
+    if _entries and entry in _entries:
+        _entries.remove(entry)
+        _unindex_entry(entry)
+
+
+def _entry_profile_ids(be):
+    """Return the profile identifiers used by a ``BootEntry``.
+
+        An entry using a ``HostProfile`` depends on both the host
+        profile and the ``OsProfile`` that it wraps.
+
+        :param be: The ``BootEntry`` to examine.
+        :returns: A tuple of ``os_id`` and ``host_id`` values.
+        :returntype: tuple
+    """
+    osp = be._osp
+    if not osp:
+        return ()
+    if isinstance(osp, HostProfile):
+        return (osp.host_id, osp.os_id)
+    return (osp.os_id,)
+
+
+def _index_entry(be):
+    """Add or update a ``BootEntry`` in the profile reverse index.
+
+        :param be: The ``BootEntry`` to index.
+        :returns: None
+    """
+    if _profile_index is None:
+        return
+    _unindex_entry(be)
+    keys = _entry_profile_ids(be)
+    for key in keys:
+        _profile_index.setdefault(key, []).append(be)
+    _profile_index_keys[id(be)] = keys
+
+
+def _unindex_entry(be):
+    """Remove a ``BootEntry`` from the profile reverse index.
+
+        :param be: The ``BootEntry`` to remove.
+        :returns: None
+    """
+    if _profile_index is None:
+        return
+    for key in _profile_index_keys.pop(id(be), ()):
+        _profile_index[key] = [e for e in _profile_index[key] if e is not be]
+
+
+def find_profile_entries(profile):
+    """Find the loaded boot entries that use a profile.
+
+        Return the ``BootEntry`` objects rendered from ``profile``. For
+        an ``OsProfile`` this includes entries that use a
+        ``HostProfile`` wrapping the ``OsProfile``.
+
+        Entries are loaded from disk if they are not already in memory,
+        and a reverse index from profile identifiers to entries is built
+        on first use and then maintained as entries are added, written
+        and removed.
+
+        :param profile: An ``OsProfile`` or ``HostProfile``.
+        :returns: A list of ``BootEntry`` objects.
+        :returntype: list
+    """
+    global _profile_index, _profile_index_keys
+    if _entries is None:
+        load_entries()
+    if _profile_index is None:
+        _profile_index = {}
+        _profile_index_keys = {}
+        for be in _entries or []:
+            _index_entry(be)
+
+    if isinstance(profile, HostProfile):
+        key = profile.host_id
+    else:
+        key = profile.os_id
+
+    # Skip entries whose profile has changed since they were indexed.
+    return [be for be in _profile_index.get(key, [])
+            if key in _entry_profile_ids(be)]
+
+
+def _parse_entry_file_name(file_name):
+    """Split a boom entry file name into its component parts.
+
+        :param file_name: The entry file name to parse.
+        :returns: A ``(machine_id, boot_id, version)`` tuple, where
+                  ``boot_id`` is the boot_id prefix used in the file
+                  name, or ``None`` if ``file_name`` does not strictly
+                  follow the boom file name format.
+        :returntype: tuple
+    """
+    match = _entry_file_name_re.match(file_name)
+    return match.groups() if match else None
+
+
+#: Selection expression accessors for parsed entry file names.
+_entry_file_expr_getters = {
+    "machine_id": itemgetter(0),
+    "version": itemgetter(2)
+}
+
+
+def _entry_file_may_match(file_name, machine_id=None, version=None,
+                          boot_id=None, expr=None):
+    """Test whether an entry file may match selection criteria using
+        only its file name.
+
+        Files that do not use the boom file name format cannot be
+        excluded, and always return ``True``.
+
+        :param file_name: The entry file name to test.
+        :param machine_id: An optional ``machine_id`` to match.
+        :param version: An optional ``version`` to match.
+        :param boot_id: An optional ``boot_id`` or prefix to match.
+        :param expr: An optional ``SelectionExpr`` to match.
+        :returns: ``False`` if the file cannot match, or ``True``
+                  otherwise.
+        :returntype: bool
+    """
+    parts = _parse_entry_file_name(file_name)
+    if not parts:
+        return True
+    (file_machine_id, file_boot_id, file_version) = parts
+    if machine_id and file_machine_id != machine_id:
+        return False
+    if version and file_version != version:
+        return False
+    if boot_id and not file_boot_id.startswith(boot_id[:len(file_boot_id)]):
+        return False
+    if expr and not expr.match(parts, _entry_file_expr_getters):
+        return False
+    return True
+
+
+def _selection_prunes_files(selection):
+    """Test whether a selection can exclude entry files by file name.
+
+        :param selection: The ``Selection`` to test.
+        :returns: ``True`` if ``selection`` includes criteria that can be
+                  tested using entry file names, or ``False`` otherwise.
+        :returntype: bool
+    """
+    if selection.machine_id or selection.version or selection.boot_id:
+        return True
+    if selection.expr:
+        return any(attr in _entry_file_expr_getters
+                   for attr in selection.expr.attrs)
+    return False
+
+
+def _list_entry_files():
+    """List the entry files in every boot entries directory.
+
+        When more than one entry root is configured the directories
+        are listed concurrently, since each root is normally a separate
+        file system. A missing entries directory in any root but the
+        first is logged and skipped.
+
+        :returns: A list of ``(entries_path, file_names)`` tuples, in
+                  entry root order.
+        :returntype: list
+    """
+    entries_paths = boom_entries_paths()
+    listings = [None] * len(entries_paths)
+
+    def list_entries_path(index):
+        try:
+            listings[index] = io_list_files(entries_paths[index], ".conf")
+        except Exception as e:
+            listings[index] = e
+
+    if len(entries_paths) > 1:
+        threads = [Thread(target=list_entries_path, args=(index,))
+                   for index in range(len(entries_paths))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        list_entries_path(0)
+
+    entry_files = []
+    for (index, listing) in enumerate(listings):
+        if isinstance(listing, Exception):
+            if not index:
+                raise listing
+            _log_warn("Could not list boot entries in '%s': %s" %
+                      (entries_paths[index], listing))
+            continue
+        entry_files.append((entries_paths[index], listing))
+    return entry_files
+
+
+def _iter_entry_files(entry_files):
+    """Load ``BootEntry`` objects from a sequence of entry files,
+        yielding each entry as it is loaded.
+
+        Files that cannot be loaded are logged and skipped, as are
+        files containing an entry with a ``boot_id`` that has already
+        been loaded. An entry found in more than one entry root is
+        loaded from the first root, and a warning is logged.
+
+        :param entry_files: A list of ``(entries_path, file_names)``
+                            tuples as returned by ``_list_entry_files()``.
+        :returns: A generator yielding ``BootEntry`` objects.
+    """
+    boot_ids = {}
+    for (entries_path, file_names) in entry_files:
+        for file_name in file_names:
+            entry_path = path_join(entries_path, file_name)
+            try:
+                be = BootEntry(entry_file=entry_path)
+            except Exception as e:
+                _log_info("Could not load BootEntry '%s': %s" %
+                          (entry_path, e))
+                continue
+            if be.boot_id in boot_ids:
+                if boot_ids[be.boot_id] != entries_path:
+                    _log_warn("Duplicate boot_id '%s' in '%s' and '%s'" %
+                              (be.disp_boot_id, boot_ids[be.boot_id],
+                               entries_path))
+                continue
+            boot_ids[be.boot_id] = entries_path
+            yield be
+
+
+def _load_entry_files(entry_files):
+    """Load ``BootEntry`` objects from a list of entry files.
+
+        :param entry_files: A list of ``(entries_path, file_names)``
+                            tuples as returned by ``_list_entry_files()``.
+        :returns: A list of ``BootEntry`` objects.
+        :returntype: list
+    """
+    return list(_iter_entry_files(entry_files))
 
 
 def drop_entries():
@@ -644,42 +1146,48 @@ def drop_entries():
 
         :returns: None
     """
-    global _entries
-    _entries = []
+    global _entries, _profile_index, _profile_index_keys
+    _entries = None
+    _profile_index = None
+    _profile_index_keys = {}
+
+_register_context_state(__name__, ["_entries", "_profile_index",
+                                   "_profile_index_keys"], drop_entries)
 
 
 def load_entries(machine_id=None):
     """ Load boot entries into memory.
 
-        Load boot entries from ``boom.bootloader.boom_entries_path()``.
+        Load boot entries from each of the directories returned by
+        ``boom.bootloader.boom_entries_paths()`` into a single list of
+        entries. Each entry is written back to the directory that it
+        was loaded from.
+
+        If ``machine_id`` is specified only entries with a file name
+        beginning with ``machine_id`` will be considered.
 
-        If ``machine_id`` is specified only matching entries will be
-        considered.
+        Profiles are loaded on demand as entries refer to them: the
+        full set of profiles is only loaded if an entry does not
+        identify its profile.
 
         :param machine_id: A ``machine_id`` value to match.
     """
     global _entries
-    if not profiles_loaded():
-        load_profiles()
-
-    entries_path = boom_entries_path()
-
     drop_entries()
 
-    _log_info("Loading boot entries from '%s'" % entries_path)
-    for entry in listdir(entries_path):
-        if not entry.endswith(".conf"):
-            continue
-        if machine_id and machine_id not in entry:
-            _log_debug_entry("Skipping entry with machine_id!='%s'",
-                             machine_id)
-            continue
-        entry_path = path_join(entries_path, entry)
-        try:
-            _add_entry(BootEntry(entry_file=entry_path))
-        except Exception as e:
-            _log_info("Could not load BootEntry '%s': %s" %
-                      (entry_path, e))
+    _log_info("Loading boot entries from '%s'" %
+              "', '".join(boom_entries_paths()))
+    with PerfTimer(PERF_ENTRY_LOAD):
+        entry_files = _list_entry_files()
+        if machine_id:
+            def has_machine_id(file_name):
+                parts = _parse_entry_file_name(file_name)
+                if parts:
+                    return parts[0].startswith(machine_id)
+                return machine_id in file_name
+            entry_files = [(p, [f for f in names if has_machine_id(f)])
+                           for (p, names) in entry_files]
+        _entries = _load_entry_files(entry_files)
 
     _log_info("Loaded %d entries" % len(_entries))
 
@@ -687,11 +1195,12 @@ def load_entries(machine_id=None):
 def write_entries():
     """Write out boot entries.
 
-        Write all currently loaded boot entries to
-        ``boom.bootloader.boom_entries_path()``.
+        Write all currently loaded boot entries to the entry
+        directory that each was loaded from, or to
+        ``boom.bootloader.boom_entries_path()`` for new entries.
     """
     global _entries
-    for be in _entries:
+    for be in _entries or []:
         try:
             be.write_entry()
         except Exception as e:
@@ -699,6 +1208,154 @@ def write_entries():
                       (be.disp_boot_id, e))
 
 
+def commit_entries(entries, unlink_paths=None):
+    """Write out a set of boot entries in a single batch.
+
+        Write each ``BootEntry`` in ``entries`` to a temporary file,
+        then rename all of the new files into place, unlink any paths
+        given in ``unlink_paths``, and synchronise the entries
+        directory once for the whole batch, holding the exclusive boom
+        lock. Successfully written entries are added to the list of
+        known on-disk entries.
+
+        If an entry was previously written to a different path (for
+        example because its ``boot_id`` has changed following an
+        edit), the old file is removed once the new data has been
+        renamed into place.
+
+        Entries are written regardless of their dirty state, although
+        the temporary file, write and rename are skipped for entries
+        whose on-disk file already holds identical data. An error
+        writing one entry does not prevent the remaining entries from
+        being written: instead a list of ``(BootEntry, exception)``
+        tuples is returned for the entries that could not be written.
+
+        :param entries: A list of ``BootEntry`` objects to write.
+        :param unlink_paths: An optional list of entry file paths to
+                             remove once the new entries are written.
+        :returns: A list of ``(BootEntry, exception)`` tuples for any
+                  entries that failed to write.
+        :returntype: list
+    """
+    global _entries
+    with BoomLock(exclusive=True):
+        with PerfTimer(PERF_WRITE):
+            failed = []
+            pending = []
+            for be in entries:
+                try:
+                    entry_path = be._entry_path
+                    data = be._render_entry()
+                    if io_elide_write(entry_path, data, BOOT_ENTRY_MODE):
+                        tmp_path = None
+                    else:
+                        tmp_path = be._write_tmp_entry(data)
+                    pending.append((be, tmp_path, entry_path))
+                except Exception as e:
+                    failed.append((be, e))
+
+            new_paths = set([p[2] for p in pending])
+            stale_paths = []
+            written = []
+            for (be, tmp_path, entry_path) in pending:
+                try:
+                    if tmp_path:
+                        io_rename(tmp_path, entry_path)
+                    chmod(entry_path, BOOT_ENTRY_MODE)
+                except Exception as e:
+                    _log_error("Error writing entry file %s: %s" %
+                               (entry_path, e))
+                    try:
+                        io_unlink(tmp_path)
+                    except:
+                        pass
+                    failed.append((be, e))
+                    continue
+                if be._last_path and be._last_path not in new_paths:
+                    stale_paths.append(be._last_path)
+                be._last_path = entry_path
+                be._unwritten = False
+                written.append(be)
+
+            for path in stale_paths + (unlink_paths or []):
+                try:
+                    io_unlink(path)
+                except Exception as e:
+                    _log_error("Error unlinking entry file %s: %s" % (path, e))
+
+            # Synchronise each entries directory that has been modified.
+            sync_paths = [p[2] for p in pending if p[1]]
+            sync_paths += stale_paths + (unlink_paths or [])
+            for entries_path in sorted(set(dirname(p) for p in sync_paths)):
+                io_sync_dir(entries_path)
+
+    # Register new entries: compare by identity, since the boot_id of
+    # a modified entry changes once it is re-written. If entries are not
+    # in memory they will be read from disk by the next load.
+    if _entries is not None:
+        known = set(id(be) for be in _entries)
+        _entries.extend([be for be in written if id(be) not in known])
+        for be in written:
+            _index_entry(be)
+
+    _log_debug_entry("Committed %d entries (%d failed, %d unlinked)" %
+                     (len(written), len(failed),
+                      len(stale_paths) + len(unlink_paths or [])))
+    return failed
+
+
+def remove_entries(entries):
+    """Remove a set of boot entries from disk in a single batch.
+
+        Unlink the on-disk file for each ``BootEntry`` in ``entries``
+        and synchronise the entries directory once for the whole
+        batch, holding the exclusive boom lock. The deleted entries are
+        then removed from the list of loaded entries in a single pass.
+
+        An error removing one entry does not prevent the remaining
+        entries from being removed: instead a list of
+        ``(BootEntry, exception)`` tuples is returned for the entries
+        that could not be removed.
+
+        :param entries: A list of ``BootEntry`` objects to remove.
+        :returns: A list of ``(BootEntry, exception)`` tuples for any
+                  entries that could not be removed.
+        :returntype: list
+    """
+    global _entries
+    failed = []
+    removed = set()
+    sync_paths = set()
+    with BoomLock(exclusive=True):
+        for be in entries:
+            entry_path = be._entry_path
+            try:
+                io_unlink(entry_path)
+            except OSError as e:
+                if e.errno == ENOENT:
+                    e = ValueError("Entry does not exist: %s" % entry_path)
+                else:
+                    _log_error("Error removing entry file %s: %s" %
+                               (entry_path, e))
+                failed.append((be, e))
+                continue
+            removed.add(id(be))
+            sync_paths.add(dirname(entry_path))
+
+        for entries_path in sorted(sync_paths):
+            io_sync_dir(entries_path)
+
+    if _entries:
+        _entries = [be for be in _entries if id(be) not in removed]
+        for be in entries:
+            if id(be) in removed:
+                _unindex_entry(be)
+
+    _log_debug_entry("Removed %d entries (%d failed)" %
+                     (len(removed), len(failed)))
+    return failed
+
+
 def min_boot_id_width():
     """Calculate the minimum unique width for boot_id values.
 
@@ -733,6 +1390,31 @@ def select_params(s, bp):
 
     return True
 
+def _entry_params_getter(attr):
+    """Return an accessor for a ``BootParams`` attribute of an entry.
+    """
+    get = attrgetter(attr)
+    return lambda be: get(be.bp) if be.bp else None
+
+
+def _entry_profile_getter(get):
+    """Return an accessor for an ``OsProfile`` attribute of an entry.
+    """
+    return lambda be: get(be._osp) if be._osp else None
+
+
+#: Selection expression accessors for ``BootEntry`` attributes.
+_entry_expr_getters = dict((attr, attrgetter(attr)) for attr in [
+    "boot_id", "title", "version", "machine_id", "linux", "initrd", "efi",
+    "options", "devicetree"
+])
+_entry_expr_getters.update((attr, _entry_params_getter(attr)) for attr in [
+    "root_device", "lvm_root_lv", "btrfs_subvol_path", "btrfs_subvol_id"
+])
+_entry_expr_getters.update((attr, _entry_profile_getter(get)) for (attr, get)
+                           in _profile_expr_getters.items())
+
+
 def select_entry(s, be):
     """Test BootEntry against Selection criteria.
 
@@ -760,9 +1442,96 @@ def select_entry(s, be):
     if not select_params(s, be.bp):
         return False
 
+    if s.expr and not s.expr.match(be, _entry_expr_getters):
+        return False
+
     return True
 
 
+def _entry_file_names(selection):
+    """Return the sorted names of the entry files in each entry root
+        that may match a selection.
+
+        Entry file names encode the ``machine_id``, ``boot_id`` prefix
+        and ``version`` of the entry: files whose names cannot match
+        ``selection`` are excluded without being opened.
+
+        :param selection: A ``Selection`` object to match.
+        :returns: A list of ``(entries_path, file_names)`` tuples.
+        :returntype: list
+    """
+    def may_match(file_name):
+        return _entry_file_may_match(file_name,
+                                     machine_id=selection.machine_id,
+                                     version=selection.version,
+                                     boot_id=selection.boot_id,
+                                     expr=selection.expr)
+
+    return [(entries_path, sorted(f for f in file_names if may_match(f)))
+            for (entries_path, file_names) in _list_entry_files()]
+
+
+def _find_entry_files(selection):
+    """Load the entries that may match a selection from disk.
+
+        When entries are not already in memory, only the files whose
+        names may match ``selection`` are opened and parsed. The entries
+        loaded are not added to the list of loaded entries.
+
+        File names are used only to exclude files: the returned entries
+        must still be tested against the complete selection.
+
+        :param selection: A ``Selection`` specifying a ``machine_id``,
+                          ``version`` or ``boot_id`` to match.
+        :returns: A list of candidate ``BootEntry`` objects.
+        :returntype: list
+    """
+    with PerfTimer(PERF_ENTRY_LOAD):
+        entries = _load_entry_files(_entry_file_names(selection))
+    _log_debug_entry("Loaded %d candidate entries" % len(entries))
+    return entries
+
+
+def iter_entries(selection=None, from_disk=False):
+    """Iterate over boot entries matching selection criteria.
+
+        Return an iterator that yields the ``BootEntry`` objects
+        matching the specified criteria as they are found. Matching
+        follows the same rules as ``find_entries()``.
+
+        If entries are already in memory and ``from_disk`` is ``False``
+        they are yielded in load order. Otherwise, if ``from_disk`` is
+        ``True`` or the selection includes a ``machine_id``, ``version``
+        or ``boot_id``, entries are streamed from disk in file name
+        order. Only files whose names may match are opened, and the
+        entries are not added to the list of loaded entries. In all
+        other cases entries are loaded into memory first.
+
+        Callers that need only the first match can stop iterating
+        early to avoid loading the remaining entries.
+
+        :param selection: A ``Selection`` object specifying the match
+                          criteria for the operation.
+        :param from_disk: Always stream entries from disk, without
+                          using or populating the in-memory entries.
+        :returns: An iterator yielding ``BootEntry`` objects.
+    """
+    # Use null search criteria if unspecified
+    selection = selection if selection else Selection()
+
+    selection.check_valid_selection(entry=True, params=True, profile=True)
+
+    if _entries is not None and not from_disk:
+        entries = _entries
+    elif from_disk or _selection_prunes_files(selection):
+        entries = _iter_entry_files(_entry_file_names(selection))
+    else:
+        load_entries()
+        entries = _entries
+
+    return (be for be in entries if select_entry(selection, be))
+
+
 def find_entries(selection=None):
     """Find boot entries matching selection criteria.
 
@@ -783,9 +1552,6 @@ def find_entries(selection=None):
     """
     global _entries
 
-    if not _entries:
-        load_entries()
-
     matches = []
 
     # Use null search criteria if unspecified
@@ -793,11 +1559,20 @@ def find_entries(selection=None):
 
     selection.check_valid_selection(entry=True, params=True, profile=True)
 
+    if _entries is not None:
+        entries = _entries
+    elif _selection_prunes_files(selection):
+        entries = _find_entry_files(selection)
+    else:
+        load_entries()
+        entries = _entries
+
     _log_debug_entry("Finding entries for %s" % repr(selection))
 
-    for be in _entries:
-        if select_entry(selection, be):
-            matches.append(be)
+    with PerfTimer(PERF_MATCH):
+        for be in entries:
+            if select_entry(selection, be):
+                matches.append(be)
     _log_debug_entry("Found %d entries" % len(matches))
     return matches
 
@@ -825,6 +1600,27 @@ def _transform_key(key_name):
     return key_name
 
 
+def _profile_from_ref(osp_ref):
+    """Return the in-memory profile for a pickled profile reference.
+
+        :param osp_ref: A ``(identity_key, identifier)`` tuple, or
+                        ``None``.
+        :returns: The matching ``OsProfile`` or ``HostProfile``, or
+                  ``None`` if no profile matches.
+    """
+    if not osp_ref:
+        return None
+    (key, profile_id) = osp_ref
+    if key == BOOM_HOST_ID:
+        osp = get_host_profile_by_host_id(profile_id)
+    else:
+        osp = get_os_profile_by_id(profile_id)
+    if not osp:
+        _log_warn("Profile not found for unpickled BootEntry (%s=%s)" %
+                  osp_ref)
+    return osp
+
+
 class BootEntry(object):
     """A class representing a BLS compliant boot entry.
 
@@ -844,16 +1640,12 @@ class BootEntry(object):
         created, or at a later time by calling the ``set_os_profile()``
         method.
     """
-    _entry_data = None
-    _unwritten = False
-    _last_path = None
-    _comments = None
-    _osp = None
-    _bp = None
-    _bp_generation = None
-
-    # boot_id cache
-    __boot_id = None
+    __slots__ = (
+        "_entry_data", "_unwritten", "_last_path", "_comments", "_osp",
+        "_bp", "_bp_generation",
+        # boot_id and serialized key data caches
+        "__boot_id", "__key_data"
+    )
 
     def __str(self, quote=False, prefix="", suffix="", tail="\n",
               sep=" ", bls=True, no_boot_id=False):
@@ -890,16 +1682,11 @@ class BootEntry(object):
         """
         be_str = prefix
 
-        for key in [k for k in ENTRY_KEYS if getattr(self, KEY_MAP[k])]:
-            attr = KEY_MAP[key]
-            key_fmt = '%s%s"%s"' if quote else '%s%s%s'
-            key_fmt += tail
-            attr_val = getattr(self, attr)
+        key_fmt = ('%s%s"%s"' if quote else '%s%s%s') + tail
+        for (key, value) in self._serialize():
             if bls:
-                key_data = (_transform_key(attr), sep, attr_val)
-            else:
-                key_data = (key, sep, attr_val)
-            be_str += key_fmt % key_data
+                key = _transform_key(KEY_MAP[key])
+            be_str += key_fmt % (key, sep, value)
 
         # BOOM_ENTRY_BOOT_ID requires special handling to avoid
         # recursion from the boot_id property method (which uses the
@@ -937,6 +1724,39 @@ class BootEntry(object):
         return self.__str(quote=True, prefix="BootEntry(entry_data={",
                           suffix="})", tail=", ", sep=": ", bls=False)
 
+    def __getstate__(self):
+        """Return the state of this ``BootEntry`` for pickling.
+
+            The attached ``OsProfile`` or ``HostProfile`` is stored as
+            a reference to its identifier rather than as a copy of the
+            profile: it is re-bound to the matching in-memory profile
+            when the entry is unpickled.
+
+            :returns: A tuple of the ``BootEntry`` state.
+            :returntype: tuple
+        """
+        osp_ref = None
+        if self._osp:
+            key = self._osp._identity_key
+            if key == BOOM_HOST_ID:
+                osp_ref = (key, self._osp.host_id)
+            else:
+                osp_ref = (key, self._osp.os_id)
+        return (self._entry_data, self._comments, self._unwritten,
+                self._last_path, self._bp, self._bp_generation,
+                osp_ref, self.__boot_id)
+
+    def __setstate__(self, state):
+        """Restore the state of an unpickled ``BootEntry``.
+
+            :param state: A tuple returned by ``__getstate__()``.
+        """
+        (self._entry_data, self._comments, self._unwritten,
+         self._last_path, self._bp, self._bp_generation,
+         osp_ref, self.__boot_id) = state
+        self._osp = _profile_from_ref(osp_ref)
+        self.__key_data = None
+
     def __len__(self):
         """Return the length (key count) of this ``BootEntry``.
 
@@ -1019,6 +1839,7 @@ class BootEntry(object):
             raise TypeError("'boot_id' property does not support assignment")
         elif key in self._entry_data:
             self._entry_data[key] = value
+            self.__key_data = None
         else:
             raise KeyError("BootEntry key %s not present." % key)
 
@@ -1105,8 +1926,95 @@ class BootEntry(object):
         """
         # Clear cached boot_id: it will be regenerated on next access
         self.__boot_id = None
+        self.__key_data = None
         self._unwritten = True
 
+    def _serialize(self):
+        """Return this entry's keys and values in BLS key order.
+
+            This is the single rendering of an entry's data used to
+            generate its ``boot_id``, its BLS file, its ``str()`` and
+            ``repr()`` forms and legacy boot loader configuration.
+
+            Values are rendered from the entry's profile templates once
+            and cached until the entry, its ``OsProfile`` or its
+            ``BootParams`` are modified. Keys with no value are omitted.
+
+            :returns: A list of ``(BOOM_ENTRY_*, value)`` tuples.
+            :returntype: list
+        """
+        osp = self._osp
+        stamp = (id(osp), osp.generation if osp else 0,
+                 self._bp.generation if self._bp else 0)
+        if self.__key_data and self.__key_data[0] == stamp:
+            return self.__key_data[1]
+        key_data = []
+        for key in ENTRY_KEYS:
+            value = getattr(self, KEY_MAP[key])
+            if value:
+                key_data.append((key, value))
+        self.__key_data = (stamp, key_data)
+        return key_data
+
+    def _render_key(self, key):
+        """Return the value of ``key`` rendered from this entry's
+            profile templates, ignoring any value stored in the entry.
+
+            :param key: One of the ``_PROFILE_KEYS`` entry keys.
+            :returns: The rendered value.
+            :returntype: str
+        """
+        if key not in self._entry_data:
+            return getattr(self, KEY_MAP[key])
+        value = self._entry_data.pop(key)
+        try:
+            return getattr(self, KEY_MAP[key])
+        finally:
+            self._entry_data[key] = value
+
+    def _profile_rendered_keys(self):
+        """Return the entry values rendered from this entry's profile.
+
+            Entries loaded from disk store the rendered ``linux``,
+            ``initrd`` and ``options`` values: a stored value that is
+            identical to the profile rendering was produced by the
+            profile, and should follow later changes to its templates.
+            Values that are not stored are always rendered.
+
+            :returns: A dictionary mapping ``BOOM_ENTRY_*`` keys to the
+                      current rendered values.
+            :returntype: dict
+        """
+        if not self._osp or not self.bp:
+            return {}
+        rendered = {}
+        for key in _PROFILE_KEYS:
+            value = self._render_key(key)
+            if value == getattr(self, KEY_MAP[key]):
+                rendered[key] = value
+        return rendered
+
+    def _rerender_profile_keys(self, rendered):
+        """Re-render entry values from this entry's profile templates.
+
+            Values in ``rendered`` that differ from the current profile
+            rendering are updated, so that the new value is used and
+            written out on the next write.
+
+            :param rendered: A dictionary returned by a prior call to
+                             ``_profile_rendered_keys()``.
+            :returns: ``True`` if the entry was modified or ``False``
+                      otherwise.
+            :returntype: bool
+        """
+        changed = [key for key in rendered
+                   if self._render_key(key) != rendered[key]]
+        for key in changed:
+            self._entry_data.pop(key, None)
+        if changed:
+            self._dirty()
+        return bool(changed)
+
     def __os_id_from_comment(self, comment):
         """Retrive OsProfile from BootEntry comment.
 
@@ -1176,10 +2084,10 @@ class BootEntry(object):
 
         # Import add/del options from HostProfile if attached.
         if hasattr(self._osp, "add_opts"):
-            self.bp.add_opts = self._osp.add_opts.split()
+            self.bp.add_opts = list(KernelCmdline(self._osp.add_opts))
 
         if hasattr(self._osp, "del_opts"):
-            self.bp.del_opts = self._osp.del_opts.split()
+            self.bp.del_opts = list(KernelCmdline(self._osp.del_opts))
 
     def __from_data(self, entry_data, boot_params):
         """Initialise a new BootEntry from in-memory data.
@@ -1276,30 +2184,25 @@ class BootEntry(object):
         """
         entry_data = {}
         comments = {}
-        comment = ""
 
         entry_basename = basename(entry_file)
         _log_debug("Loading BootEntry from '%s'" % entry_basename)
 
-        with open(entry_file, "r") as ef:
-            for line in ef:
-                if blank_or_comment(line):
-                    comment += line if line else ""
-                else:
-                    bls_key, value = parse_name_value(line, separator=None)
-                    # Convert BLS key name to Boom notation
-                    key = _transform_key(bls_key)
-                    if key not in MAP_KEY:
-                        raise LookupError("Unknown BLS key '%s'" % bls_key)
-                    key = MAP_KEY[_transform_key(bls_key)]
-                    entry_data[key] = value
-                    if comment:
-                        comment = self.__os_id_from_comment(comment)
-                        if not comment:
-                            continue
-                        comments[key] = comment
-                        comment = ""
-        self._comments = comments
+        for (bls_key, value, comment) in read_name_values(entry_file,
+                                                          separator=None):
+            # Convert BLS key name to Boom notation
+            key = _transform_key(bls_key)
+            if key not in MAP_KEY:
+                raise LookupError("Unknown BLS key '%s'" % bls_key)
+            key = MAP_KEY[key]
+            if key in _INTERN_KEYS:
+                value = intern_string(value)
+            entry_data[key] = value
+            if comment:
+                comment = self.__os_id_from_comment(comment)
+                if comment:
+                    comments[key] = intern_string(comment)
+        self._comments = comments or None
 
         self.__from_data(entry_data, boot_params)
 
@@ -1307,7 +2210,7 @@ class BootEntry(object):
         if not match or len(match.groups()) <= 1:
             _log_warn("Unknown boot entry file: %s" % entry_basename)
         else:
-            if self.disp_boot_id != match.group(2):
+            if not self.boot_id.startswith(match.group(2)):
                 _log_info("Entry file name does not match boot_id: %s" %
                           entry_basename)
 
@@ -1368,6 +2271,15 @@ class BootEntry(object):
 
             :returntype: BootEntry
         """
+        self._entry_data = None
+        self._unwritten = False
+        self._last_path = None
+        self._comments = None
+        self._bp = None
+        self._bp_generation = None
+        self.__boot_id = None
+        self.__key_data = None
+
         # An osprofile kwarg always takes precedent over either an
         # 'OsIdentifier' comment or a matched osprofile value.
         self._osp = osprofile
@@ -1453,6 +2365,8 @@ class BootEntry(object):
         if not fmt:
             return ""
 
+        perf_count(PERF_TEMPLATE_RENDERED)
+
         # Table-driven key formatting
         #
         # Each entry in the format_key_specs table specifies a list of
@@ -1606,6 +2520,7 @@ class BootEntry(object):
         # the inclusion of the ``boot_id``.
         #
         # Other callers should always rely on the standard methods.
+        perf_count(PERF_SHA_COMPUTED)
         boot_id = sha1(self.__str(no_boot_id=True).encode('utf-8')).hexdigest()
         _log_debug_entry("Generated new boot_id='%s'" % boot_id)
         return boot_id
@@ -1751,53 +2666,27 @@ class BootEntry(object):
             :setter: sets the command line for this ``BootEntry``.
             :type: string
         """
-        def add_opts(opts, append):
-            """Append additional kernel options to this ``BootEntry``'s
-                options property.
-            """
-            extra = " ".join(append)
-            return "%s %s" % (opts, extra) if append else opts
-
-        def del_opt(opt, drop):
-            """Return ``True`` if option ``opt`` should be dropped or
-                ``False`` otherwise.
+        def add_del_opts(opts):
+            """Append additional kernel options to, and drop template
+                supplied kernel options from, the options string
+                ``opts``, as specified by this ``BootEntry``'s
+                ``BootParams``. See ``KernelCmdline.drop()`` for the
+                format of drop specifications.
             """
-            # "name" or "name=value"
-            if opt in drop:
-                return True
-
-            # "name=" wildcard
-            if ("%s=" % opt.split('=')[0]) in drop:
-                return True
-
-            return False
-
-        def del_opts(opts, drop):
-            """Drop specified template supplied kernel options from this
-                ``BootEntry``.
-
-                A drop specification matches either a simple name, a name and
-                its full value (in which case both must match), or a name,
-                followed by '=', indicating that an option with value should
-                be dropped regardless of the actual value:
-
-                <name>         drop name
-                <name>=        drop name and any value
-                <name>=<value> drop name only if its value == value
-            """
-            return " ".join([o for o in opts.split() if not del_opt(o, drop)])
+            cmdline = KernelCmdline(opts)
+            cmdline.extend(self.bp.add_opts or [])
+            for drop in self.bp.del_opts or []:
+                cmdline.drop(drop)
+            return str(cmdline)
 
         if BOOM_ENTRY_OPTIONS in self._entry_data:
             opts = self._entry_data_property(BOOM_ENTRY_OPTIONS)
             if self.bp:
-                opts = add_opts(opts, self.bp.add_opts)
-                return del_opts(opts, self.bp.del_opts)
+                return add_del_opts(opts)
             return opts
 
         if self._osp and self.bp:
-            opts = self._apply_format(self._osp.options)
-            opts = add_opts(opts, self.bp.add_opts)
-            return del_opts(opts, self.bp.del_opts)
+            return add_del_opts(self._apply_format(self._osp.options))
 
         return ""
 
@@ -1874,17 +2763,29 @@ class BootEntry(object):
         self._entry_data[BOOM_ENTRY_DEVICETREE] = devicetree
         self._dirty()
 
+    @property
+    def _entries_dir(self):
+        """The entries directory that this ``BootEntry`` is written
+            to: the directory it was loaded from or last written to, or
+            ``boom_entries_path()`` for a new entry.
+        """
+        if self._last_path:
+            return dirname(self._last_path)
+        return boom_entries_path()
+
     @property
     def _entry_path(self):
         id_tuple = (self.machine_id, self.boot_id[0:7], self.version)
         file_name = BOOT_ENTRIES_FORMAT % id_tuple
-        return path_join(boom_entries_path(), file_name)
+        return path_join(self._entries_dir, file_name)
 
     def write_entry(self, force=False):
         """Write out entry to disk.
 
             Write out this ``BootEntry``'s data to a file in BLS
-            format to the path specified by ``boom_entries_path()``.
+            format to the entry directory that it was loaded from, or
+            to the path specified by ``boom_entries_path()`` for a new
+            entry.
 
             The file will be named according to the entry's key values,
             and the value of the ``BOOT_ENTRIES_FORMAT`` constant.
@@ -1894,6 +2795,8 @@ class BootEntry(object):
             If the value of ``force`` is ``False`` and the ``OsProfile``
             is not currently marked as dirty (either new, or modified
             since the last load operation) the write will be skipped.
+            The write is also skipped if the entry file on disk already
+            contains identical data.
 
             :param force: Force this entry to be written to disk even
                           if the entry is unmodified.
@@ -1904,43 +2807,91 @@ class BootEntry(object):
         """
         if not self._unwritten and not force:
             return
-        entry_path = self._entry_path
-        (tmp_fd, tmp_path) = mkstemp(prefix="boom", dir=boom_entries_path())
-        with fdopen(tmp_fd, "w") as f:
-            # Our original file descriptor will be closed on exit from the
-            # fdopen with statement: save a copy so that we can call fdatasync
-            # once at the end of writing rather than on each loop iteration.
-            tmp_fd = dup(tmp_fd)
-            if self._osp:
-                # Insert OsIdentifier comment at top-of-file
-                f.write("#OsIdentifier: %s\n" % self._osp.os_id)
-            for key in [k for k in ENTRY_KEYS if getattr(self, KEY_MAP[k])]:
-                if self._comments and key in self._comments:
-                    f.write(self._comments[key].rstrip() + '\n')
-                # Map Boom key names to BLS entry keys
-                key = KEY_MAP[key]
-                key_fmt = "%s %s\n"
-                key_data = (_transform_key(key), getattr(self, key))
-                f.write(key_fmt % key_data)
-                f.flush()
+        with BoomLock(exclusive=True):
+            with PerfTimer(PERF_WRITE):
+                entry_path = self._entry_path
+                data = self._render_entry()
+                if not io_elide_write(entry_path, data, BOOT_ENTRY_MODE):
+                    self._replace_entry_file(entry_path, data)
+
+                self._last_path = entry_path
+                self._unwritten = False
+
+            # Add this entry to the list of known on-disk entries
+            _add_entry(self)
+
+    def _replace_entry_file(self, entry_path, data):
+        """Atomically replace the file at ``entry_path`` with ``data``.
+
+            :param entry_path: The path of the entry file to replace.
+            :param data: The rendered entry file content.
+            :returntype: None
+        """
+        tmp_path = self._write_tmp_entry(data)
         try:
-            fdatasync(tmp_fd)
-            rename(tmp_path, entry_path)
+            io_rename(tmp_path, entry_path)
             chmod(entry_path, BOOT_ENTRY_MODE)
         except Exception as e:
             _log_error("Error writing entry file %s: %s" %
                        (entry_path, e))
             try:
-                unlink(tmp_path)
+                io_unlink(tmp_path)
             except:
                 pass
             raise e
 
-        self._last_path = entry_path
-        self._unwritten = False
+    def _render_entry(self):
+        """Render this entry's data as the content of a BLS file.
 
-        # Add this entry to the list of known on-disk entries
-        _add_entry(self)
+            :returns: The entry file content.
+            :returntype: str
+        """
+        lines = []
+        if self._osp:
+            # Insert OsIdentifier comment at top-of-file
+            lines.append("#OsIdentifier: %s\n" % self._osp.os_id)
+        for (key, value) in self._serialize():
+            if self._comments and key in self._comments:
+                lines.append(self._comments[key].rstrip() + '\n')
+            # Map Boom key names to BLS entry keys
+            lines.append("%s %s\n" % (_transform_key(KEY_MAP[key]), value))
+        return "".join(lines)
+
+    def _write_tmp_entry(self, data=None):
+        """Write this entry's data to a new temporary file.
+
+            Write out this ``BootEntry``'s data in BLS format to a
+            temporary file in the entry's entries directory, and
+            synchronise the file data to
+            disk. The caller is responsible for renaming the file into
+            place, or unlinking it on error.
+
+            :param data: The rendered entry data, or ``None`` to render
+                         the entry's current data.
+            :returns: The path to the temporary entry file.
+            :returntype: str
+        """
+        if data is None:
+            data = self._render_entry()
+        (tmp_fd, tmp_path) = io_mkstemp(prefix="boom", dir=self._entries_dir)
+        with fdopen(tmp_fd, "w") as f:
+            # Our original file descriptor will be closed on exit from the
+            # fdopen with statement: save a copy so that we can call fdatasync
+            # once the data has been written.
+            tmp_fd = dup(tmp_fd)
+            f.write(data)
+        try:
+            io_fsync(tmp_fd, data_only=True)
+        except Exception as e:
+            _log_error("Error writing entry file %s: %s" % (tmp_path, e))
+            try:
+                io_unlink(tmp_path)
+            except:
+                pass
+            raise e
+        finally:
+            close(tmp_fd)
+        return tmp_path
 
     def update_entry(self, force=False):
         """Update on-disk entry.
@@ -1975,7 +2926,7 @@ class BootEntry(object):
         self.write_entry(force=force)
         if self._entry_path != to_unlink:
             try:
-                unlink(to_unlink)
+                io_unlink(to_unlink)
             except Exception as e:
                 _log_error("Error unlinking entry file %s: %s" %
                            (to_unlink, e))
@@ -1992,17 +2943,19 @@ class BootEntry(object):
             :raises: ``OsError`` if an error occurs removing the file or
                      ``ValueError`` if the entry does not exist.
         """
-        if not path_exists(self._entry_path):
-            raise ValueError("Entry does not exist: %s" % self._entry_path)
-        try:
-            unlink(self._entry_path)
-        except Exception as e:
-            _log_error("Error removing entry file %s: %s" %
-                       (entry_path, e))
-            raise
+        with BoomLock(exclusive=True):
+            entry_path = self._entry_path
+            try:
+                io_unlink(entry_path)
+            except OSError as e:
+                if e.errno == ENOENT:
+                    raise ValueError("Entry does not exist: %s" % entry_path)
+                _log_error("Error removing entry file %s: %s" %
+                           (entry_path, e))
+                raise
 
-        if not self._unwritten:
-            _del_entry(self)
+            if not self._unwritten:
+                _del_entry(self)
 
 
 __all__ = [
@@ -2026,14 +2979,15 @@ __all__ = [
     # Boom root device error class
     'BoomRootDeviceError',
 
-    # BootParams and BootEntry objects
-    'BootParams', 'BootEntry',
+    # Kernel command line, BootParams and BootEntry objects
+    'KernelCmdline', 'BootParams', 'BootEntry',
 
     # Path configuration
-    'boom_entries_path',
+    'boom_entries_path', 'boom_entries_paths',
 
     # Entry lookup, load, and write functions
-    'drop_entries', 'load_entries', 'write_entries', 'find_entries',
+    'drop_entries', 'load_entries', 'write_entries', 'commit_entries',
+    'remove_entries', 'find_entries', 'iter_entries', 'find_profile_entries',
 
     # Formatting
     'min_boot_id_width',
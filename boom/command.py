@@ -33,12 +33,24 @@ from boom.bootloader import *
 from boom.hostprofile import *
 from boom.legacy import *
 from boom.config import *
+from boom.bootloader import check_root_device, _add_entry, _del_entry
+from boom._boom import _register_context_state
 
 import sys
-from os import environ, uname, getcwd
-from os.path import basename, isabs, join
+from os import environ, uname, getcwd, stat
+from os.path import basename, isabs, join, exists as path_exists
 from argparse import ArgumentParser
+from itertools import islice
 import logging
+import shlex
+import json
+import re
+
+# Python3 moves StringIO to io
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 #: The environment variable from which to take the location of the
 #: ``/boot`` file system.
@@ -57,6 +69,37 @@ _log_error = _log.error
 _default_log_level = logging.WARNING
 _console_handler = None
 
+#: Defer legacy bootloader synchronisation (batch mode).
+_legacy_deferred = False
+#: A deferred legacy bootloader synchronisation is pending.
+_legacy_pending = False
+#: Entries to write at the end of a batch, or ``None`` outside a batch.
+_batch_writes = None
+#: Entry files to unlink at the end of a batch.
+_batch_unlinks = None
+#: The number of the batch line currently executing.
+_batch_line = None
+#: Batch line numbers that queued each entry, keyed by ``id(be)``.
+_batch_lines = None
+
+
+def _reset_batch_state():
+    """Reset the batch mode write and legacy synchronisation state.
+    """
+    global _legacy_deferred, _legacy_pending, _batch_writes, _batch_unlinks
+    global _batch_line, _batch_lines
+    _legacy_deferred = False
+    _legacy_pending = False
+    _batch_writes = None
+    _batch_unlinks = None
+    _batch_line = None
+    _batch_lines = None
+
+_register_context_state(__name__, ["_legacy_deferred", "_legacy_pending",
+                                   "_batch_writes", "_batch_unlinks",
+                                   "_batch_line", "_batch_lines"],
+                        _reset_batch_state)
+
 #
 # Reporting object types
 #
@@ -325,11 +368,136 @@ def _canonicalize_lv_name(lvname):
 def __write_legacy():
     """Synchronise boom boot entries with the configured legacy
         bootloader format.
+
+        If legacy synchronisation is currently deferred (for example
+        while executing a batch of commands) the synchronisation is
+        recorded as pending and performed once, at the end of the
+        batch.
     """
+    global _legacy_pending
     config = get_boom_config()
     if config.legacy_enable and config.legacy_sync:
-        clear_legacy_loader()
-        write_legacy_loader(selection=Selection(), loader=config.legacy_format)
+        if _legacy_deferred:
+            _legacy_pending = True
+            return
+        with PerfTimer(PERF_LEGACY_SYNC):
+            sync_legacy_loader(selection=Selection(),
+                               loader=config.legacy_format)
+
+
+def __write_entry(be, update=False):
+    """Write a single boot entry to disk.
+
+        While a batch is running the entry is added to the list of
+        loaded entries and queued for the single commit made at the
+        end of the batch.
+
+        :param be: The ``BootEntry`` to write.
+        :param update: Unlink the entry's previous file if the
+                       ``boot_id`` has changed.
+        :returns: None
+    """
+    if _batch_writes is not None:
+        __commit_entries([be])
+    elif update:
+        be.update_entry()
+    else:
+        be.write_entry()
+
+
+def __commit_entries(bes):
+    """Write a set of boot entries to disk in a single batch.
+
+        While a batch is running the entries are added to the list of
+        loaded entries and queued for the single commit made at the
+        end of the batch, together with the number of the batch line
+        that queued them.
+
+        :param bes: The list of ``BootEntry`` objects to write.
+        :returns: A list of ``(BootEntry, exception)`` tuples for any
+                  entries that failed to write.
+        :returntype: list
+    """
+    if _batch_writes is None:
+        return commit_entries(bes)
+    for be in bes:
+        if not any(be is queued for queued in _batch_writes):
+            _batch_writes.append(be)
+        lines = _batch_lines.setdefault(id(be), [])
+        if _batch_line not in lines:
+            lines.append(_batch_line)
+        _add_entry(be)
+    return []
+
+
+def __remove_entries(bes):
+    """Remove a set of boot entries from disk in a single batch.
+
+        While a batch is running the entries are removed from the list
+        of loaded entries, and their files are queued to be unlinked by
+        the single commit made at the end of the batch. An entry that
+        was created earlier in the batch is simply dropped from the
+        queue of entries to write.
+
+        :param bes: The list of ``BootEntry`` objects to remove.
+        :returns: A list of ``(BootEntry, exception)`` tuples for any
+                  entries that could not be removed.
+        :returntype: list
+    """
+    global _batch_writes
+    if _batch_writes is None:
+        return remove_entries(bes)
+    failed = []
+    for be in bes:
+        queued = any(be is q for q in _batch_writes)
+        _batch_writes = [q for q in _batch_writes if q is not be]
+        # An entry is on disk at the path it was last read from or
+        # written to: an entry created in this batch has no file yet.
+        path = be._last_path if queued else be._last_path or be._entry_path
+        if path and path_exists(path):
+            _batch_unlinks.append(path)
+        elif not queued:
+            e = ValueError("Entry does not exist: %s" % path)
+            failed.append((be, e))
+            continue
+        _del_entry(be)
+    return failed
+
+
+def __commit_batch():
+    """Write out the entries queued by the commands in a batch.
+
+        All queued entries are written and queued entry files unlinked
+        by a single call to ``commit_entries()``, so that each entries
+        directory is synchronised once for the whole batch.
+
+        :returns: A list of ``(BootEntry, exception)`` tuples for any
+                  entries that failed to write.
+        :returntype: list
+    """
+    global _batch_writes, _batch_unlinks
+    (bes, unlinks) = (_batch_writes, _batch_unlinks)
+    (_batch_writes, _batch_unlinks) = (None, None)
+    if not bes and not unlinks:
+        return []
+    # A queued entry may re-use the path of an entry deleted earlier.
+    new_paths = set(be._entry_path for be in bes)
+    unlinks = [path for path in unlinks if path not in new_paths]
+    return commit_entries(bes, unlink_paths=unlinks)
+
+
+def __batch_failed_lines(failed):
+    """Return the batch line numbers that queued a set of entries.
+
+        :param failed: A list of ``(BootEntry, exception)`` tuples
+                       returned by ``__commit_batch()``.
+        :returns: A sorted list of batch line numbers.
+        :returntype: list
+    """
+    lines = set()
+    for (be, e) in failed:
+        lines.update(_batch_lines.get(id(be), []))
+    return sorted(lines)
 
 
 def _do_print_type(report_fields, selected, output_fields=None,
@@ -372,14 +540,13 @@ def _merge_add_del_opts(orig_opts, opts):
         :param orig_opts: A list of original option modifications
         :param opts: A space-separated string containing a list of
                      command line option modifications
-        :returns: A single list containing the merged options
+        :returns: A single list containing the merged options, with
+                  command line values first and duplicates removed
     """
     # Merge new and cloned kernel options
-    all_opts = set()
-    if opts:
-        all_opts.update(opts.split())
-    if orig_opts:
-        all_opts.update(orig_opts)
+    all_opts = KernelCmdline()
+    for opt in (opts.split() if opts else []) + list(orig_opts or []):
+        all_opts.add(opt)
 
     return list(all_opts)
 
@@ -392,6 +559,48 @@ def _merge_add_del_opts(orig_opts, opts):
 # BootEntry manipulation
 #
 
+def _new_entry(title, version, machine_id, root_device, lvm_root_lv=None,
+               btrfs_subvol_path=None, btrfs_subvol_id=None, profile=None,
+               add_opts=None, del_opts=None, allow_no_dev=False):
+    """Validate arguments and construct a new, unwritten, ``BootEntry``.
+
+        See ``create_entry()`` for a description of the arguments.
+
+        :returns: a new ``BootEntry`` object.
+        :returntype: ``BootEntry``
+        :raises: ``ValueError`` if required values are missing.
+    """
+    if not title and not profile.title:
+        raise ValueError("Entry title cannot be empty.")
+
+    if not version:
+        raise ValueError("Entry version cannot be empty.")
+
+    if not machine_id:
+        raise ValueError("Entry machine_id cannot be empty.")
+
+    if not root_device:
+        raise ValueError("Entry requires a root_device.")
+
+    if not profile:
+        raise ValueError("Cannot create entry without OsProfile.")
+
+    add_opts = list(KernelCmdline(add_opts))
+    del_opts = list(KernelCmdline(del_opts))
+
+    _log_debug_cmd("Effective add options: %s" % add_opts)
+    _log_debug_cmd("Effective del options: %s" % del_opts)
+
+    bp = BootParams(version, root_device, lvm_root_lv=lvm_root_lv,
+                    btrfs_subvol_path=btrfs_subvol_path,
+                    btrfs_subvol_id=btrfs_subvol_id,
+                    add_opts=add_opts, del_opts=del_opts)
+
+    return BootEntry(title=title, machine_id=machine_id,
+                     osprofile=profile, boot_params=bp,
+                     allow_no_dev=allow_no_dev)
+
+
 def create_entry(title, version, machine_id, root_device, lvm_root_lv=None,
                  btrfs_subvol_path=None, btrfs_subvol_id=None, profile=None,
                  add_opts=None, del_opts=None, write=True, allow_no_dev=False):
@@ -418,47 +627,142 @@ def create_entry(title, version, machine_id, root_device, lvm_root_lv=None,
                  a duplicate entry exists, or``OsError`` if an error
                  occurs while writing the entry file.
     """
-    if not title and not profile.title:
-        raise ValueError("Entry title cannot be empty.")
+    be = _new_entry(title, version, machine_id, root_device,
+                    lvm_root_lv=lvm_root_lv,
+                    btrfs_subvol_path=btrfs_subvol_path,
+                    btrfs_subvol_id=btrfs_subvol_id, profile=profile,
+                    add_opts=add_opts, del_opts=del_opts,
+                    allow_no_dev=allow_no_dev)
 
-    if not version:
-        raise ValueError("Entry version cannot be empty.")
+    dupes = iter_entries(Selection(boot_id=be.boot_id))
+    if next(dupes, None) is not None:
+        raise ValueError("Entry already exists (boot_id=%s)." %
+                         be.disp_boot_id)
 
-    if not machine_id:
-        raise ValueError("Entry machine_id cannot be empty.")
+    if write:
+        __write_entry(be)
+        __write_legacy()
 
-    if not root_device:
-        raise ValueError("Entry requires a root_device.")
+    return be
 
-    if not profile:
-        raise ValueError("Cannot create entry without OsProfile.")
 
-    btrfs = any([btrfs_subvol_path, btrfs_subvol_id])
+def _spec_profile(profile, version, profile_cache):
+    """Resolve the profile for one ``create_entries()`` specification.
 
-    add_opts = add_opts.split() if add_opts else []
-    del_opts = del_opts.split() if del_opts else []
+        Profiles given as an ``os_id`` string, or matched by version
+        string, are looked up once per batch and cached in the
+        ``profile_cache`` dictionary.
 
-    _log_debug_cmd("Effective add options: %s" % add_opts)
-    _log_debug_cmd("Effective del options: %s" % del_opts)
+        :param profile: An ``OsProfile``, an ``os_id`` string or None.
+        :param version: The kernel version of the new entry.
+        :param profile_cache: A dictionary of resolved profiles.
+        :returns: The ``OsProfile`` to use for the entry.
+        :raises: ``ValueError`` if no unique profile is found.
+    """
+    if isinstance(profile, OsProfile):
+        return profile
+
+    key = ("os_id", profile) if profile else ("version", version)
+    if key not in profile_cache:
+        if profile:
+            osp = get_os_profile_by_id(profile)
+            osps = [osp] if osp else find_profiles(Selection(os_id=profile))
+            if len(osps) > 1:
+                profile_cache[key] = ValueError("OsProfile ID '%s' is "
+                                                "ambiguous" % profile)
+            else:
+                profile_cache[key] = osps[0] if osps else None
+        else:
+            profile_cache[key] = match_os_profile_by_version(version)
+
+    osp = profile_cache[key]
+    if isinstance(osp, Exception):
+        raise osp
+    if not osp:
+        if profile:
+            raise ValueError("OsProfile not found: %s" % profile)
+        raise ValueError("No matching OsProfile for version: %s" % version)
+    return osp
 
-    bp = BootParams(version, root_device, lvm_root_lv=lvm_root_lv,
-                    btrfs_subvol_path=btrfs_subvol_path,
-                    btrfs_subvol_id=btrfs_subvol_id,
-                    add_opts=add_opts, del_opts=del_opts)
 
-    be = BootEntry(title=title, machine_id=machine_id,
-                   osprofile=profile, boot_params=bp,
-                   allow_no_dev=allow_no_dev)
+def create_entries(specs, write=True, allow_no_dev=False):
+    """Create a set of new boot loader entries.
 
-    if find_entries(Selection(boot_id=be.boot_id)):
-        raise ValueError("Entry already exists (boot_id=%s)." %
-                         be.disp_boot_id)
+        Create the boot entries described by ``specs`` in the configured
+        loader directory. Each specification is a dictionary containing
+        keyword arguments for ``create_entry()``: the ``profile`` value
+        may be an ``OsProfile`` object, an ``os_id`` string, or omitted
+        to match a profile using the entry version.
 
-    if write:
-        be.write_entry()
+        Profiles are resolved and root devices checked once for each
+        distinct value in the batch, and duplicate entries (either
+        with an existing entry, or within the batch) are detected by
+        ``boot_id``. All new entries are then written to disk together,
+        followed by a single legacy bootloader synchronisation.
+
+        A list with one ``(BootEntry, error)`` tuple for each
+        specification is returned, in the order of ``specs``: on
+        success ``error`` is ``None``, and if the entry could not be
+        created ``BootEntry`` is ``None`` and ``error`` contains the
+        exception describing the failure.
+
+        :param specs: A list of entry specification dictionaries.
+        :param write: ``True`` if the entries should be written to disk,
+                      or ``False`` otherwise.
+        :param allow_no_dev: Accept a non-existent or invalid root dev.
+        :returns: A list of ``(BootEntry, error)`` tuples.
+        :returntype: list
+    """
+    boot_ids = set([be.boot_id for be in find_entries()])
+    profile_cache = {}
+    device_errors = {}
+    results = []
+    new_entries = []
+
+    for spec in specs:
+        spec = dict(spec)
+        for key in ["title", "version", "machine_id", "root_device"]:
+            spec.setdefault(key, None)
+        try:
+            version = spec["version"]
+            spec["profile"] = _spec_profile(spec.get("profile"), version,
+                                            profile_cache)
+            root_device = spec["root_device"]
+            if root_device and not allow_no_dev:
+                if root_device not in device_errors:
+                    try:
+                        check_root_device(root_device)
+                        device_errors[root_device] = None
+                    except BoomRootDeviceError as brde:
+                        device_errors[root_device] = brde
+                if device_errors[root_device]:
+                    raise device_errors[root_device]
+
+            spec["allow_no_dev"] = True
+            be = _new_entry(**spec)
+
+            if be.boot_id in boot_ids:
+                raise ValueError("Entry already exists (boot_id=%s)." %
+                                 be.disp_boot_id)
+            boot_ids.add(be.boot_id)
+        except (BoomError, TypeError, ValueError) as e:
+            results.append((None, e))
+            continue
+
+        results.append((be, None))
+        new_entries.append(be)
+
+    if write and new_entries:
+        failed = __commit_entries(new_entries)
+        failed = dict([(id(be), e) for (be, e) in failed])
+        if failed:
+            results = [(None, failed[id(be)]) if id(be) in failed else (be, e)
+                       for (be, e) in results]
         __write_legacy()
 
-    return be
+    _log_debug_cmd("Created %d of %d entries" %
+                   (len([r for r in results if r[0]]), len(specs)))
+    return results
 
 
 def delete_entries(selection=None):
@@ -485,14 +789,129 @@ def delete_entries(selection=None):
     if not bes:
         raise IndexError("No matching entry found.")
 
-    deleted = 0
-    for be in bes:
-        be.delete_entry()
-        deleted += 1
+    return _delete_entry_set(bes)
+
+
+def _delete_entry_set(bes):
+    """Delete a list of entries in a single batch.
+
+        Remove the entries in ``bes`` from disk and from the list of
+        loaded entries, and synchronise the legacy bootloader once.
+        If any entry could not be removed the first error is raised
+        once the remaining entries have been processed.
+
+        :param bes: The list of ``BootEntry`` objects to delete.
+        :returns: the number of entries removed.
+        :returntype: ``int``
+    """
+    failed = __remove_entries(bes)
+    for (be, e) in failed:
+        _log_error("Could not delete entry (boot_id=%s): %s" %
+                   (be.disp_boot_id, e))
 
     __write_legacy()
 
-    return deleted
+    if failed:
+        raise failed[0][1]
+
+    return len(bes)
+
+
+def _retention_key(be):
+    """Return the retention group key for a ``BootEntry``.
+
+        Entries are grouped by ``machine_id`` and root logical volume,
+        or root device for entries that do not use LVM2.
+
+        :param be: The ``BootEntry`` to return a key for.
+        :returns: A ``(machine_id, root)`` tuple.
+    """
+    return (be.machine_id, be.bp.lvm_root_lv or be.bp.root_device)
+
+
+#: Pattern splitting a version string into numeric and alphabetic parts.
+_version_part_re = re.compile(r"(\d+|[a-zA-Z]+)")
+
+
+def _version_key(version):
+    """Return a sort key comparing kernel version strings.
+
+        The version is split into numeric and alphabetic segments that
+        are compared in turn: numeric segments compare by value, and are
+        newer than alphabetic segments, as in ``rpmvercmp()``.
+
+        :param version: The version string to return a key for.
+        :returns: A sort key for ``version``.
+        :returntype: list
+    """
+    return [(1, int(part)) if part.isdigit() else (0, part)
+            for part in _version_part_re.findall(version or "")]
+
+
+def _entry_age_key(be):
+    """Return a sort key ordering entries from oldest to newest.
+
+        Entries are ordered by kernel version. Entry file modification
+        times change whenever an entry is rewritten, so they are used
+        only to order entries with the same version. Entries that have
+        not been written are treated as the newest.
+
+        :param be: The ``BootEntry`` to return a key for.
+        :returns: A sort key for ``be``.
+    """
+    try:
+        mtime = stat(be._last_path).st_mtime if be._last_path else None
+    except OSError:
+        mtime = 0
+    return (_version_key(be.version), mtime is None, mtime or 0)
+
+
+def find_retention_victims(keep, selection=None):
+    """Find entries exceeding a per machine_id/root LV retention limit.
+
+        Group the entries matching ``selection`` by ``machine_id`` and
+        root logical volume (or root device for non-LVM2 entries), and
+        return the entries in each group beyond the ``keep`` newest, as
+        determined by kernel version.
+
+        :param keep: The number of entries to retain in each group.
+        :param selection: A Selection object giving selection
+                          criteria for the entries to consider.
+        :returns: A list of the ``BootEntry`` objects to remove.
+        :returntype: list
+    """
+    if keep < 0:
+        raise ValueError("Retention count cannot be negative: %d" % keep)
+
+    groups = {}
+    for be in find_entries(selection=selection):
+        groups.setdefault(_retention_key(be), []).append(be)
+
+    victims = []
+    for group in groups.values():
+        if len(group) > keep:
+            group.sort(key=_entry_age_key, reverse=True)
+            victims.extend(group[keep:])
+    return victims
+
+
+def retain_entries(keep, selection=None):
+    """Delete all but the newest entries per machine_id and root LV.
+
+        Delete the entries returned by ``find_retention_victims()`` for
+        the given ``keep`` count and ``selection`` in a single batch,
+        followed by a single legacy bootloader synchronisation.
+
+        :param keep: The number of entries to retain in each group.
+        :param selection: A Selection object giving selection
+                          criteria for the entries to consider.
+        :returns: the number of entries removed.
+        :returntype: ``int``
+    """
+    victims = find_retention_victims(keep, selection=selection)
+    if not victims:
+        return 0
+    return _delete_entry_set(victims)
 
 
 def clone_entry(selection=None, title=None, version=None, machine_id=None,
@@ -537,7 +956,8 @@ def clone_entry(selection=None, title=None, version=None, machine_id=None,
                          "machine_id, root_device, lvm_root_lv, "
                          "btrfs_subvol_path, btrfs_subvol_id, profile")
 
-    bes = find_entries(selection=selection)
+    # Two matches are enough to reject the selection as ambiguous.
+    bes = list(islice(iter_entries(selection=selection), 2))
     if not bes:
         raise ValueError("No matching entry found for boot ID %s" %
                          selection.boot_id)
@@ -573,12 +993,13 @@ def clone_entry(selection=None, title=None, version=None, machine_id=None,
     clone_be = BootEntry(title=title, machine_id=machine_id,
                          osprofile=profile, boot_params=bp,
                          allow_no_dev=allow_no_dev)
-    if find_entries(Selection(boot_id=clone_be.boot_id)):
+    dupes = iter_entries(Selection(boot_id=clone_be.boot_id))
+    if next(dupes, None) is not None:
         raise ValueError("Entry already exists (boot_id=%s)." %
                          clone_be.disp_boot_id)
 
     if write:
-        clone_be.write_entry()
+        __write_entry(clone_be)
         __write_legacy()
 
     return clone_be
@@ -635,6 +1056,28 @@ def edit_entry(selection=None, title=None, version=None, machine_id=None,
 
     be = bes[0]
 
+    _edit_entry_values(be, title, version, machine_id, root_device,
+                       lvm_root_lv, btrfs_subvol_path, btrfs_subvol_id,
+                       profile, add_opts, del_opts)
+    __write_entry(be, update=True)
+    __write_legacy()
+
+    return be
+
+
+def _edit_entry_values(be, title, version, machine_id, root_device,
+                       lvm_root_lv, btrfs_subvol_path, btrfs_subvol_id,
+                       profile, add_opts, del_opts):
+    """Apply new values to an in-memory ``BootEntry``.
+
+        Set each non-None value in the argument list on ``be`` or its
+        ``BootParams``, merging option modifications with the existing
+        add and del options. The entry is not written to disk.
+
+        See ``edit_entry()`` for a description of the arguments.
+
+        :returntype: None
+    """
     _log_debug("Editing entry with boot_id='%s'" % be.disp_boot_id)
 
     # Use a matching HostProfile is one exists, or the command line
@@ -657,10 +1100,126 @@ def edit_entry(selection=None, title=None, version=None, machine_id=None,
     be.bp.btrfs_subvol_id = btrfs_subvol_id or be.bp.btrfs_subvol_id
     be.bp.add_opts = add_opts
     be.bp.del_opts = del_opts
-    be.update_entry()
+
+
+def _save_entry_values(be):
+    """Save the values of an in-memory ``BootEntry`` that may be
+        modified by ``_edit_entry_values()``.
+
+        :param be: The ``BootEntry`` to save.
+        :returns: An opaque tuple to pass to ``_restore_entry_values()``.
+        :returntype: tuple
+    """
+    bp = be.bp
+    return (be._osp, dict(be._entry_data), be._unwritten, bp.version,
+            bp.root_device, bp.lvm_root_lv, bp.btrfs_subvol_path,
+            bp.btrfs_subvol_id, bp.add_opts, bp.del_opts)
+
+
+def _restore_entry_values(be, values):
+    """Restore the values of an in-memory ``BootEntry`` saved by
+        ``_save_entry_values()``.
+
+        :param be: The ``BootEntry`` to restore.
+        :param values: The values returned by ``_save_entry_values()``.
+        :returntype: None
+    """
+    (osp, entry_data, unwritten, version, root_device, lvm_root_lv,
+     btrfs_subvol_path, btrfs_subvol_id, add_opts, del_opts) = values
+    bp = be.bp
+    bp.version = version
+    bp.root_device = root_device
+    bp.lvm_root_lv = lvm_root_lv
+    bp.btrfs_subvol_path = btrfs_subvol_path
+    bp.btrfs_subvol_id = btrfs_subvol_id
+    bp.add_opts = add_opts
+    bp.del_opts = del_opts
+    be._osp = osp
+    be._entry_data = entry_data
+    be._dirty()
+    be._unwritten = unwritten
+
+
+def edit_entries(selection=None, title=None, version=None, machine_id=None,
+                 root_device=None, lvm_root_lv=None, btrfs_subvol_path=None,
+                 btrfs_subvol_id=None, profile=None, add_opts=None,
+                 del_opts=None):
+    """Edit all boot loader entries matching selection criteria.
+
+        Modify every BootEntry matching ``selection`` by changing one
+        or more of the entry values or boot parameters. Option
+        modifications in ``add_opts`` and ``del_opts`` are merged with
+        the existing options of each entry.
+
+        All entries are modified in memory and their new boot_id values
+        checked for collisions before any changes are made on disk: the
+        modified entries are then written, and the files for the old
+        boot_id values removed, in a single batch followed by a single
+        legacy bootloader synchronisation.
+
+        :param selection: A Selection giving criteria for the entries
+                          to edit
+        :param title: The new entry title
+        :param version: The new entry version
+        :param machine_id: The new machine_id
+        :param root_device: The new root device
+        :param lvm_root_lv: The new LVM root LV
+        :param btrfs_subvol_path: The new BTRFS subvolume path
+        :param btrfs_subvol_id: The new BTRFS subvolme ID
+        :param profile: The host or OS profile for the edited entries
+        :param add_opts: A space-separated string of kernel options to
+                         add to each entry
+        :param del_opts: A space-separated string of template-supplied
+                         options to drop from each entry
+        :returns: A list of the modified ``BootEntry`` objects
+        :returntype: list
+        :raises: ``ValueError`` if no change is requested, no entries
+                 match, or the edit would create duplicate entries.
+    """
+    all_args = (title, version, machine_id, root_device, lvm_root_lv,
+                btrfs_subvol_path, btrfs_subvol_id, profile, add_opts,
+                del_opts)
+
+    if not any(all_args):
+        raise ValueError("edit requires one or more of:\ntitle, version, "
+                         "machine_id, root_device, lvm_root_lv, "
+                         "btrfs_subvol_path, btrfs_subvol_id, profile, "
+                         "add_opts, del_opts")
+
+    bes = find_entries(selection=selection)
+    if not bes:
+        raise ValueError("No matching entry found.")
+
+    edited = set([id(be) for be in bes])
+    boot_ids = set([be.boot_id for be in find_entries()
+                    if id(be) not in edited])
+
+    saved = []
+    for be in bes:
+        saved.append((be, _save_entry_values(be)))
+        _edit_entry_values(be, title, version, machine_id, root_device,
+                           lvm_root_lv, btrfs_subvol_path, btrfs_subvol_id,
+                           profile, add_opts, del_opts)
+        if be.boot_id in boot_ids:
+            boot_id = be.disp_boot_id
+            # Discard the modifications made by this call before failing:
+            # other in-memory changes (for example, queued batch entries)
+            # are preserved.
+            for (edited_be, values) in saved:
+                _restore_entry_values(edited_be, values)
+            raise ValueError("Edit would duplicate entry (boot_id=%s)." %
+                             boot_id)
+        boot_ids.add(be.boot_id)
+
+    failed = __commit_entries(bes)
+    for (be, e) in failed:
+        _log_error("Could not write edited entry (boot_id=%s): %s" %
+                   (be.disp_boot_id, e))
+
     __write_legacy()
 
-    return be
+    failed = set([id(be) for (be, e) in failed])
+    return [be for be in bes if id(be) not in failed]
 
 
 def list_entries(selection=None):
@@ -715,8 +1274,8 @@ def print_entries(selection=None, output_fields=None, opts=None,
     """
     output_fields = _expand_fields(_default_entry_fields, output_fields)
 
-    bes = find_entries(selection=selection)
-    selected = [BoomReportObj(be, be._osp, None) for be in bes]
+    bes = iter_entries(selection=selection)
+    selected = (BoomReportObj(be, be._osp, None) for be in bes)
 
     report_fields = _entry_fields + _profile_fields + _params_fields
     return _do_print_type(report_fields, selected, output_fields=output_fields,
@@ -745,7 +1304,12 @@ def _find_profile(cmd_args, version, machine_id, command, optional=True):
     else:
         os_id = cmd_args.profile
 
-    osps = find_profiles(Selection(os_id=os_id)) if os_id else None
+    # A complete os_id is resolved without loading all profiles.
+    osp = get_os_profile_by_id(os_id) if os_id else None
+    if osp:
+        osps = [osp]
+    else:
+        osps = find_profiles(Selection(os_id=os_id)) if os_id else None
 
     # Fail if an explicit profile was given and it is not found.
     if not osps and os_id is not None and os_id == cmd_args.profile:
@@ -915,6 +1479,52 @@ def create_profile(name, short_name, version, version_id,
     osp.write_profile()
     return osp
 
+def _profile_rendered_entries(profile):
+    """Return the entries that use ``profile`` together with the
+        values of each entry that are rendered from the profile's
+        templates.
+
+        This must be called before ``profile`` is modified.
+
+        :param profile: An ``OsProfile`` or ``HostProfile``.
+        :returns: A list of ``(BootEntry, rendered)`` tuples.
+        :returntype: list
+    """
+    return [(be, be._profile_rendered_keys())
+            for be in find_profile_entries(profile)]
+
+
+def _update_profile_entries(rendered):
+    """Re-render and rewrite the entries affected by a profile edit.
+
+        Only entries whose rendered values have changed are written,
+        in a single batch followed by one legacy bootloader
+        synchronisation.
+
+        :param rendered: A list of ``(BootEntry, rendered)`` tuples returned
+                         by ``_profile_rendered_entries()`` before the
+                         profile was modified.
+        :returns: The list of updated ``BootEntry`` objects.
+        :returntype: list
+    """
+    bes = [be for (be, values) in rendered
+           if be._rerender_profile_keys(values)]
+    if not bes:
+        return []
+
+    failed = __commit_entries(bes)
+    for (be, e) in failed:
+        _log_error("Could not write updated entry (boot_id=%s): %s" %
+                   (be.disp_boot_id, e))
+
+    __write_legacy()
+
+    _log_info("Updated %d entries following profile edit" %
+              (len(bes) - len(failed)))
+    failed = set([id(be) for (be, e) in failed])
+    return [be for be in bes if id(be) not in failed]
+
+
 def delete_profiles(selection=None):
     """Delete profiles matching selection criteria.
 
@@ -941,6 +1551,10 @@ def delete_profiles(selection=None):
 
     deleted = 0
     for osp in osps:
+        nr_entries = len(find_profile_entries(osp))
+        if nr_entries:
+            _log_warn("Deleting OsProfile(os_id=%s) orphans %d boot "
+                      "entries" % (osp.disp_os_id, nr_entries))
         osp.delete_profile()
         deleted += 1
 
@@ -1035,7 +1649,8 @@ def edit_profile(selection=None, uname_pattern=None, kernel_pattern=None,
         profile values.
 
         The modified OsProfile is written to disk and returned on
-        success.
+        success. Boot entries rendered from the profile's templates are
+        re-rendered and any that change are rewritten.
 
         :param selection: A Selection specifying the boot_id to edit
         :param uname_pattern: The new uname pattern
@@ -1059,6 +1674,7 @@ def edit_profile(selection=None, uname_pattern=None, kernel_pattern=None,
                          selection.os_id)
 
     osp = osps.pop()
+    rendered = _profile_rendered_entries(osp)
     osp.uname_pattern = uname_pattern or osp.uname_pattern
     osp.kernel_pattern = kernel_pattern or osp.kernel_pattern
     osp.initramfs_pattern = initramfs_pattern or osp.initramfs_pattern
@@ -1066,6 +1682,7 @@ def edit_profile(selection=None, uname_pattern=None, kernel_pattern=None,
     osp.root_opts_btrfs = root_opts_btrfs or osp.root_opts_btrfs
     osp.options = options or osp.options
     osp.write_profile()
+    _update_profile_entries(rendered)
     return osp
 
 
@@ -1225,6 +1842,10 @@ def delete_hosts(selection=None):
 
     deleted = 0
     for hp in hps:
+        nr_entries = len(find_profile_entries(hp))
+        if nr_entries:
+            _log_warn("Deleting HostProfile(host_id=%s) affects %d boot "
+                      "entries" % (hp.disp_host_id, nr_entries))
         hp.delete_profile()
         deleted += 1
 
@@ -1330,7 +1951,8 @@ def edit_host(selection=None, machine_id=None, os_id=None, host_name=None,
         profile values.
 
         The modified HostProfile is written to disk and returned on
-        success.
+        success. Boot entries rendered from the profile's templates are
+        re-rendered and any that change are rewritten.
 
         :param selection: A Selection specifying the boot_id to edit
         :param machine_id: The machine id for the edited host profile
@@ -1359,6 +1981,7 @@ def edit_host(selection=None, machine_id=None, os_id=None, host_name=None,
                          selection.os_id)
 
     hp = hps.pop()
+    rendered = _profile_rendered_entries(hp)
     hp.delete_profile()
     hp.machine_id = machine_id or hp.os_id
     hp.host_name = host_name or hp.host_name
@@ -1370,6 +1993,7 @@ def edit_host(selection=None, machine_id=None, os_id=None, host_name=None,
     hp.root_opts_btrfs = root_opts_btrfs or hp.root_opts_btrfs
     hp.options = options or hp.options
     hp.write_profile()
+    _update_profile_entries(rendered)
     return hp
 
 
@@ -1441,6 +2065,105 @@ def _apply_profile_overrides(boot_entry, cmd_args):
         boot_entry.initrd = cmd_args.initrd
         modified = True
 
+#: Keys accepted in entry manifest objects.
+_manifest_keys = [
+    "title", "version", "machine_id", "root_device", "lvm_root_lv",
+    "btrfs_subvol_path", "btrfs_subvol_id", "profile", "add_opts",
+    "del_opts"
+]
+
+
+def _manifest_specs(manifest_file, cmd_args):
+    """Read entry specifications from a manifest file.
+
+        A manifest contains either a JSON list of objects, or one JSON
+        object per line. Each object uses the argument names of
+        ``create_entry()``: values that are not given in the manifest
+        are taken from the command line arguments.
+
+        :param manifest_file: An open manifest file.
+        :param cmd_args: Command line arguments for the command
+        :returns: A list of ``create_entries()`` specifications.
+        :raises: ``ValueError`` if the manifest is invalid.
+    """
+    data = manifest_file.read()
+    if data.lstrip().startswith("["):
+        objs = json.loads(data)
+    else:
+        objs = [json.loads(line) for line in data.splitlines()
+                if not blank_or_comment(line.strip())]
+
+    defaults = {
+        "title": cmd_args.title,
+        "version": cmd_args.version,
+        "machine_id": cmd_args.machine_id,
+        "root_device": cmd_args.root_device,
+        "lvm_root_lv": cmd_args.root_lv,
+        "profile": cmd_args.profile,
+        "add_opts": cmd_args.add_opts,
+        "del_opts": cmd_args.del_opts
+    }
+    (defaults["btrfs_subvol_path"],
+     defaults["btrfs_subvol_id"]) = _subvol_from_arg(cmd_args.btrfs_subvolume)
+
+    specs = []
+    for obj in objs:
+        if not isinstance(obj, dict):
+            raise ValueError("Manifest entries must be JSON objects")
+        spec = dict(defaults)
+        for (key, value) in obj.items():
+            key = str(key)
+            if key not in _manifest_keys:
+                raise ValueError("Unknown manifest key: %s" % key)
+            # JSON strings are unicode on Python 2: use the native str.
+            if not isinstance(value, str) and hasattr(value, "encode"):
+                value = value.encode("utf8")
+            spec[key] = value
+        if spec["lvm_root_lv"]:
+            spec["lvm_root_lv"] = _canonicalize_lv_name(spec["lvm_root_lv"])
+            if "root_device" not in obj:
+                spec["root_device"] = DEV_PATTERN % spec["lvm_root_lv"]
+        specs.append(spec)
+    return specs
+
+
+def _create_manifest_cmd(cmd_args):
+    """Create entries from a manifest file.
+
+        :param cmd_args: Command line arguments for the command
+        :returns: integer status code returned from ``main()``
+    """
+    try:
+        with open(cmd_args.manifest, "r") as manifest_file:
+            specs = _manifest_specs(manifest_file, cmd_args)
+    except (IOError, OSError, ValueError) as e:
+        print(e)
+        return 1
+
+    machine_id = None
+    version = None
+    for spec in specs:
+        if not spec["version"]:
+            spec["version"] = version = version or get_uts_release()
+        if not spec["machine_id"]:
+            # Use host machine-id by default
+            spec["machine_id"] = machine_id = machine_id or _get_machine_id()
+            if not machine_id:
+                print("Could not determine machine_id")
+                return 1
+
+    results = create_entries(specs, allow_no_dev=cmd_args.no_dev)
+
+    status = 0
+    for (nr, (be, error)) in enumerate(results, 1):
+        if error:
+            print("Entry %d: %s" % (nr, error))
+            status = 1
+        else:
+            print("Created entry with boot_id %s" % be.disp_boot_id)
+    return status
+
+
 def _create_cmd(cmd_args, select, opts, identifier):
     """Create entry command handler.
 
@@ -1460,6 +2183,9 @@ def _create_cmd(cmd_args, select, opts, identifier):
         print("entry create does not accept <identifier>")
         return 1
 
+    if cmd_args.manifest:
+        return _create_manifest_cmd(cmd_args)
+
     if not cmd_args.version:
         version = get_uts_release()
         if not version:
@@ -1523,7 +2249,7 @@ def _create_cmd(cmd_args, select, opts, identifier):
     _apply_profile_overrides(be, cmd_args)
 
     try:
-        be.write_entry()
+        __write_entry(be)
         __write_legacy()
     except Exception as e:
         if cmd_args.debug:
@@ -1556,6 +2282,15 @@ def _delete_cmd(cmd_args, select, opts, identifier):
         print("delete requires selection criteria")
         return 1
 
+    if cmd_args.keep is not None:
+        try:
+            nr = retain_entries(cmd_args.keep, selection=select)
+        except ValueError as e:
+            print(e)
+            return 1
+        print("Deleted %d entr%s" % (nr, "y" if nr == 1 else "ies"))
+        return 0
+
     if cmd_args.options:
         fields = cmd_args.options
     elif cmd_args.verbose:
@@ -1636,7 +2371,7 @@ def _clone_cmd(cmd_args, select, opts, identifier):
     _apply_profile_overrides(be, cmd_args)
 
     try:
-        be.write_entry()
+        __write_entry(be)
         __write_legacy()
     except Exception as e:
         if cmd_args.debug:
@@ -1709,6 +2444,62 @@ def _list_cmd(cmd_args, select, opts, identifier):
     return 0
 
 
+def _edit_all_cmd(cmd_args, select, identifier):
+    """Edit all entries command handler.
+
+        Apply the entry values and option modifications supplied in
+        ``cmd_args`` to every entry matching the ``boot_id`` prefix
+        given by ``identifier`` or ``--boot-id`` and the ``--select``
+        expression in ``select``. Entry values given on the command
+        line are new values and not selection criteria.
+
+        At least one of a ``boot_id`` or a ``--select`` expression is
+        required: to edit every entry use ``--select 'boot_id=*'``.
+
+        :param cmd_args: Command line arguments for the command
+        :param select: Selection criteria for the entries to edit
+        :param identifier: An optional ``boot_id`` prefix
+        :returns: integer status code returned from ``main()``
+    """
+    boot_id = identifier or cmd_args.boot_id
+    expr = select.expr if select else None
+    select = Selection(boot_id=boot_id, expr=expr)
+    if select.is_null():
+        print("edit --all requires selection criteria: use "
+              "--select 'boot_id=*' to edit every entry")
+        return 1
+
+    subvol = cmd_args.btrfs_subvolume
+    (btrfs_subvol_path, btrfs_subvol_id) = _subvol_from_arg(subvol)
+
+    profile = None
+    if cmd_args.profile:
+        profile = _find_profile(cmd_args, cmd_args.version,
+                                cmd_args.machine_id, "edit")
+        if not profile:
+            return 1
+
+    try:
+        bes = edit_entries(selection=select, title=cmd_args.title,
+                           version=cmd_args.version,
+                           machine_id=cmd_args.machine_id,
+                           root_device=cmd_args.root_device,
+                           lvm_root_lv=cmd_args.root_lv,
+                           btrfs_subvol_path=btrfs_subvol_path,
+                           btrfs_subvol_id=btrfs_subvol_id, profile=profile,
+                           add_opts=cmd_args.add_opts,
+                           del_opts=cmd_args.del_opts)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print("Edited %d entries" % len(bes))
+    if cmd_args.verbose:
+        for be in bes:
+            print("  boot_id now: %s" % be.disp_boot_id)
+    return 0
+
+
 def _edit_cmd(cmd_args, select, opts, identifier):
     """Edit entry command handler.
 
@@ -1721,6 +2512,9 @@ def _edit_cmd(cmd_args, select, opts, identifier):
         :param select: The ``boot_id`` of the entry to edit
         :returns: integer status code returned from ``main()``
     """
+    if cmd_args.all:
+        return _edit_all_cmd(cmd_args, select, identifier)
+
     identifier = identifier or cmd_args.boot_id
     if identifier is not None:
         select = Selection(boot_id=identifier)
@@ -1760,7 +2554,7 @@ def _edit_cmd(cmd_args, select, opts, identifier):
     _apply_profile_overrides(be, cmd_args)
 
     try:
-        be.write_entry()
+        __write_entry(be)
         __write_legacy()
     except Exception as e:
         if cmd_args.debug:
@@ -2287,8 +3081,7 @@ def _write_legacy_cmd(cmd_args, select, opts, identifier):
         return 1
     config = get_boom_config()
     try:
-        clear_legacy_loader()
-        write_legacy_loader(selection=select, loader=config.legacy_format)
+        sync_legacy_loader(selection=select, loader=config.legacy_format)
     except Exception as e:
         print(e)
         return 1
@@ -2317,6 +3110,27 @@ def _show_legacy_cmd(cmd_args, select, opts, identifier):
     show_legacy(selection=select, loader=config.legacy_format)
 
 
+def _batch_cmd(cmd_args, select, opts, identifier):
+    """Execute a batch of boom commands read from a file or stdin.
+
+        :param cmd_args: Command line arguments for the command
+        :returns: integer status code returned from ``main()``
+    """
+    if identifier and identifier != "-":
+        try:
+            batch_file = open(identifier, "r")
+        except (IOError, OSError) as e:
+            print(e)
+            return 1
+    else:
+        batch_file = sys.stdin
+
+    try:
+        return run_batch(batch_file)
+    finally:
+        if batch_file is not sys.stdin:
+            batch_file.close()
+
 boom_usage = """%(prog}s [type] <command> [options]\n\n"
                 [entry] create <title> <version> [--osprofile=os_id] [...]
                 [entry] delete [title|version|boot_id|os_id]
@@ -2333,6 +3147,7 @@ boom_usage = """%(prog}s [type] <command> [options]\n\n"
                 host edit [...]
                 legacy write [...]
                 legacy delete [...]
+                batch [file]
              """
 
 CREATE_CMD = "create"
@@ -2344,11 +3159,13 @@ LIST_CMD = "list"
 EDIT_CMD = "edit"
 
 WRITE_CMD = "write"
+RUN_CMD = "run"
 
 ENTRY_TYPE = "entry"
 PROFILE_TYPE = "profile"
 HOST_TYPE = "host"
 LEGACY_TYPE = "legacy"
+BATCH_TYPE = "batch"
 
 _boom_entry_commands = [
     (CREATE_CMD, _create_cmd),
@@ -2383,13 +3200,21 @@ _boom_legacy_commands = [
     (SHOW_CMD, _show_legacy_cmd)
 ]
 
+_boom_batch_commands = [
+    (RUN_CMD, _batch_cmd)
+]
+
 _boom_command_types = [
     (ENTRY_TYPE, _boom_entry_commands),
     (PROFILE_TYPE, _boom_profile_commands),
     (HOST_TYPE, _boom_host_commands),
-    (LEGACY_TYPE, _boom_legacy_commands)
+    (LEGACY_TYPE, _boom_legacy_commands),
+    (BATCH_TYPE, _boom_batch_commands)
 ]
 
+#: Commands that only read boom data and may run under a shared lock.
+_read_only_commands = [SHOW_CMD, LIST_CMD]
+
 
 def _id_from_arg(cmd_args, cmdtype, cmd):
     if cmd == CREATE_CMD:
@@ -2475,6 +3300,7 @@ def set_debug(debug_arg):
         "entry": BOOM_DEBUG_ENTRY,
         "report": BOOM_DEBUG_REPORT,
         "command": BOOM_DEBUG_COMMAND,
+        "perf": BOOM_DEBUG_PERF,
         "all": BOOM_DEBUG_ALL
     }
 
@@ -2486,14 +3312,32 @@ def set_debug(debug_arg):
     set_debug_mask(mask)
 
 
-def main(args):
-    global _boom_entry_commands, _boom_profile_commands, _boom_command_types
-    parser = ArgumentParser(prog=basename(args[0]),
-                            description="Boom Boot Manager")
+def _insert_default_type(args):
+    """Insert an implicit command type into an argument list.
+
+        Boot entry commands may be given without a type ("boom list"),
+        and the batch type has a single, implicit command ("boom batch").
+        Modify ``args`` in-place to contain the full command form.
 
+        :param args: A ``main()`` style argument list.
+        :returntype: None
+    """
     # Default type is boot entry.
     if len(args) > 1 and _match_command(args[1], _boom_entry_commands):
-        args.insert(1, "entry")
+        args.insert(1, ENTRY_TYPE)
+    elif len(args) > 1 and args[1] == BATCH_TYPE:
+        if len(args) == 2 or args[2] != RUN_CMD:
+            args.insert(2, RUN_CMD)
+
+
+def _make_parser(prog):
+    """Create the boom command line ``ArgumentParser``.
+
+        :param prog: The program name to use in messages.
+        :returns: A new ``ArgumentParser`` for boom commands.
+        :returntype: ``ArgumentParser``
+    """
+    parser = ArgumentParser(prog=prog, description="Boom Boot Manager")
 
     parser.add_argument("type", metavar="[TYPE]", type=str,
                         help="The command type to run: profile or entry",
@@ -2506,6 +3350,8 @@ def main(args):
                         "operate on", nargs="?", default=None)
     parser.add_argument("-a", "--add-opts", "--addopts", metavar="OPTIONS",
                         help="Additional kernel options to append", type=str)
+    parser.add_argument("--all", action="store_true",
+                        help="Edit all entries matching the selection")
     parser.add_argument("-b", "--boot-id", "--bootid", metavar="BOOT_ID",
                         type=str, help="The BOOT_ID of a boom boot entry")
     parser.add_argument("--boot-dir", "--bootdir", metavar="PATH", type=str,
@@ -2517,6 +3363,9 @@ def main(args):
                         help="A template option string for BTRFS devices")
     parser.add_argument("-c", "--config", metavar="FILE", type=str,
                         help="Path to a boom configuration file", default=None)
+    parser.add_argument("--cprofile", metavar="FILE", type=str,
+                        help="Write cProfile statistics for the command "
+                        "to FILE")
     parser.add_argument("-d", "--del-opts", "--delopts", metavar="OPTIONS",
                         help="List of kernel options to be dropped", type=str)
     parser.add_argument("--debug", metavar="DEBUGOPTS", type=str,
@@ -2533,6 +3382,9 @@ def main(args):
     parser.add_argument("-k", "--kernel-pattern", "--kernelpattern",
                         metavar="PATTERN", type=str,
                         help="A pattern for generating kernel paths")
+    parser.add_argument("--keep", metavar="COUNT", type=int,
+                        help="Delete all but the newest COUNT entries for "
+                        "each machine_id and root LV")
     parser.add_argument("--label", metavar="LABEL", type=str,
                         help="Host profile label")
     parser.add_argument("-l", "--linux", metavar="IMG", type=str,
@@ -2541,6 +3393,8 @@ def main(args):
                         help="An LVM2 root logical volume")
     parser.add_argument("--lvm-opts", "--lvmopts", metavar="OPTS", type=str,
                         help="A template option string for LVM2 devices")
+    parser.add_argument("--manifest", metavar="FILE", type=str,
+                        help="A manifest of boot entries to create")
     parser.add_argument("-m", "--machine-id", "--machineid",
                         metavar="MACHINE_ID", type=str,
                         help="The machine_id value to use")
@@ -2576,6 +3430,8 @@ def main(args):
                         "paths", metavar="PATTERN")
     parser.add_argument("--rows", action="store_true",
                         help="Output report columnes as rows")
+    parser.add_argument("--select", metavar="EXPR", type=str,
+                        help="A selection expression to match")
     parser.add_argument("--separator", metavar="SEP", type=str,
                         help="Report field separator")
     parser.add_argument("-s", "--short-name", "--shortname",
@@ -2591,28 +3447,20 @@ def main(args):
     parser.add_argument("-v", "--version", metavar="VERSION", type=str,
                         help="The kernel version of a boom "
                         "boot entry")
-    cmd_args = parser.parse_args()
+    return parser
 
-    try:
-        set_debug(cmd_args.debug)
-    except ValueError as e:
-        print(e)
-        return 1
-    setup_logging(cmd_args)
-    cmd_type = _match_cmd_type(cmd_args.type)
 
-    if cmd_args.boot_dir or BOOM_BOOT_PATH_ENV in environ:
-        boot_path = cmd_args.boot_dir or environ[BOOM_BOOT_PATH_ENV]
-        if not isabs(boot_path):
-            boot_path = join(getcwd(), boot_path)
-        set_boot_path(boot_path)
-        set_boom_config_path("boom.conf")
-
-    if cmd_args.config:
-        set_boom_config_path(cmd_args.config)
+def _canonicalize_root_args(cmd_args):
+    """Canonicalize the root LV and root device arguments.
 
-    load_boom_config(path=cmd_args.config)
+        Parse an LV name from ``root_lv`` and re-write the root
+        device, or parse an LV name from ``root_device`` and set
+        ``root_lv``, if one is found.
 
+        :param cmd_args: Command line arguments for the command
+        :returns: 0 on success or 1 on error
+        :returntype: int
+    """
     # Parse an LV name from root_lv and re-write the root_device if found
     if cmd_args.root_lv:
         try:
@@ -2637,6 +3485,241 @@ def main(args):
         except ValueError:
             # No valid VG name
             pass
+    return 0
+
+
+#: Argument names that apply to a whole boom invocation and that may
+#: not be changed by individual commands in a batch.
+_batch_global_args = ["boot_dir", "config", "cprofile", "debug"]
+
+#: The optional JSON Lines key used to correlate batch results.
+BATCH_TAG_KEY = "tag"
+
+
+def _batch_cmd_args(parser, line):
+    """Parse one line of batch input into command arguments.
+
+        A line beginning with '{' is parsed as a JSON object mapping
+        argument names (as used in the ``cmd_args`` namespace) to
+        values, with optional "type", "command" and "tag" keys. Any
+        other line is split using shell quoting rules and parsed as a
+        ``boom`` command line without the program name.
+
+        :param parser: The ``ArgumentParser`` to use.
+        :param line: The line of batch input to parse.
+        :returns: A ``(cmd_args, tag)`` tuple.
+        :raises: ValueError if the line cannot be parsed.
+    """
+    tag = None
+    if line.startswith("{"):
+        cmd_obj = json.loads(line)
+        if not isinstance(cmd_obj, dict):
+            raise ValueError("Batch command must be a JSON object")
+        tag = cmd_obj.pop(BATCH_TAG_KEY, None)
+        cmd_type = cmd_obj.pop("type", ENTRY_TYPE)
+        command = cmd_obj.pop("command", None)
+        if not command:
+            raise ValueError("Batch command object requires 'command'")
+        cmd_args = parser.parse_args([str(cmd_type), str(command)])
+        for (name, value) in cmd_obj.items():
+            name = str(name)
+            if not hasattr(cmd_args, name):
+                raise ValueError("Unknown batch command argument: %s" % name)
+            # JSON strings are unicode on Python 2: use the native str.
+            if not isinstance(value, str) and hasattr(value, "encode"):
+                value = value.encode("utf8")
+            setattr(cmd_args, name, value)
+    else:
+        args = ["boom"] + shlex.split(line)
+        _insert_default_type(args)
+        cmd_args = parser.parse_args(args[1:])
+
+    for name in _batch_global_args:
+        if getattr(cmd_args, name):
+            raise ValueError("Argument '%s' is not permitted in a batch" %
+                             name)
+    return (cmd_args, tag)
+
+
+def _run_batch_command(parser, line):
+    """Run a single command from a batch.
+
+        Parse and execute the command in ``line`` against the current
+        boom state, capturing the output of the command.
+
+        :param parser: The ``ArgumentParser`` to use.
+        :param line: The line of batch input to execute.
+        :returns: A ``(status, tag, output, error)`` tuple.
+    """
+    (status, tag, error) = (1, None, None)
+    output = StringIO()
+    (stdout, stderr) = (sys.stdout, sys.stderr)
+    sys.stdout = sys.stderr = output
+    try:
+        (cmd_args, tag) = _batch_cmd_args(parser, line)
+        cmd_type = _match_cmd_type(cmd_args.type)
+        if not cmd_type or cmd_type[0] == BATCH_TYPE:
+            raise ValueError("Invalid batch command type: %s" %
+                             cmd_args.type)
+        command = _match_command(cmd_args.command, cmd_type[1])
+        if not command:
+            raise ValueError("Unknown command: %s %s" %
+                             (cmd_type[0], cmd_args.command))
+        if not _canonicalize_root_args(cmd_args):
+            select = Selection.from_cmd_args(cmd_args)
+            opts = _report_opts_from_args(cmd_args)
+            opts.report_file = output
+            identifier = _id_from_arg(cmd_args, cmd_type[0], command[0])
+            status = command[1](cmd_args, select, opts, identifier) or 0
+    except SystemExit:
+        # ArgumentParser errors: report the final line of the message.
+        lines = output.getvalue().strip().splitlines()
+        error = lines[-1] if lines else "Invalid command arguments"
+        output = StringIO()
+    except Exception as e:
+        error = str(e)
+    finally:
+        (sys.stdout, sys.stderr) = (stdout, stderr)
+
+    return (status, tag, output.getvalue(), error)
+
+
+def run_batch(batch_file, out_file=None):
+    """Execute a batch of boom commands.
+
+        Read commands from ``batch_file``, one per line, and execute
+        them in order against a single loaded boom state. Each command
+        line uses either the argument vocabulary of the ``boom``
+        command (without the program name, for example "create
+        --title Snap --version 4.16.11-100.fc26.x86_64 -L vg/snap"),
+        or is a JSON object mapping argument names to values. Blank
+        lines and comments are ignored.
+
+        Boot entries are loaded once when the batch starts. Entries
+        created, modified and deleted by the commands in the batch are
+        updated in memory and written out together by a single call to
+        ``commit_entries()`` once all of the commands have run, and
+        legacy bootloader synchronisation is then carried out once.
+
+        One result is written to ``out_file`` for each command, as a
+        JSON object on a single line, containing the input line number,
+        the command status, any output generated by the command, an
+        error message if the command failed, and the value of the
+        "tag" key for JSON commands. Since entries are only written
+        once all commands have run, a zero command status means that
+        the command's changes were queued: if any queued entry cannot
+        be written a final result is written with a null line number,
+        a status of 1, an error message and a "lines" key listing the
+        input lines whose changes were not written.
+
+        :param batch_file: An iterable of command lines.
+        :param out_file: The file to write results to (default stdout).
+        :returns: 0 if all commands succeeded or 1 otherwise.
+        :returntype: int
+    """
+    global _legacy_deferred, _legacy_pending, _batch_writes, _batch_unlinks
+    global _batch_line, _batch_lines
+    out_file = out_file or sys.stdout
+    parser = _make_parser("boom")
+    status = 0
+
+    # Queued entries must be visible to later commands in the batch.
+    load_entries()
+
+    _legacy_deferred = True
+    _legacy_pending = False
+    (_batch_writes, _batch_unlinks) = ([], [])
+    _batch_lines = {}
+    try:
+        for (line_nr, line) in enumerate(batch_file, 1):
+            line = line.strip()
+            if blank_or_comment(line):
+                continue
+            _batch_line = line_nr
+            result = _run_batch_command(parser, line)
+            (cmd_status, tag, output, error) = result
+            _log_debug_cmd("Batch line %d exited with status %d" %
+                           (line_nr, cmd_status))
+            batch_result = {
+                "line": line_nr,
+                "status": cmd_status,
+                "output": output
+            }
+            if tag is not None:
+                batch_result[BATCH_TAG_KEY] = tag
+            if error:
+                batch_result["error"] = error
+            if cmd_status:
+                status = 1
+            out_file.write(json.dumps(batch_result, sort_keys=True) + "\n")
+            out_file.flush()
+    finally:
+        _legacy_deferred = False
+        failed = __commit_batch()
+        failed_lines = __batch_failed_lines(failed)
+        (_batch_line, _batch_lines) = (None, None)
+
+    for (be, e) in failed:
+        _log_error("Could not write entry (boot_id=%s): %s" %
+                   (be.disp_boot_id, e))
+        status = 1
+
+    if failed:
+        batch_result = {
+            "line": None,
+            "status": 1,
+            "output": "",
+            "error": "Could not write entries queued by lines: %s" %
+                     ", ".join(str(line_nr) for line_nr in failed_lines),
+            "lines": failed_lines
+        }
+        out_file.write(json.dumps(batch_result, sort_keys=True) + "\n")
+        out_file.flush()
+
+    if _legacy_pending:
+        _legacy_pending = False
+        try:
+            __write_legacy()
+        except Exception as e:
+            _log_error("Legacy synchronisation failed: %s" % e)
+            return 1
+    return status
+
+
+def main(args):
+    global _boom_entry_commands, _boom_profile_commands, _boom_command_types
+    parser = _make_parser(basename(args[0]))
+
+    _insert_default_type(args)
+
+    cmd_args = parser.parse_args(args[1:])
+
+    reset_io_counts()
+    reset_perf_metrics()
+
+    try:
+        set_debug(cmd_args.debug)
+    except ValueError as e:
+        print(e)
+        return 1
+    setup_logging(cmd_args)
+    cmd_type = _match_cmd_type(cmd_args.type)
+
+    if cmd_args.boot_dir or BOOM_BOOT_PATH_ENV in environ:
+        boot_path = cmd_args.boot_dir or environ[BOOM_BOOT_PATH_ENV]
+        if not isabs(boot_path):
+            boot_path = join(getcwd(), boot_path)
+        set_boot_path(boot_path)
+        set_boom_config_path("boom.conf")
+
+    if cmd_args.config:
+        set_boom_config_path(cmd_args.config)
+
+    with PerfTimer(PERF_CONFIG_LOAD):
+        load_boom_config(path=cmd_args.config)
+
+    if _canonicalize_root_args(cmd_args):
+        return 1
 
     if not cmd_type:
         print("Unknown command type: %s" % cmd_args.type)
@@ -2648,26 +3731,52 @@ def main(args):
         print("Unknown command: %s %s" % (cmd_type[0], cmd_args.command))
         return 1
 
-    select = Selection.from_cmd_args(cmd_args)
+    try:
+        select = Selection.from_cmd_args(cmd_args)
+    except ValueError as e:
+        print(e)
+        return 1
     opts = _report_opts_from_args(cmd_args)
     identifier = _id_from_arg(cmd_args, cmd_type[0], command[0])
     status = 1
 
+    if cmd_args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Read-only commands share the boom lock: all others are exclusive.
+    exclusive = command[0] not in _read_only_commands
+
     if cmd_args.debug:
-        status = command[1](cmd_args, select, opts, identifier)
+        with BoomLock(exclusive=exclusive):
+            status = command[1](cmd_args, select, opts, identifier)
     else:
         try:
-            status = command[1](cmd_args, select, opts, identifier)
+            with BoomLock(exclusive=exclusive):
+                status = command[1](cmd_args, select, opts, identifier)
         except Exception as e:
             _log_error("Command failed: %s" % e)
 
+    if cmd_args.cprofile:
+        profiler.disable()
+        try:
+            profiler.dump_stats(cmd_args.cprofile)
+        except (IOError, OSError) as e:
+            _log_error("Could not write cProfile data to '%s': %s" %
+                       (cmd_args.cprofile, e))
+
+    if perf_enabled():
+        print(format_perf_metrics(), file=sys.stderr)
+
     shutdown_logging()
     sys.exit(status)
 
 __all__ = [
     # BootEntry manipulation
-    'create_entry', 'delete_entries', 'clone_entry', 'edit_entry',
-    'list_entries', 'print_entries',
+    'create_entry', 'create_entries', 'delete_entries', 'clone_entry',
+    'edit_entry', 'edit_entries', 'list_entries', 'print_entries',
+    'find_retention_victims', 'retain_entries',
 
     # OsProfile manipulation
     'create_profile', 'delete_profiles', 'clone_profile', 'edit_profile',
@@ -2675,7 +3784,10 @@ __all__ = [
 
     # HostProfile manipulation
     'create_host', 'delete_hosts', 'clone_host', 'edit_host',
-    'list_hosts', 'print_hosts'
+    'list_hosts', 'print_hosts',
+
+    # Batch command mode
+    'run_batch'
 ]
 
 # vim: set et ts=4 sw=4 :
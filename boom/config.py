@@ -31,6 +31,11 @@ from tempfile import mkstemp
 from errno import ENOENT
 import logging
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 try:
     # Python2
     from ConfigParser import SafeConfigParser as ConfigParser, ParsingError
@@ -64,6 +69,8 @@ _CFG_SECT_GLOBAL = "global"
 _CFG_SECT_LEGACY = "legacy"
 _CFG_BOOT_ROOT = "boot_root"
 _CFG_BOOM_ROOT = "boom_root"
+_CFG_LOCK_TIMEOUT = "lock_timeout"
+_CFG_ENTRY_ROOTS = "entry_roots"
 _CFG_LEGACY_ENABLE = "enable"
 _CFG_LEGACY_FMT = "format"
 _CFG_LEGACY_SYNC = "sync"
@@ -101,6 +108,18 @@ def _read_boom_config(path=None):
         if cfg.has_option(_CFG_SECT_GLOBAL, _CFG_BOOM_ROOT):
             _log_debug("Found global.boom_path")
             bc.boom_path = cfg.get(_CFG_SECT_GLOBAL, _CFG_BOOM_ROOT)
+        if cfg.has_option(_CFG_SECT_GLOBAL, _CFG_LOCK_TIMEOUT):
+            _log_debug("Found global.lock_timeout")
+            timeout = cfg.get(_CFG_SECT_GLOBAL, _CFG_LOCK_TIMEOUT)
+            try:
+                bc.lock_timeout = float(timeout)
+            except ValueError:
+                raise ValueError("Invalid lock_timeout value in %s: %s" %
+                                 (path, timeout))
+        if cfg.has_option(_CFG_SECT_GLOBAL, _CFG_ENTRY_ROOTS):
+            _log_debug("Found global.entry_roots")
+            roots = cfg.get(_CFG_SECT_GLOBAL, _CFG_ENTRY_ROOTS)
+            bc.entry_roots = roots.replace(",", " ").split() or None
 
     if cfg.has_section(_CFG_SECT_LEGACY):
         if cfg.has_option(_CFG_SECT_LEGACY, _CFG_LEGACY_ENABLE):
@@ -151,6 +170,14 @@ def _sync_config(bc, cfg):
         cfg.set(_CFG_SECT_GLOBAL, _CFG_BOOT_ROOT, bc.boot_path)
     if attr_has_value(bc, "boom_path"):
         cfg.set(_CFG_SECT_GLOBAL, _CFG_BOOM_ROOT, bc.boom_path)
+    if attr_has_value(bc, "lock_timeout"):
+        # Only write a non-default timeout, or one already in the file.
+        if (bc.lock_timeout != DEFAULT_LOCK_TIMEOUT or
+                cfg.has_option(_CFG_SECT_GLOBAL, _CFG_LOCK_TIMEOUT)):
+            cfg.set(_CFG_SECT_GLOBAL, _CFG_LOCK_TIMEOUT,
+                    str(bc.lock_timeout))
+    if attr_has_value(bc, "entry_roots"):
+        cfg.set(_CFG_SECT_GLOBAL, _CFG_ENTRY_ROOTS, ", ".join(bc.entry_roots))
     if attr_has_value(bc, "legacy_enable"):
         cfg.set(_CFG_SECT_LEGACY, _CFG_LEGACY_ENABLE, yes_no(bc.legacy_enable))
     if attr_has_value(bc, "legacy_format"):
@@ -178,11 +205,13 @@ def write_boom_config(config=None, path=None):
         :param path: the configuration file to read, or None to read the
                      currently configured config file path
 
+        The file is not rewritten if it already contains the rendered
+        configuration.
+
         :returntype: None
     """
     path = path or get_boom_config_path()
     cfg_dir = dirname(path)
-    (tmp_fd, tmp_path) = mkstemp(prefix="boom", dir=cfg_dir)
 
     config = config or get_boom_config()
 
@@ -191,8 +220,17 @@ def write_boom_config(config=None, path=None):
     else:
         _sync_config(config, config._cfg)
 
+    buf = StringIO()
+    config._cfg.write(buf)
+    data = buf.getvalue()
+
+    if io_elide_write(path, data, BOOT_CONFIG_MODE):
+        return
+
+    (tmp_fd, tmp_path) = mkstemp(prefix="boom", dir=cfg_dir)
     with fdopen(tmp_fd, "w") as f_tmp:
-        config._cfg.write(f_tmp)
+        f_tmp.write(data)
+        f_tmp.flush()
         fdatasync(tmp_fd)
 
     try:
@@ -33,12 +33,16 @@ from __future__ import print_function
 
 from boom import *
 from boom.osprofile import *
+from boom.osprofile import _init_profiles
+from boom._boom import (_register_context_state, _find_profile_file,
+                        _have_profile_snapshot)
 
 from hashlib import sha1
 from os import listdir
 from tempfile import mkstemp
 from os.path import basename, join as path_join, exists as path_exists
 from os import fdopen, rename, chmod, unlink, fdatasync
+from operator import attrgetter
 import logging
 import string
 import re
@@ -189,6 +193,10 @@ def drop_host_profiles():
     _host_profiles_by_host_id = {}
     _profiles_loaded = False
 
+_register_context_state(__name__, ["_host_profiles", "_host_profiles_by_id",
+                                    "_host_profiles_by_host_id",
+                                    "_profiles_loaded"], drop_host_profiles)
+
 
 def load_host_profiles():
     """Load HostProfile data from disk.
@@ -204,14 +212,74 @@ def load_host_profiles():
 
         :returns: None
     """
+    global _profiles_loaded
+    # Host profiles loaded on demand may already be bound to entries.
+    on_demand = {} if _profiles_loaded else dict(_host_profiles_by_host_id)
     drop_host_profiles()
     profiles_path = boom_host_profiles_path()
-    load_profiles_for_class(HostProfile, "Host", profiles_path, "host")
+    with PerfTimer(PERF_HOST_LOAD):
+        load_profiles_for_class(HostProfile, "Host", profiles_path, "host")
 
+    _adopt_host_profiles(on_demand)
     _profiles_loaded = True
     _log_info("Loaded %d host profiles" % len(_host_profiles))
 
 
+def _adopt_host_profiles(on_demand):
+    """Replace newly loaded host profiles with host profiles loaded on
+        demand.
+
+        :param on_demand: A dictionary mapping ``host_id`` values to the
+                          host profiles loaded on demand.
+        :returns: None
+    """
+    for (i, hp) in enumerate(_host_profiles):
+        if hp.host_id not in on_demand:
+            continue
+        old_hp = on_demand[hp.host_id]
+        _host_profiles[i] = old_hp
+        _host_profiles_by_id[hp.machine_id][hp.label] = old_hp
+        _host_profiles_by_host_id[hp.host_id] = old_hp
+
+
+def _load_host_profile_by_id(host_id):
+    """Load a single HostProfile from disk by its ``host_id``.
+
+        The host profile file is located by file name and only that
+        file (and the ``OsProfile`` it references) is parsed. If a
+        host profile snapshot exists the full set of host profiles is
+        loaded from it instead.
+
+        :param host_id: The full host_id of the profile to load.
+        :returns: The ``HostProfile`` with identifier ``host_id``, or
+                  ``None`` if no host profile file is named for
+                  ``host_id``.
+        :returntype: ``HostProfile``
+    """
+    if _profiles_loaded or host_id in _host_profiles_by_host_id:
+        return _host_profiles_by_host_id.get(host_id)
+
+    if _have_profile_snapshot(boom_host_profiles_path()):
+        load_host_profiles()
+        return _host_profiles_by_host_id.get(host_id)
+
+    profile_file = _find_profile_file(boom_host_profiles_path(), host_id,
+                                      "host")
+    if not profile_file:
+        return None
+
+    # The OsProfile referenced by the host may also be loaded on demand.
+    _init_profiles()
+
+    _log_debug("Loading host profile for host_id='%s' on demand" % host_id)
+    try:
+        return HostProfile(profile_file=profile_file)
+    except Exception as e:
+        _log_warn("Failed to load HostProfile from '%s': %s" %
+                  (profile_file, e))
+        return None
+
+
 def write_host_profiles(force=False):
     """Write all HostProfile data to disk.
 
@@ -253,6 +321,24 @@ def min_machine_id_width():
     """
     return min_id_width(7, _host_profiles, "machine_id")
 
+#: Selection expression accessors for ``HostProfile`` attributes.
+_host_expr_getters = dict((attr, attrgetter(prop)) for (attr, prop) in [
+    ("host_id", "host_id"), ("host_name", "host_name"),
+    ("host_label", "label"), ("host_short_name", "short_name"),
+    ("host_add_opts", "add_opts"), ("host_del_opts", "del_opts"),
+    ("machine_id", "machine_id"),
+    ("os_id", "os_id"), ("os_name", "os_name"),
+    ("os_short_name", "os_short_name"), ("os_version", "os_version"),
+    ("os_version_id", "os_version_id"),
+    ("os_uname_pattern", "uname_pattern"),
+    ("os_kernel_pattern", "kernel_pattern"),
+    ("os_initramfs_pattern", "initramfs_pattern"),
+    ("os_root_opts_lvm2", "root_opts_lvm2"),
+    ("os_root_opts_btrfs", "root_opts_btrfs"),
+    ("os_options", "options")
+])
+
+
 def select_host_profile(s, hp):
     """Test the supplied host profile against selection criteria.
 
@@ -297,9 +383,38 @@ def select_host_profile(s, hp):
         return False
     if s.os_options and hp.options != s.os_options:
         return False
+    if s.expr and not s.expr.match(hp, _host_expr_getters):
+        return False
     return True
 
 
+def iter_host_profiles(selection=None, match_fn=select_host_profile):
+    """Iterate over host profiles matching selection criteria.
+
+        Return an iterator that yields the ``HostProfile`` objects
+        matching the specified criteria in load order. Matching follows
+        the same rules as ``find_host_profiles()``, but results are not
+        sorted.
+
+        Host profiles will be automatically loaded from disk if they are
+        not already in memory.
+
+        :param selection: A ``Selection`` object specifying the match
+                          criteria for the operation.
+        :param match_fn: An optional match function to test profiles.
+        :returns: An iterator yielding ``HostProfile`` objects.
+    """
+    # Use null search criteria if unspecified
+    selection = selection if selection else Selection()
+
+    selection.check_valid_selection(host=True)
+
+    if not host_profiles_loaded():
+        load_host_profiles()
+
+    return (hp for hp in _host_profiles if match_fn(selection, hp))
+
+
 def find_host_profiles(selection=None, match_fn=select_host_profile):
     """Find host profiles matching selection criteria.
 
@@ -338,9 +453,10 @@ def find_host_profiles(selection=None, match_fn=select_host_profile):
     matches = []
 
     _log_debug_profile("Finding host profiles for %s" % repr(selection))
-    for hp in _host_profiles:
-        if match_fn(selection, hp):
-            matches.append(hp)
+    with PerfTimer(PERF_MATCH):
+        for hp in _host_profiles:
+            if match_fn(selection, hp):
+                matches.append(hp)
     _log_debug_profile("Found %d host profiles" % len(matches))
     matches.sort(key=lambda h: h.host_name)
 
@@ -366,6 +482,26 @@ def get_host_profile_by_id(machine_id, label=""):
     return None
 
 
+def get_host_profile_by_host_id(host_id):
+    """Find a HostProfile by its host_id.
+
+        Return the HostProfile object corresponding to ``host_id``, or
+        ``None`` if it is not found.
+
+        If host profiles have not been loaded from disk only the host
+        profile file named for ``host_id`` is read: the full set of
+        host profiles is loaded only if no such file exists.
+
+        :param host_id: The full host_id of the profile to find.
+        :returntype: HostProfile
+        :returns: A HostProfile matching host_id or None if no match
+                  was found.
+    """
+    if not host_profiles_loaded() and not _load_host_profile_by_id(host_id):
+        load_host_profiles()
+    return _host_profiles_by_host_id.get(host_id)
+
+
 def match_host_profile(entry):
     """Attempt to match a BootEntry to a corresponding HostProfile.
 
@@ -509,6 +645,16 @@ class HostProfile(OsProfile):
             _check_format_key_value(key, value, bad_key_map[key])
 
         self._profile_data[key] = value
+        self._generation += 1
+
+    @property
+    def generation(self):
+        """A counter that is incremented each time this profile's
+            data, or the data of its embedded ``OsProfile``, is
+            modified.
+        """
+        osp = getattr(self, "osp", None)
+        return self._generation + (osp.generation if osp else 0)
 
     def _generate_host_id(self):
         """Generate a new host identifier.
@@ -521,6 +667,7 @@ class HostProfile(OsProfile):
         """
         hashdata = (self.machine_id + self.label)
 
+        perf_count(PERF_SHA_COMPUTED)
         digest = sha1(hashdata.encode('utf-8')).hexdigest()
         self._profile_data[BOOM_HOST_ID] = digest
 
@@ -528,6 +675,11 @@ class HostProfile(OsProfile):
         """Set this ``HostProfile``'s ``osp`` member to the
             corresponding profile for the set ``os_id``.
         """
+        osp = get_os_profile_by_id(self.os_id)
+        if osp:
+            self.osp = osp
+            return
+
         osps = find_profiles(Selection(os_id=self.os_id))
         if not osps:
             raise ValueError("OsProfile not found: %s" % self.os_id)
@@ -584,6 +736,19 @@ class HostProfile(OsProfile):
 
         self._append_profile()
 
+    def _snapshot_bind(self):
+        """Bind a ``HostProfile`` loaded from a snapshot to its
+            ``OsProfile``.
+
+            :returns: None
+        """
+        self.__set_os_profile()
+
+    @classmethod
+    def _drop_snapshot_profiles(cls):
+        """Discard host profiles partially loaded from a snapshot.
+        """
+        drop_host_profiles()
 
     def __init__(self, machine_id=None, host_name=None, label=None, os_id=None,
                  kernel_pattern=None, initramfs_pattern=None,
@@ -1107,8 +1272,10 @@ __all__ = [
     # Host profiles
     'HostProfile',
     'drop_host_profiles', 'load_host_profiles', 'write_host_profiles',
-    'host_profiles_loaded', 'find_host_profiles', 'select_host_profile',
-    'get_host_profile_by_id', 'match_host_profile', 'select_host_profile',
+    'host_profiles_loaded', 'find_host_profiles', 'iter_host_profiles',
+    'select_host_profile',
+    'get_host_profile_by_id', 'get_host_profile_by_host_id',
+    'match_host_profile', 'select_host_profile',
 
     # Host profile keys
     'BOOM_HOST_ID', 'BOOM_HOST_NAME',
@@ -17,17 +17,21 @@ with legacy bootloader configuration formats.
 Legacy formats are read-only and can only be updated by synchronising
 the entire current set of boot entries to the legacy format, or removing
 all entries from the legacy configuration file.
+
+The ``grub2`` format writes a pre-rendered Grub2 menu fragment that
+the boom grub.d script can ``source`` at boot time, in place of
+importing and parsing each BLS entry file with ``bls_import``.
 """
 from __future__ import print_function
 
 from boom import *
 from boom.bootloader import *
+from boom._boom import _register_context_state
 
 from subprocess import Popen, PIPE
-from os.path import dirname, exists as path_exists, join as path_join
+from os.path import dirname, join as path_join
 from os.path import isabs
-from os import fdopen, rename, chmod, fdatasync, dup
-from tempfile import mkstemp
+from os import fdopen, chmod
 import logging
 import re
 
@@ -38,6 +42,8 @@ BOOM_LEGACY_END_FMT="#--- BOOM_%s_END ---"
 #: Constants for legacy boot loaders supported by boom
 BOOM_LOADER_GRUB1="grub1"
 BOOM_GRUB1_CFG_PATH="grub/grub.conf"
+BOOM_LOADER_GRUB2="grub2"
+BOOM_GRUB2_CFG_PATH="grub2/boom.cfg"
 
 # Module logging configuration
 _log = logging.getLogger(__name__)
@@ -98,6 +104,15 @@ class BoomLegacyFormatError(BoomError):
     pass
 
 
+def _reset_grub1_device():
+    """Reset the cached grub1 root device.
+    """
+    global __grub1_device
+    __grub1_device = None
+
+_register_context_state(__name__, ["__grub1_device"], _reset_grub1_device)
+
+
 def find_legacy_loader(loader, cfg_path):
     """Look up a legacy loader format in the table of available formats
         and return a tuple containing the format name, decorator class
@@ -126,73 +141,162 @@ def find_legacy_loader(loader, cfg_path):
     return (name, decorator, path)
 
 
-def write_legacy_loader(selection=None, loader=BOOM_LOADER_GRUB1,
-                        cfg_path=None):
-    """Synchronise boom's configuration with the specified legacy boot
-        loader.
+def _legacy_cfg_path(loader, cfg_path):
+    """Return the name, decorator and absolute configuration file path
+        for the legacy loader format ``loader``.
 
-        For boot loaders that support only a single configuration file
-        with multiple boot entries, boom will generate a block of
-        configuration statements bounded by "BOOM_BEGIN"/"BOOM_END" on
-        a line by themselves and prefixed with the comment character
-        for that configuration format (e.g. '#').
+        If the configuration path is not absolute it is assumed to be
+        relative to the configured system '/boot' directory as returned
+        by ``boom.get_boot_path()``.
 
-        :param loader: the legacy boot loader type to write
+        :param loader: the legacy bootloader format to operate on
+        :param cfg_path: the path to the legacy bootloader configuration
+                         file, or ``None`` to use the default path.
+        :returns: (name, decorator, path) tuple
     """
     (name, decorator, path) = find_legacy_loader(loader, cfg_path)
 
     if not isabs(path):
         path = path_join(get_boot_path(), path)
+    return (name, decorator, path)
 
-    cfg_dir = dirname(path)
 
+def _read_legacy_config(name, path, missing_ok=False):
+    """Read a legacy bootloader configuration file, removing any boom
+        managed entries.
+
+        :param name: the legacy bootloader format name.
+        :param path: the absolute path to the configuration file.
+        :param missing_ok: treat a missing file as an empty file.
+        :raises BoomLegacyFormatError: if the legacy configuration file
+                                       contains invalid boom entries.
+        :returns: A ``(lines, found_boom)`` tuple containing the list of
+                  configuration lines that are not boom managed, and a
+                  boolean indicating whether boom entries were found.
+        :returntype: tuple
+    """
     begin_tag = BOOM_LEGACY_BEGIN_FMT % name
     end_tag = BOOM_LEGACY_END_FMT % name
 
-    (tmp_fd, tmp_path) = mkstemp(prefix="boom", dir=cfg_dir)
+    # Pre-set configuration error messages. Use a string format for
+    # the line number so that 'EOF' can be passed for end-of-file.
+    err_dupe_begin = ("Duplicate Boom begin tag at %s in legacy " +
+                      "configuration file '%s'")
+    err_dupe_end = ("Duplicate Boom end tag at %s in legacy " +
+                    "configuration file '%s'")
+    err_no_begin = ("Missing Boom begin tag at %s in legacy " +
+                    "configuration file '%s'")
+    err_no_end = ("Missing Boom end tag at %s in legacy " +
+                  "configuration file '%s'")
+
+    lines = []
+    found_boom = False
+    in_boom_cfg = False
 
-    def _legacy_format_error(err, fmt_data):
-        """Helper function to clean up the temporary file and raise the
-            corresponding BoomLegacyFormatError exception.
-        """
-        if type(fmt_data[0]) == int:
-            fmt_data = ("line %d" % fmt_data[0], fmt_data[1])
+    if missing_ok and not io_exists(path):
+        return (lines, found_boom)
+
+    with io_open(path, "r") as cfg_f:
+        for (line_nr, line) in enumerate(cfg_f, 1):
+            if begin_tag in line:
+                if in_boom_cfg or found_boom:
+                    raise BoomLegacyFormatError(err_dupe_begin %
+                                                ("line %d" % line_nr, path))
+                in_boom_cfg = True
+                continue
+
+            if end_tag in line:
+                if found_boom:
+                    raise BoomLegacyFormatError(err_dupe_end %
+                                                ("line %d" % line_nr, path))
+                if not in_boom_cfg:
+                    raise BoomLegacyFormatError(err_no_begin %
+                                                ("line %d" % line_nr, path))
+                in_boom_cfg = False
+                found_boom = True
+                continue
 
-        try:
-            unlink(tmp_path)
-        except:
-            pass
-        raise BoomLegacyFormatError(err % fmt_data)
-
-    with fdopen(tmp_fd, "w") as tmp_f:
-        # Our original file descriptor will be closed on exit from the
-        # fdopen with statement: save a copy so that we can call fdatasync
-        # once at the end of writing rather than on each loop iteration.
-        tmp_fd = dup(tmp_fd)
-        with open(path, "r") as cfg_f:
-            for line in cfg_f:
-                tmp_f.write(line)
-
-        tmp_f.write(begin_tag + "\n")
-        bes = find_entries(selection=selection)
-        for be in bes:
-            dbe = decorator(be)
-            tmp_f.write(str(dbe) + "\n")
-        tmp_f.write(end_tag + "\n")
+            if not in_boom_cfg:
+                lines.append(line)
+
+    if in_boom_cfg and not found_boom:
+        raise BoomLegacyFormatError(err_no_end % ("EOF", path))
 
+    return (lines, found_boom)
+
+
+def _write_legacy_config(path, lines):
+    """Atomically replace a legacy bootloader configuration file.
+
+        The new content is written to a temporary file in the same
+        directory, synchronised to disk once, and renamed into place.
+        The file is left untouched if it already contains ``lines``.
+
+        :param path: the absolute path to the configuration file.
+        :param lines: the list of lines to write.
+        :returns: None
+    """
+    if io_elide_write(path, "".join(lines), BOOT_ENTRY_MODE):
+        return
+    (tmp_fd, tmp_path) = io_mkstemp(prefix="boom", dir=dirname(path))
     try:
-        fdatasync(tmp_fd)
-        rename(tmp_path, path)
+        with fdopen(tmp_fd, "w") as tmp_f:
+            tmp_f.writelines(lines)
+            tmp_f.flush()
+            io_fsync(tmp_f.fileno(), data_only=True)
+        io_rename(tmp_path, path)
         chmod(path, BOOT_ENTRY_MODE)
     except Exception as e:
         _log_error("Error writing legacy configuration file %s: %s" %
                    (path, e))
         try:
-            unlink(tmp_path)
+            io_unlink(tmp_path)
         except:
             pass
         raise e
 
+
+def _legacy_entry_lines(name, decorator, selection):
+    """Return the boom managed configuration block for the entries
+        matching ``selection`` as a list of lines.
+    """
+    lines = [BOOM_LEGACY_BEGIN_FMT % name + "\n"]
+    for be in find_entries(selection=selection):
+        lines.append(str(decorator(be)) + "\n")
+    lines.append(BOOM_LEGACY_END_FMT % name + "\n")
+    return lines
+
+
+def write_legacy_loader(selection=None, loader=BOOM_LOADER_GRUB1,
+                        cfg_path=None):
+    """Synchronise boom's configuration with the specified legacy boot
+        loader.
+
+        For boot loaders that support only a single configuration file
+        with multiple boot entries, boom will generate a block of
+        configuration statements bounded by "BOOM_BEGIN"/"BOOM_END" on
+        a line by themselves and prefixed with the comment character
+        for that configuration format (e.g. '#').
+
+        The block is appended to the existing file content: callers
+        replacing existing boom entries should use
+        ``sync_legacy_loader()``.
+
+        :param loader: the legacy boot loader type to write
+    """
+    with BoomLock(exclusive=True):
+        (name, decorator, path) = _legacy_cfg_path(loader, cfg_path)
+
+        if decorator.owns_cfg and not io_exists(path):
+            lines = []
+        else:
+            with io_open(path, "r") as cfg_f:
+                lines = cfg_f.readlines()
+
+        lines.extend(_legacy_entry_lines(name, decorator, selection))
+        _write_legacy_config(path, lines)
+
+
 def clear_legacy_loader(loader=BOOM_LOADER_GRUB1, cfg_path=None):
     """Delete all boom managed entries from the specified legacy boot
         loader configuration file.
@@ -227,96 +331,46 @@ def clear_legacy_loader(loader=BOOM_LOADER_GRUB1, cfg_path=None):
                                        unknown or invalid.
         :returns: None
     """
-    (name, decorator, path) = find_legacy_loader(loader, cfg_path)
+    with BoomLock(exclusive=True):
+        (name, decorator, path) = _legacy_cfg_path(loader, cfg_path)
 
-    if not isabs(path):
-        path = path_join(get_boot_path(), path)
+        (lines, found_boom) = _read_legacy_config(name, path,
+                                                  decorator.owns_cfg)
+        if not found_boom:
+            # No boom entries: nothing to do.
+            return
 
-    cfg_dir = dirname(path)
+        _write_legacy_config(path, lines)
 
-    begin_tag = BOOM_LEGACY_BEGIN_FMT % name
-    end_tag = BOOM_LEGACY_END_FMT % name
 
-    # Pre-set configuration error messages. Use a string format for
-    # the line number so that 'EOF' can be passed for end-of-file.
-    err_dupe_begin = ("Duplicate Boom begin tag at %s in legacy " + 
-                      "configuration file '%s'")
-    err_dupe_end = ("Duplicate Boom end tag at %s in legacy " +
-                    "configuration file '%s'")
-    err_no_begin = ("Missing Boom begin tag at %s in legacy " +
-                    "configuration file '%s'")
-    err_no_end = ("Missing Boom end tag at %s in legacy " +
-                  "configuration file '%s'")
+def sync_legacy_loader(selection=None, loader=BOOM_LOADER_GRUB1,
+                       cfg_path=None):
+    """Replace the boom managed entries in the specified legacy boot
+        loader configuration file with the current set of boot entries.
 
-    line_nr = 1
-    found_boom = False
-    in_boom_cfg = False
-
-    (tmp_fd, tmp_path) = mkstemp(prefix="boom", dir=cfg_dir)
-
-    def _legacy_format_error(err, fmt_data):
-        """Helper function to clean up the temporary file and raise the
-            corresponding BoomLegacyFormatError exception.
-        """
-        if type(fmt_data[0]) == int:
-            fmt_data = ("line %d" % fmt_data[0], fmt_data[1])
-
-        try:
-            unlink(tmp_path)
-        except:
-            pass
-        raise BoomLegacyFormatError(err % fmt_data)
-
-    with fdopen(tmp_fd, "w") as tmp_f:
-        # Our original file descriptor will be closed on exit from the
-        # fdopen with statement: save a copy so that we can call fdatasync
-        # once at the end of writing rather than on each loop iteration.
-        tmp_fd = dup(tmp_fd)
-        with open(path, "r") as cfg_f:
-            for line in cfg_f:
-                if begin_tag in line:
-                    if in_boom_cfg or found_boom:
-                        _legacy_format_error(err_dupe_begin, (line_nr, path))
-                    in_boom_cfg = True
-                    continue
-
-                if end_tag in line:
-                    if found_boom:
-                        _legacy_format_error(err_dupe_end, (line_nr, path))
-                    if not in_boom_cfg:
-                        _legacy_format_error(err_no_begin, (line_nr, path))
-                    in_boom_cfg = False
-                    found_boom = True
-                    continue
-
-                if not in_boom_cfg:
-                    tmp_f.write(line)
+        This is equivalent to calling ``clear_legacy_loader()`` followed
+        by ``write_legacy_loader()``, but reads and rewrites the legacy
+        configuration file only once.
 
-                line_nr += 1
-
-    if in_boom_cfg and not found_boom:
-        _legacy_format_error(err_no_end, ("EOF", path))
-
-    if not found_boom:
-        # No boom entries: nothing to do.
-        try:
-            unlink(tmp_path)
-        except:
-            pass
-        return
+        :param selection: A ``Selection`` specifying the entries to
+                          write, or ``None`` to write all entries.
+        :param loader: the legacy bootloader format to operate on
+        :param cfg_path: the path to the legacy bootloader configuration
+                         file. If ``cfg_path`` is None the default path
+                         for the specified loader will be used.
+        :raises BoomLegacyFormatError: if the legacy configuration file
+                                       contains invalid boom entries or
+                                       the specified legacy format is
+                                       unknown or invalid.
+        :returns: None
+    """
+    with BoomLock(exclusive=True):
+        (name, decorator, path) = _legacy_cfg_path(loader, cfg_path)
 
-    try:
-        fdatasync(tmp_fd)
-        rename(tmp_path, path)
-        chmod(path, BOOT_ENTRY_MODE)
-    except Exception as e:
-        _log_error("Error writing legacy configuration file %s: %s" %
-                   (path, e))
-        try:
-            unlink(tmp_path)
-        except:
-            pass
-        raise e
+        (lines, found_boom) = _read_legacy_config(name, path,
+                                                  decorator.owns_cfg)
+        lines.extend(_legacy_entry_lines(name, decorator, selection))
+        _write_legacy_config(path, lines)
 
 
 class Grub1BootEntry(object):
@@ -338,6 +392,9 @@ class Grub1BootEntry(object):
 
     be = None
 
+    #: The Grub1 configuration file must already exist.
+    owns_cfg = False
+
     def __init__(self, boot_entry):
         self.be = boot_entry
 
@@ -346,14 +403,69 @@ class Grub1BootEntry(object):
         grub1_fmt = ("title %s\n" + grub1_tab + "root %s\n" + grub1_tab +
                      "kernel %s %s\n" + grub1_tab + "initrd %s")
 
-        return grub1_fmt % (self.be.title, _get_grub1_device(),
-                            self.be.linux, self.be.options, self.be.initrd)
+        key_data = dict(self.be._serialize())
+        return grub1_fmt % (key_data.get(BOOM_ENTRY_TITLE, ""),
+                            _get_grub1_device(),
+                            key_data.get(BOOM_ENTRY_LINUX, ""),
+                            key_data.get(BOOM_ENTRY_OPTIONS, ""),
+                            key_data.get(BOOM_ENTRY_INITRD, ""))
+
+
+def _grub2_quote(value):
+    """Quote ``value`` as a single-quoted Grub2 script word.
+    """
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+class Grub2BootEntry(object):
+    """Class transforming a Boom ``BootEntry`` into a Grub2
+        ``menuentry`` statement.
+
+        The Grub2BootEntry decorates the ``__str__`` method of the
+        BootEntry superclass by returning the entry as a Grub2 menu
+        entry equivalent to the one generated by the Grub2 BLS
+        module (``bls_import``) when it parses the entry file.
+
+        Each menu entry is given the Grub2 identifier
+        ``boom-<boot_id>``.
+    """
+
+    be = None
+
+    #: The Grub2 fragment is written entirely by boom.
+    owns_cfg = True
+
+    def __init__(self, boot_entry):
+        self.be = boot_entry
+
+    def __str__(self):
+        grub2_tab = " " * 8
+        key_data = dict(self.be._serialize())
+
+        lines = ["menuentry %s --id %s {" %
+                 (_grub2_quote(key_data.get(BOOM_ENTRY_TITLE, "")),
+                  _grub2_quote("boom-%s" % self.be.boot_id))]
+        if BOOM_ENTRY_LINUX in key_data:
+            linux = key_data[BOOM_ENTRY_LINUX]
+            if BOOM_ENTRY_OPTIONS in key_data:
+                linux += " " + key_data[BOOM_ENTRY_OPTIONS]
+            lines.append(grub2_tab + "linux " + linux)
+        elif BOOM_ENTRY_EFI in key_data:
+            lines.append(grub2_tab + "chainloader " + key_data[BOOM_ENTRY_EFI])
+        if BOOM_ENTRY_INITRD in key_data:
+            lines.append(grub2_tab + "initrd " + key_data[BOOM_ENTRY_INITRD])
+        if BOOM_ENTRY_DEVICETREE in key_data:
+            lines.append(grub2_tab + "devicetree " +
+                         key_data[BOOM_ENTRY_DEVICETREE])
+        lines.append("}")
+        return "\n".join(lines)
 
 #: Map of legacy boot loader decorator classes and defaults.
 #: Each entry in _loader_map is a three tuple containing the
 #: format's name, decorator class and default configuration path.
 _loader_map = {
-    BOOM_LOADER_GRUB1: ("Grub1", Grub1BootEntry, BOOM_GRUB1_CFG_PATH)
+    BOOM_LOADER_GRUB1: ("Grub1", Grub1BootEntry, BOOM_GRUB1_CFG_PATH),
+    BOOM_LOADER_GRUB2: ("Grub2", Grub2BootEntry, BOOM_GRUB2_CFG_PATH)
 }
 
 __all__ = [
@@ -363,14 +475,17 @@ __all__ = [
     # Write legacy boot configuration
     'write_legacy_loader',
     'clear_legacy_loader',
+    'sync_legacy_loader',
 
     # Lookup legacy boot loader formats
     'find_legacy_loader',
 
     # Legacy bootloader names
     'BOOM_LOADER_GRUB1',
+    'BOOM_LOADER_GRUB2',
 
     # Legacy bootloader decorator classes
-    'Grub1BootEntry'
+    'Grub1BootEntry',
+    'Grub2BootEntry'
 ]
 
@@ -35,11 +35,13 @@ are suitable for display use and are used by default by the
 from __future__ import print_function
 
 from boom import *
+from boom._boom import (_register_context_state, _find_profile_file,
+                        _have_profile_snapshot)
 from hashlib import sha1
-from os import listdir
-from tempfile import mkstemp
-from os.path import basename, join as path_join, exists as path_exists
-from os import fdopen, rename, chmod, unlink, fdatasync
+from os.path import basename, join as path_join
+from os import fdopen, chmod
+from errno import ENOENT
+from operator import attrgetter
 import logging
 import re
 
@@ -144,6 +146,24 @@ _profiles_by_id = {}
 #: Whether profiles have been read from disk
 _profiles_loaded = False
 
+#: Compiled uname pattern cache
+_uname_regexes = {}
+
+
+def _uname_regex(pattern):
+    """Return a compiled regular expression for ``pattern``.
+
+        Compiled expressions are cached by pattern string so that
+        repeated profile matches do not re-compile the same pattern.
+
+        :param pattern: A uname pattern string.
+        :returns: A compiled regular expression object.
+    """
+    if pattern not in _uname_regexes:
+        perf_count(PERF_REGEX_COMPILED)
+        _uname_regexes[pattern] = re.compile(pattern)
+    return _uname_regexes[pattern]
+
 
 def _profile_exists(os_id):
     """Test whether the specified ``os_id`` already exists.
@@ -214,7 +234,7 @@ def drop_profiles():
         :returns: None
     """
     global _profiles, _profiles_by_id, _profiles_loaded
-    nr_profiles = len(_profiles) - 1
+    nr_profiles = max(len(_profiles) - 1, 0)
 
     _profiles = []
     _profiles_by_id = {}
@@ -226,6 +246,9 @@ def drop_profiles():
     _log_info("Dropped %d profiles" % nr_profiles)
     _profiles_loaded = False
 
+_register_context_state(__name__, ["_profiles", "_profiles_by_id",
+                                    "_profiles_loaded"], drop_profiles)
+
 
 def load_profiles():
     """Load OsProfile data from disk.
@@ -242,12 +265,86 @@ def load_profiles():
         :returns: None
     """
     global _profiles_loaded
+    # Profiles loaded on demand may already be bound to entries.
+    on_demand = {} if _profiles_loaded else dict(_profiles_by_id)
     drop_profiles()
-    load_profiles_for_class(OsProfile, "Os", boom_profiles_path(), "profile")
+    with PerfTimer(PERF_PROFILE_LOAD):
+        load_profiles_for_class(OsProfile, "Os", boom_profiles_path(),
+                                "profile")
+    _adopt_profiles(on_demand)
     _log_info("Loaded %d profiles" % (len(_profiles) - 1))
     _profiles_loaded = True
 
 
+def _adopt_profiles(on_demand):
+    """Replace newly loaded profiles with profiles loaded on demand.
+
+        Profiles that were loaded individually by ``os_id`` before the
+        full profile set was loaded may already be referenced by boot
+        entries and host profiles: the existing objects are kept in
+        place of the copies read by ``load_profiles()``.
+
+        :param on_demand: A dictionary mapping ``os_id`` values to the
+                          profiles loaded on demand.
+        :returns: None
+    """
+    for (i, osp) in enumerate(_profiles):
+        if i == 0 or osp.os_id not in on_demand:
+            continue
+        _profiles[i] = on_demand[osp.os_id]
+        _profiles_by_id[osp.os_id] = on_demand[osp.os_id]
+
+
+def _init_profiles():
+    """Install the Null Profile if the profile list is empty.
+
+        The Null Profile must occupy the first slot of the profile list
+        before any profile is loaded on demand, since ``_is_null_profile()``
+        treats the profile at index zero as the Null Profile.
+
+        :returns: None
+    """
+    if not _profiles:
+        drop_profiles()
+
+
+def _load_profile_by_id(os_id):
+    """Load a single OsProfile from disk by its ``os_id``.
+
+        The profile file is located by file name and only that file is
+        parsed. If the profile is already in memory it is returned
+        without accessing the profiles directory, and if a profile
+        snapshot exists the full set of profiles is loaded from it
+        instead, since reading the snapshot costs no more than parsing
+        a single profile file.
+
+        :param os_id: The full os_id of the profile to load.
+        :returns: The ``OsProfile`` with identifier ``os_id``, or
+                  ``None`` if no profile file is named for ``os_id``.
+        :returntype: ``OsProfile``
+    """
+    if _profiles_loaded or os_id in _profiles_by_id:
+        return _profiles_by_id.get(os_id)
+
+    if _have_profile_snapshot(boom_profiles_path()):
+        load_profiles()
+        return _profiles_by_id.get(os_id)
+
+    profile_file = _find_profile_file(boom_profiles_path(), os_id, "profile")
+    if not profile_file:
+        return None
+
+    _init_profiles()
+
+    _log_debug_profile("Loading profile for os_id='%s' on demand" % os_id)
+    try:
+        return OsProfile(profile_file=profile_file)
+    except Exception as e:
+        _log_warn("Failed to load OsProfile from '%s': %s" %
+                  (profile_file, e))
+        return None
+
+
 def write_profiles(force=False):
     """Write all OsProfile data to disk.
 
@@ -280,6 +377,20 @@ def min_os_id_width():
     return min_id_width(7, _profiles, "os_id")
 
 
+#: Selection expression accessors for ``OsProfile`` attributes.
+_profile_expr_getters = dict((attr, attrgetter(prop)) for (attr, prop) in [
+    ("os_id", "os_id"), ("os_name", "os_name"),
+    ("os_short_name", "os_short_name"), ("os_version", "os_version"),
+    ("os_version_id", "os_version_id"),
+    ("os_uname_pattern", "uname_pattern"),
+    ("os_kernel_pattern", "kernel_pattern"),
+    ("os_initramfs_pattern", "initramfs_pattern"),
+    ("os_root_opts_lvm2", "root_opts_lvm2"),
+    ("os_root_opts_btrfs", "root_opts_btrfs"),
+    ("os_options", "options")
+])
+
+
 def select_profile(s, osp):
     """Test the supplied profile against selection criteria.
 
@@ -313,9 +424,38 @@ def select_profile(s, osp):
         return False
     if s.os_options and osp.options != s.os_options:
         return False
+    if s.expr and not s.expr.match(osp, _profile_expr_getters):
+        return False
     return True
 
 
+def iter_profiles(selection=None, match_fn=select_profile):
+    """Iterate over profiles matching selection criteria.
+
+        Return an iterator that yields the ``OsProfile`` objects
+        matching the specified criteria in load order. Matching follows
+        the same rules as ``find_profiles()``, but results are not
+        sorted.
+
+        OS profiles will be automatically loaded from disk if they are
+        not already in memory.
+
+        :param selection: A ``Selection`` object specifying the match
+                          criteria for the operation.
+        :param match_fn: An optional match function to test profiles.
+        :returns: An iterator yielding ``OsProfile`` objects.
+    """
+    # Use null search criteria if unspecified
+    selection = selection if selection else Selection()
+
+    selection.check_valid_selection(profile=True)
+
+    if not profiles_loaded():
+        load_profiles()
+
+    return (osp for osp in _profiles if match_fn(selection, osp))
+
+
 def find_profiles(selection=None, match_fn=select_profile):
     """Find profiles matching selection criteria.
 
@@ -353,9 +493,10 @@ def find_profiles(selection=None, match_fn=select_profile):
     matches = []
 
     _log_debug_profile("Finding profiles for %s" % repr(selection))
-    for osp in _profiles:
-        if match_fn(selection, osp):
-            matches.append(osp)
+    with PerfTimer(PERF_MATCH):
+        for osp in _profiles:
+            if match_fn(selection, osp):
+                matches.append(osp)
     _log_debug_profile("Found %d profiles" % len(matches))
     matches.sort(key=lambda o: (o.os_name, o.os_version))
 
@@ -368,11 +509,15 @@ def get_os_profile_by_id(os_id):
         Return the OsProfile object corresponding to ``os_id``, or
         ``None`` if it is not found.
 
+        If profiles have not been loaded from disk only the profile file
+        named for ``os_id`` is read: the full set of profiles is loaded
+        only if no such file exists.
+
         :returntype: OsProfile
         :returns: An OsProfile matching os_id or None if no match was
                   found
     """
-    if not profiles_loaded():
+    if not profiles_loaded() and not _load_profile_by_id(os_id):
         load_profiles()
     if os_id in _profiles_by_id:
         return _profiles_by_id[os_id]
@@ -467,6 +612,7 @@ class OsProfile(object):
     _profile_data = None
     _unwritten = False
     _comments = None
+    _generation = 0
 
     _profile_keys = OS_PROFILE_KEYS
     _required_keys = OS_REQUIRED_KEYS
@@ -515,6 +661,31 @@ class OsProfile(object):
         osp_str = osp_str.rstrip(", ")
         return osp_str + "})"
 
+    def __getstate__(self):
+        """Return the state of this profile for pickling.
+
+            Only the profile data, comments and dirty state are
+            stored: profile references (for e.g. a ``HostProfile``'s
+            ``OsProfile``) are re-bound by identifier when the profile
+            is unpickled.
+
+            :returns: A tuple of the profile state.
+            :returntype: tuple
+        """
+        return (self._profile_data, self._comments, self._unwritten)
+
+    def __setstate__(self, state):
+        """Restore the state of an unpickled profile.
+
+            Unpickled profiles are not added to the in-memory profile
+            lists: use ``get_os_profile_by_id()`` or the ``find_*()``
+            functions to obtain the profile known to this process.
+
+            :param state: A tuple returned by ``__getstate__()``.
+        """
+        (self._profile_data, self._comments, self._unwritten) = state
+        self._snapshot_bind()
+
     def __len__(self):
         """Return the length (key count) of this profile.
 
@@ -571,6 +742,7 @@ class OsProfile(object):
             _check_format_key_value(key, value, bad_key_map[key])
 
         self._profile_data[key] = value
+        self._generation += 1
 
     def keys(self):
         """Return the list of keys for this OsProfile.
@@ -615,6 +787,15 @@ class OsProfile(object):
         if self._identity_key in self._profile_data:
             self._profile_data.pop(self._identity_key)
         self._unwritten = True
+        self._generation += 1
+
+    @property
+    def generation(self):
+        """A counter that is incremented each time this profile's
+            data is modified. Users of the profile may cache values
+            rendered from its templates until the generation changes.
+        """
+        return self._generation
 
     def _generate_os_id(self):
         """Generate a new OS identifier.
@@ -627,6 +808,7 @@ class OsProfile(object):
         """
         hashdata = (self.os_short_name + self.os_version + self.os_version_id)
 
+        perf_count(PERF_SHA_COMPUTED)
         digest = sha1(hashdata.encode('utf-8')).hexdigest()
         self._profile_data[BOOM_OS_ID] = digest
 
@@ -684,6 +866,48 @@ class OsProfile(object):
 
         self._append_profile()
 
+    def _snapshot_bind(self):
+        """Bind a profile loaded from a snapshot to related objects.
+
+            ``OsProfile`` objects have no external references: this
+            method is overridden by subclasses that do.
+
+            :returns: None
+        """
+        pass
+
+    @classmethod
+    def _from_snapshot(cls, profile_data, comments):
+        """Initialise a new profile from profile snapshot data.
+
+            Snapshot data has already been validated and had default
+            values and the profile identifier applied when the snapshot
+            was written: the profile is added to the global profile list
+            without repeating these steps.
+
+            This method should not be called directly: profile snapshots
+            are managed by ``boom.load_profiles_for_class()``.
+
+            :param profile_data: The stored ``_profile_data`` dictionary.
+            :param comments: The stored profile comments dictionary.
+            :returns: A new profile object.
+        """
+        profile = cls.__new__(cls)
+        profile._profile_data = profile_data
+        profile._comments = comments
+        profile._unwritten = False
+        profile._snapshot_bind()
+        profile._append_profile()
+        if BOOM_OS_UNAME_PATTERN in profile_data:
+            _uname_regex(profile_data[BOOM_OS_UNAME_PATTERN])
+        return profile
+
+    @classmethod
+    def _drop_snapshot_profiles(cls):
+        """Discard profiles partially loaded from a snapshot.
+        """
+        drop_profiles()
+
     def _from_file(self, profile_file, profile_type):
         """Initialise a new profile from data stored in a file.
 
@@ -698,20 +922,13 @@ class OsProfile(object):
         """
         profile_data = {}
         comments = {}
-        comment = ""
 
         _log_debug("Loading %sProfile from '%s'" %
                    (profile_type, basename(profile_file)))
-        with open(profile_file, "r") as pf:
-            for line in pf:
-                if blank_or_comment(line):
-                    comment += line if line else ""
-                else:
-                    name, value = parse_name_value(line)
-                    profile_data[name] = value
-                    if comment:
-                        comments[name] = comment
-                        comment = ""
+        for (name, value, comment) in read_name_values(profile_file):
+            profile_data[name] = value
+            if comment:
+                comments[name] = comment
         self._comments = comments
 
         try:
@@ -821,7 +1038,7 @@ class OsProfile(object):
         _log_debug_profile("Matching uname pattern '%s' to '%s'" %
                            (self.uname_pattern, version))
         if self.uname_pattern and version:
-            if re.search(self.uname_pattern, version):
+            if _uname_regex(self.uname_pattern).search(version):
                 return True
         return False
 
@@ -1219,7 +1436,7 @@ class OsProfile(object):
             :returns: A new OsProfile for the specified os-release file
             :returntype: OsProfile
         """
-        with open(path, "r") as f:
+        with io_open(path, "r") as f:
             return cls.from_os_release(f)
 
     @classmethod
@@ -1260,6 +1477,8 @@ class OsProfile(object):
             If the value of ``force`` is ``False`` and the profile
             is not currently marked as dirty (either new, or modified
             since the last load operation) the write will be skipped.
+            The write is also skipped if the profile file on disk
+            already contains identical data.
 
             :param profile_type: The type of profile, Host or Os.
             :param profile_id: The os_id or host_id of this profile.
@@ -1275,37 +1494,46 @@ class OsProfile(object):
         if not force and not self._unwritten:
             return
 
-        profile_path = self._profile_path()
+        with BoomLock(exclusive=True):
+            profile_path = self._profile_path()
 
-        _log_debug("Writing %sProfile(%s_id='%s') to '%s'" %
-                   (profile_type, profile_type.lower(), profile_id,
-                    basename(profile_path)))
+            _log_debug("Writing %sProfile(%s_id='%s') to '%s'" %
+                       (profile_type, profile_type.lower(), profile_id,
+                        basename(profile_path)))
 
-        # List of key names for this profile type
-        profile_keys = self._profile_keys
+            # List of key names for this profile type
+            profile_keys = self._profile_keys
 
-        (tmp_fd, tmp_path) = mkstemp(prefix="boom", dir=profile_dir)
-        with fdopen(tmp_fd, "w") as f:
-            for key in [k for k in profile_keys if k in self._profile_data]:
+            lines = []
+            keys = [k for k in profile_keys if k in self._profile_data]
+            for key in keys:
                 if self._comments and key in self._comments:
-                    f.write(self._comments[key].rstrip() + '\n')
-                f.write('%s="%s"\n' % (key, self._profile_data[key]))
+                    lines.append(self._comments[key].rstrip() + '\n')
+                lines.append('%s="%s"\n' % (key, self._profile_data[key]))
+            data = "".join(lines)
+
+            if io_elide_write(profile_path, data, mode):
+                return
+
+            (tmp_fd, tmp_path) = io_mkstemp(prefix="boom", dir=profile_dir)
+            with fdopen(tmp_fd, "w") as f:
+                f.write(data)
                 f.flush()
-                fdatasync(f.fileno())
-        try:
-            rename(tmp_path, profile_path)
-            chmod(profile_path, mode)
-        except Exception as e:
-            _log_error("Error writing profile file '%s': %s" %
-                       (profile_path, e))
+                io_fsync(f.fileno(), data_only=True)
             try:
-                unlink(tmp_path)
-            except:
-                pass
-            raise e
-
-        _log_debug("Wrote %sProfile (%s_id=%s)'" %
-                   (profile_type, profile_type.lower(), profile_id))
+                io_rename(tmp_path, profile_path)
+                chmod(profile_path, mode)
+            except Exception as e:
+                _log_error("Error writing profile file '%s': %s" %
+                           (profile_path, e))
+                try:
+                    io_unlink(tmp_path)
+                except:
+                    pass
+                raise e
+
+            _log_debug("Wrote %sProfile (%s_id=%s)'" %
+                       (profile_type, profile_type.lower(), profile_id))
 
     def write_profile(self, force=False):
         """Write out profile data to disk.
@@ -1343,21 +1571,22 @@ class OsProfile(object):
             :raises: ``OsError`` if an error occurs removing the file or
                      ``ValueError`` if the profile does not exist.
         """
-        profile_path = self._profile_path()
+        with BoomLock(exclusive=True):
+            profile_path = self._profile_path()
 
-        _log_debug("Deleting %sProfile(%s_id='%s') from '%s'" %
-                   (profile_type, profile_type.lower(), profile_id,
-                    basename(profile_path)))
+            _log_debug("Deleting %sProfile(%s_id='%s') from '%s'" %
+                       (profile_type, profile_type.lower(), profile_id,
+                        basename(profile_path)))
 
-        if not path_exists(profile_path):
-            return
-        try:
-            unlink(profile_path)
-            _log_debug("Deleted %sProfile(%s_id='%s')" %
-                       (profile_type, profile_type.lower(), profile_id))
-        except Exception as e:
-            _log_error("Error removing %sProfile file '%s': %s" %
-                       (profile_type, profile_path, e))
+            try:
+                io_unlink(profile_path)
+                _log_debug("Deleted %sProfile(%s_id='%s')" %
+                           (profile_type, profile_type.lower(), profile_id))
+            except OSError as e:
+                if e.errno == ENOENT:
+                    return
+                _log_error("Error removing %sProfile file '%s': %s" %
+                           (profile_type, profile_path, e))
 
     def delete_profile(self):
         """Delete on-disk data for this profile.
@@ -1383,7 +1612,8 @@ class OsProfile(object):
 __all__ = [
     'OsProfile',
     'profiles_loaded', 'drop_profiles', 'load_profiles', 'write_profiles',
-    'find_profiles', 'get_os_profile_by_id', 'select_profile',
+    'find_profiles', 'iter_profiles', 'get_os_profile_by_id',
+    'select_profile',
     'match_os_profile', 'match_os_profile_by_version', 'key_from_key_name',
 
     # Module constants
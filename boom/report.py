@@ -29,7 +29,8 @@ mapper reports.
 """
 from __future__ import print_function
 
-from boom import find_minimum_sha_prefix, BOOM_DEBUG_REPORT
+from boom import (find_minimum_sha_prefix, BOOM_DEBUG_REPORT, PerfTimer,
+                  PERF_REPORT_BUILD, PERF_REPORT_SORT, PERF_REPORT_OUTPUT)
 import logging
 import sys
 
@@ -245,14 +246,16 @@ class BoomField(object):
         A ``BoomField`` represents an instance of a ``BoomFieldType``
         including its associated data values.
     """
-    #: reference to the containing BoomReport
-    _report = None
-    #: reference to the BoomFieldProperties describing this field
-    _props = None
-    #: The formatted string to be reported for this field.
-    report_string = None
-    #: The raw value of this field. Used for sorting.
-    sort_value = None
+    __slots__ = (
+        # reference to the containing BoomReport
+        "_report",
+        # reference to the BoomFieldProperties describing this field
+        "_props",
+        # The formatted string to be reported for this field.
+        "report_string",
+        # The raw value of this field. Used for sorting.
+        "sort_value"
+    )
 
     def __init__(self, report, props):
         """Initialise a new BoomField object.
@@ -265,6 +268,8 @@ class BoomField(object):
         """
         self._report = report
         self._props = props
+        self.report_string = None
+        self.sort_value = None
 
     def report_str(self, value):
         """Report a string value for this BoomField object.
@@ -324,15 +329,19 @@ class BoomRow(object):
     """BoomRow()
         A class representing a single data row making up a report.
     """
-    #: the report that this BoomRow belongs to
-    _report = None
-    #: the list of report fields in display order
-    _fields = None
-    #: fields in sort order
-    _sort_fields = None
+    __slots__ = (
+        # the report that this BoomRow belongs to
+        "_report",
+        # the list of report fields in display order
+        "_fields",
+        # fields in sort order
+        "_sort_fields"
+    )
+
     def __init__(self, report):
         self._report = report
         self._fields = []
+        self._sort_fields = None
 
     def add_field(self, field):
         """Add a field to this BoomRow.
@@ -916,7 +925,8 @@ class BoomReport(object):
 
             :returns: None
         """
-        self._rows.sort(key=self.__row_key_fn())
+        with PerfTimer(PERF_REPORT_SORT):
+            self._rows.sort(key=self.__row_key_fn())
 
     def report_object(self, obj):
         """Report data for object.
@@ -934,25 +944,26 @@ class BoomReport(object):
         if self._already_reported:
             return
 
-        row = BoomRow(self)
-        fields = self._fields
-        if self._sort_required:
-            row._sort_fields = [-1] * self._keys_count
-        for fp in self._field_properties:
-            field = BoomField(self, fp)
-            data = fp.objtype.data_fn(obj)
-
-            if data is None:
-                raise ValueError("No data assigned to field %s" %
-                                 fields[fp.field_num].name)
-
-            try:
-                fields[fp.field_num].report_fn(field, data)
-            except ValueError:
-                raise ValueError("No value assigned to field %s" %
-                                 fields[fp.field_num].name)
-            row.add_field(field)
-        self._rows.append(row)
+        with PerfTimer(PERF_REPORT_BUILD):
+            row = BoomRow(self)
+            fields = self._fields
+            if self._sort_required:
+                row._sort_fields = [-1] * self._keys_count
+            for fp in self._field_properties:
+                field = BoomField(self, fp)
+                data = fp.objtype.data_fn(obj)
+
+                if data is None:
+                    raise ValueError("No data assigned to field %s" %
+                                     fields[fp.field_num].name)
+
+                try:
+                    fields[fp.field_num].report_fn(field, data)
+                except ValueError:
+                    raise ValueError("No value assigned to field %s" %
+                                     fields[fp.field_num].name)
+                row.add_field(field)
+            self._rows.append(row)
 
         if not self.opts.buffered:
             return self.report_output()
@@ -1066,10 +1077,16 @@ class BoomReport(object):
             self.__recalculate_fields()
         if self._sort_required:
             self._sort_rows()
-        if self.opts.columns_as_rows:
-            return self._output_as_rows()
-        else:
-            return self._output_as_columns()
+        with PerfTimer(PERF_REPORT_OUTPUT):
+            if self.opts.columns_as_rows:
+                ret = self._output_as_rows()
+            else:
+                ret = self._output_as_columns()
+        # In unbuffered mode each row is output as it is reported: drop
+        # rows once written so that they are not output again.
+        if not self.opts.buffered:
+            self._rows = []
+        return ret
 
 __all__ = [
     # Module constants
@@ -12,15 +12,41 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
-from os.path import join, abspath
-from os import geteuid, getegid, makedirs
+from os.path import join, abspath, dirname, isdir
+from os import geteuid, getegid, makedirs, listdir
+from tempfile import mkdtemp
+import atexit
 import shutil
 import errno
 
 import boom
 
+# Location of the test fixture data
+FIXTURE_ROOT = dirname(abspath(__file__))
+
+# Fixture directories that are not copied to the testing directory
+_FIXTURE_SKIP = ["__pycache__", "bench", "sandbox"]
+
+
+def _copy_fixtures():
+    """Copy the test fixture data to a new temporary directory.
+
+        Tests create and delete entries and profiles, and boom writes
+        lock files and profile snapshots: running the tests against a
+        copy of the fixtures keeps the source tree unmodified.
+
+        :returns: The path to the temporary directory.
+    """
+    root = mkdtemp(prefix="boom-tests-")
+    atexit.register(shutil.rmtree, root, True)
+    for name in listdir(FIXTURE_ROOT):
+        path = join(FIXTURE_ROOT, name)
+        if isdir(path) and name not in _FIXTURE_SKIP:
+            shutil.copytree(path, join(root, name), symlinks=True)
+    return root
+
 # Root of the testing directory
-BOOT_ROOT_TEST = abspath("./tests")
+BOOT_ROOT_TEST = _copy_fixtures()
 
 # Location of the temporary sandbox for test data
 SANDBOX_PATH = join(BOOT_ROOT_TEST, "sandbox")
@@ -54,6 +80,7 @@ def reset_boom_paths():
     """Reset configurable boom module paths to the default test values.
     """
     boom.set_boot_path(BOOT_ROOT_TEST)
+    boom.set_entry_roots(None)
 
 # Mock objects
 
@@ -61,11 +88,13 @@ class MockArgs(object):
     """Mock arguments class for testing boom command line infrastructure.
     """
     add_opts = ""
+    all = False
     boot_id = "12345678"
     btrfs_opts = ""
     btrfs_subvolume = "23"
     command = ""
     config = ""
+    cprofile = ""
     debug = ""
     del_opts = ""
     efi = ""
@@ -77,10 +106,12 @@ class MockArgs(object):
     initramfs_pattern = ""
     initrd = ""
     kernel_pattern = ""
+    keep = None
     label = ""
     linux = ""
     lvm_opts = ""
     machine_id = ""
+    manifest = ""
     name = ""
     name_prefixes = False
     no_dev = False
@@ -95,6 +126,7 @@ class MockArgs(object):
     root_device = ""
     root_lv = ""
     rows = False
+    select = ""
     separator = ""
     short_name = ""
     sort = ""
@@ -114,7 +146,7 @@ def have_root():
     return geteuid() == 0 and getegid() == 0
 
 __all__ = [
-    'BOOT_ROOT_TEST', 'SANDBOX_PATH',
+    'BOOT_ROOT_TEST', 'FIXTURE_ROOT', 'SANDBOX_PATH',
     'rm_sandbox', 'mk_sandbox', 'reset_sandbox', 'reset_boom_paths',
     'MockArgs',
     'have_root'
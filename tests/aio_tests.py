@@ -0,0 +1,133 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# aio_tests.py - Boom asyncio interface tests.
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import unittest
+import logging
+from os.path import join
+
+import boom
+import boom.aio
+from boom.bootloader import drop_entries
+from boom.osprofile import drop_profiles
+from boom.hostprofile import drop_host_profiles
+
+from tests import *
+from tests.bench.fixtures import make_boot_dir, BENCH_MACHINE_ID
+
+log = logging.getLogger()
+log.level = logging.DEBUG
+log.addHandler(logging.FileHandler("test.log"))
+
+
+@unittest.skipIf(not boom.aio.asyncio, "asyncio is not available")
+class AioTests(unittest.TestCase):
+    def setUp(self):
+        import asyncio
+        reset_sandbox()
+        self._config = boom.get_boom_config()
+        self._roots = []
+        for (i, nr_entries) in enumerate([3, 5]):
+            root = join(SANDBOX_PATH, "root%d" % i)
+            make_boot_dir(root, nr_entries)
+            self._roots.append(root)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        import asyncio
+        boom.aio.shutdown()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        drop_entries()
+        drop_profiles()
+        drop_host_profiles()
+        rm_sandbox()
+        boom.set_boom_config(self._config)
+        reset_boom_paths()
+
+    def _context(self, i):
+        return boom.BoomContext(boot_path=self._roots[i])
+
+    def test_find_entries(self):
+        bes = self.loop.run_until_complete(
+            boom.aio.find_entries(context=self._context(1)))
+        self.assertEqual(len(bes), 5)
+
+    def test_find_profiles(self):
+        osps = self.loop.run_until_complete(
+            boom.aio.find_profiles(context=self._context(0)))
+        self.assertEqual(len(osps), 4)
+
+    def test_concurrent_contexts(self):
+        import asyncio
+        futures = [boom.aio.find_entries(context=self._context(i))
+                   for i in range(len(self._roots))]
+        results = self.loop.run_until_complete(asyncio.gather(*futures))
+        self.assertEqual([len(bes) for bes in results], [3, 5])
+
+    def test_create_delete_entry(self):
+        ctx = self._context(0)
+        osp = self.loop.run_until_complete(
+            boom.aio.find_profiles(context=ctx))[0]
+        be = self.loop.run_until_complete(
+            boom.aio.create_entry("ATITLE", "2.6.0", BENCH_MACHINE_ID,
+                                  "/dev/sda1", profile=osp,
+                                  allow_no_dev=True, context=ctx))
+        bes = self.loop.run_until_complete(boom.aio.find_entries(context=ctx))
+        self.assertEqual(len(bes), 4)
+        nr = self.loop.run_until_complete(
+            boom.aio.delete_entries(boom.Selection(boot_id=be.boot_id),
+                                    context=ctx))
+        self.assertEqual(nr, 1)
+
+    def test_create_edit_entries(self):
+        ctx = self._context(0)
+        osp = self.loop.run_until_complete(
+            boom.aio.find_profiles(context=ctx))[0]
+        specs = [{"title": "Snap%d" % n, "version": "2.6.0",
+                  "machine_id": BENCH_MACHINE_ID,
+                  "root_device": "/dev/sda%d" % n, "profile": osp}
+                 for n in range(0, 3)]
+        results = self.loop.run_until_complete(
+            boom.aio.create_entries(specs, allow_no_dev=True, context=ctx))
+        self.assertEqual([error for (be, error) in results], [None] * 3)
+        bes = self.loop.run_until_complete(
+            boom.aio.edit_entries(boom.Selection(version="2.6.0"),
+                                  title="Edited", context=ctx))
+        self.assertEqual(len(bes), 3)
+        bes = self.loop.run_until_complete(
+            boom.aio.find_entries(boom.Selection(title="Edited"),
+                                  context=ctx))
+        self.assertEqual(len(bes), 3)
+
+
+class AioNoAsyncioTests(unittest.TestCase):
+    def setUp(self):
+        self._asyncio = boom.aio.asyncio
+        boom.aio.asyncio = None
+
+    def tearDown(self):
+        boom.aio.asyncio = self._asyncio
+
+    def test_no_asyncio(self):
+        with self.assertRaises(boom.BoomError):
+            boom.aio.find_entries()
+
+    def test_no_asyncio_batch(self):
+        with self.assertRaises(boom.BoomError):
+            boom.aio.create_entries([])
+        with self.assertRaises(boom.BoomError):
+            boom.aio.edit_entries(title="Edited")
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,27 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# bench/__init__.py - Boom scalability benchmarks
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+"""Scalability benchmarks for the boom library.
+
+The ``tests.bench.fixtures`` module generates synthetic /boot
+directories containing large numbers of boot entries, and the
+``tests.bench.boom_bench`` module times boom operations against them:
+
+    python -m tests.bench.boom_bench --sizes 100,1000,10000 \\
+        --output baseline.json
+
+    python -m tests.bench.boom_bench --sizes 100,1000,10000 \\
+        --compare baseline.json
+"""
+
+# vim: set et ts=4 sw=4 :
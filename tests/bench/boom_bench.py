@@ -0,0 +1,473 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# boom_bench.py - Boom scalability benchmarks
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+"""Boom scalability benchmarks.
+
+Time boom library operations against synthetic boot directories of
+increasing size, optionally saving the results as a JSON baseline or
+comparing them to a previously saved baseline.
+
+Comparison reports two kinds of regression for each benchmark:
+
+ * a slowdown: the time at a given size exceeds the baseline time by
+   more than the ``--threshold`` factor.
+ * a complexity regression: the growth exponent between successive
+   sizes (the slope of log(time) against log(size)) exceeds the
+   baseline exponent by more than ``--exponent-slack``. A benchmark
+   that was linear in the baseline and is now quadratic is flagged
+   even if it is still fast at small sizes.
+
+The memory used by the loaded boot entries is also measured for each
+size and reported in bytes per entry. Objects shared with the rest of
+boom (profiles, classes and modules) are excluded, and an object that
+is referenced by several entries (for e.g. an interned string) is
+counted once. Use ``--sizes 1000,10000,100000`` for the memory scaling
+figures at 1k, 10k and 100k entries.
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from math import log
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from types import FunctionType, ModuleType
+import json
+import sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import boom
+import boom.bootloader
+import boom.legacy
+from boom import (Selection, set_boot_path, set_boom_config, BoomConfig,
+                  BoomLock)
+from boom.osprofile import (drop_profiles, load_profiles, get_os_profile_by_id,
+                            OsProfile)
+from boom.hostprofile import drop_host_profiles, load_host_profiles
+from boom.bootloader import drop_entries, load_entries, find_entries
+from boom.command import (create_entry, delete_entries, edit_entry,
+                          print_entries)
+from boom.legacy import sync_legacy_loader, BOOM_LOADER_GRUB1
+from boom.report import BoomReportOpts
+
+from tests.bench.fixtures import (make_boot_dir, profile_os_id,
+                                  host_machine_id, entry_version,
+                                  BENCH_MACHINE_ID)
+
+#: Default fixture sizes (number of boot entries).
+DEFAULT_SIZES = [100, 1000, 10000]
+
+#: Default number of timed repetitions (the minimum is reported).
+DEFAULT_REPEAT = 3
+
+#: Default slowdown factor flagged as a regression.
+DEFAULT_THRESHOLD = 1.5
+
+#: Default growth exponent increase flagged as a regression.
+DEFAULT_EXPONENT_SLACK = 0.3
+
+#: Benchmark result format version.
+BENCH_FORMAT_VERSION = 1
+
+
+class BenchContext(object):
+    """State shared by the benchmarks for one fixture.
+    """
+    def __init__(self, boot_path, nr_entries, nr_profiles, nr_hosts):
+        self.boot_path = boot_path
+        self.nr_entries = nr_entries
+        self.nr_profiles = nr_profiles
+        self.nr_hosts = nr_hosts
+
+    @property
+    def machine_id(self):
+        if self.nr_hosts:
+            return host_machine_id(0)
+        return BENCH_MACHINE_ID
+
+
+def _reset_boom():
+    """Drop all in-memory boom state so that the next operation must
+        load profiles and entries from disk.
+    """
+    drop_entries()
+    drop_host_profiles()
+    drop_profiles()
+
+
+def _setup(ctx):
+    """Point boom at a fixture directory and warm the profile snapshots.
+    """
+    set_boom_config(BoomConfig(boot_path=ctx.boot_path,
+                               boom_path=join(ctx.boot_path, "boom"),
+                               legacy_enable=False))
+    set_boot_path(ctx.boot_path)
+    # Grub1 device discovery shells out to the grub binary: use a fixed
+    # device so that legacy synchronisation can be timed.
+    setattr(boom.legacy, "__grub1_device", "(hd0,0)")
+    _reset_boom()
+    # Snapshots are only written under the exclusive boom lock.
+    with BoomLock(exclusive=True):
+        load_profiles()
+        load_host_profiles()
+    load_entries()
+
+
+def bench_load_entries(ctx):
+    _reset_boom()
+    load_entries()
+
+
+def bench_find_all(ctx):
+    find_entries()
+
+
+def bench_find_machine_id(ctx):
+    find_entries(Selection(machine_id=ctx.machine_id))
+
+
+def bench_find_os_id(ctx):
+    find_entries(Selection(os_id=profile_os_id(0)))
+
+
+def bench_find_version(ctx):
+    find_entries(Selection(version=entry_version(ctx.nr_entries // 2,
+                                                 (ctx.nr_entries // 2) %
+                                                 ctx.nr_profiles)))
+
+
+def bench_find_root_lv(ctx):
+    find_entries(Selection(lvm_root_lv="vg0/lv0"))
+
+
+def bench_print_entries(ctx):
+    opts = BoomReportOpts(report_file=StringIO())
+    print_entries(opts=opts)
+
+
+def bench_create_delete(ctx):
+    osp = get_os_profile_by_id(profile_os_id(0))
+    be = create_entry("Bench create", "4.0.0-1.bench0.x86_64",
+                      ctx.machine_id, "/dev/vg9/created",
+                      lvm_root_lv="vg9/created", profile=osp,
+                      allow_no_dev=True)
+    delete_entries(Selection(boot_id=be.boot_id))
+
+
+def bench_edit(ctx):
+    bes = find_entries(Selection(lvm_root_lv="vg0/lv0"))
+    title = bes[0].title
+    be = edit_entry(Selection(boot_id=bes[0].boot_id),
+                    title=title + " (edited)")
+    edit_entry(Selection(boot_id=be.boot_id), title=title)
+
+
+def bench_legacy_sync(ctx):
+    sync_legacy_loader(selection=Selection(), loader=BOOM_LOADER_GRUB1,
+                       cfg_path=join(ctx.boot_path, "grub", "grub.conf"))
+
+
+#: Benchmarks in run order: (name, function).
+BENCHMARKS = [
+    ("load_entries", bench_load_entries),
+    ("find_all", bench_find_all),
+    ("find_machine_id", bench_find_machine_id),
+    ("find_os_id", bench_find_os_id),
+    ("find_version", bench_find_version),
+    ("find_root_lv", bench_find_root_lv),
+    ("print_entries", bench_print_entries),
+    ("create_delete", bench_create_delete),
+    ("edit", bench_edit),
+    ("legacy_sync", bench_legacy_sync)
+]
+
+
+def _deep_sizeof(obj, seen):
+    """Return the total size of ``obj`` and the objects reachable from
+        it that are not already in ``seen``.
+
+        Profiles, classes, modules and functions are shared with the
+        rest of boom and are not counted.
+    """
+    skip_types = (OsProfile, type, ModuleType, FunctionType)
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, skip_types):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                for name in slots:
+                    if name.startswith("__") and not name.endswith("__"):
+                        name = "_%s%s" % (cls.__name__.lstrip("_"), name)
+                    if hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+    return total
+
+
+def entry_memory():
+    """Return the memory used by the loaded boot entries in bytes per
+        entry, or zero if no entries are loaded.
+    """
+    entries = boom.bootloader._entries or []
+    if not entries:
+        return 0
+    seen = set()
+    return sum(_deep_sizeof(be, seen) for be in entries) // len(entries)
+
+
+def _time_bench(fn, ctx, repeat):
+    """Return the minimum wall clock time of ``repeat`` calls to ``fn``.
+    """
+    best = None
+    for i in range(repeat):
+        start = time()
+        fn(ctx)
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmarks(sizes=None, nr_profiles=4, nr_hosts=4, os_identifier=True,
+                   repeat=DEFAULT_REPEAT, names=None, tmp_dir=None):
+    """Run the benchmark suite.
+
+        :param sizes: A list of fixture sizes (numbers of entries).
+        :param nr_profiles: The number of OsProfiles in each fixture.
+        :param nr_hosts: The number of HostProfiles in each fixture.
+        :param os_identifier: Write ``#OsIdentifier`` comments to the
+                              fixture entries.
+        :param repeat: The number of timed repetitions per benchmark.
+        :param names: An optional list of benchmark names to run.
+        :param tmp_dir: An optional parent directory for fixtures.
+        :returns: A results dictionary suitable for ``save_results()``.
+        :returntype: dict
+    """
+    sizes = sorted(sizes or DEFAULT_SIZES)
+    benchmarks = [b for b in BENCHMARKS if not names or b[0] in names]
+    results = {
+        "version": BENCH_FORMAT_VERSION,
+        "params": {
+            "profiles": nr_profiles,
+            "hosts": nr_hosts,
+            "os_identifier": os_identifier,
+            "repeat": repeat
+        },
+        "sizes": sizes,
+        "times": dict((name, []) for (name, fn) in benchmarks),
+        "memory": []
+    }
+
+    grub1_device = getattr(boom.legacy, "__grub1_device")
+    for size in sizes:
+        boot_path = mkdtemp(prefix="boom-bench.", dir=tmp_dir)
+        try:
+            make_boot_dir(boot_path, size, nr_profiles=nr_profiles,
+                          nr_hosts=nr_hosts, os_identifier=os_identifier)
+            ctx = BenchContext(boot_path, size, nr_profiles, nr_hosts)
+            _setup(ctx)
+            results["memory"].append(entry_memory())
+            for (name, fn) in benchmarks:
+                elapsed = _time_bench(fn, ctx, repeat)
+                results["times"][name].append(elapsed)
+        finally:
+            _reset_boom()
+            setattr(boom.legacy, "__grub1_device", grub1_device)
+            rmtree(boot_path)
+    return results
+
+
+def growth_exponents(sizes, times):
+    """Return the growth exponents between successive sizes.
+
+        The exponent ``k`` approximates ``time ~ size ** k`` between
+        each pair of adjacent sizes: 1.0 is linear, 2.0 is quadratic.
+        Times too small to measure reliably yield an exponent of 0.0.
+    """
+    exponents = []
+    for i in range(1, len(sizes)):
+        (t0, t1) = (times[i - 1], times[i])
+        if t0 <= 0 or t1 <= 0:
+            exponents.append(0.0)
+            continue
+        exponents.append(log(t1 / t0) / log(float(sizes[i]) / sizes[i - 1]))
+    return exponents
+
+
+def compare_results(baseline, results, threshold=DEFAULT_THRESHOLD,
+                    exponent_slack=DEFAULT_EXPONENT_SLACK,
+                    min_time=0.001):
+    """Compare benchmark results to a baseline.
+
+        :param baseline: A results dictionary loaded from a baseline.
+        :param results: The current results dictionary.
+        :param threshold: The slowdown factor to flag.
+        :param exponent_slack: The growth exponent increase to flag.
+        :param min_time: Times below this value (in seconds) are too
+                         noisy to compare and are ignored.
+        :returns: A list of regression description strings.
+        :returntype: list
+    """
+    regressions = []
+    for (name, times) in sorted(results["times"].items()):
+        if name not in baseline["times"]:
+            continue
+        base_times = dict(zip(baseline["sizes"], baseline["times"][name]))
+        cur_times = dict(zip(results["sizes"], times))
+        common = sorted(set(base_times) & set(cur_times))
+
+        for size in common:
+            (base, cur) = (base_times[size], cur_times[size])
+            if cur < min_time:
+                continue
+            if cur > max(base, min_time) * threshold:
+                regressions.append("%s: %d entries: %.3fs > %.3fs (x%.2f)" %
+                                   (name, size, cur, base, cur / base
+                                    if base else float("inf")))
+
+        # Only compare growth where both endpoints are measurable.
+        sizes = [s for s in common
+                 if base_times[s] >= min_time and cur_times[s] >= min_time]
+        base_exp = growth_exponents(sizes, [base_times[s] for s in sizes])
+        cur_exp = growth_exponents(sizes, [cur_times[s] for s in sizes])
+        for i in range(len(cur_exp)):
+            if cur_exp[i] > base_exp[i] + exponent_slack:
+                regressions.append("%s: %d->%d entries: growth exponent "
+                                   "%.2f > %.2f" % (name, sizes[i],
+                                                    sizes[i + 1], cur_exp[i],
+                                                    base_exp[i]))
+
+    base_memory = dict(zip(baseline["sizes"], baseline.get("memory", [])))
+    for (size, cur) in zip(results["sizes"], results.get("memory", [])):
+        base = base_memory.get(size)
+        if base and cur > base * threshold:
+            regressions.append("memory: %d entries: %d > %d bytes/entry "
+                               "(x%.2f)" % (size, cur, base,
+                                            float(cur) / base))
+    return regressions
+
+
+def save_results(results, path):
+    """Save benchmark results as a JSON baseline.
+    """
+    with open(path, "w") as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+
+def load_results(path):
+    """Load benchmark results from a JSON baseline.
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def format_results(results):
+    """Format benchmark results as a table of times in milliseconds.
+    """
+    sizes = results["sizes"]
+    name_width = max([len(name) for name in results["times"]] + [11])
+    lines = ["%-*s %s" % (name_width, "benchmark",
+                          " ".join("%12d" % s for s in sizes))]
+    for (name, fn) in BENCHMARKS:
+        if name not in results["times"]:
+            continue
+        times = results["times"][name]
+        lines.append("%-*s %s" % (name_width, name,
+                                  " ".join("%10.3fms" % (t * 1000.0)
+                                           for t in times)))
+    if results.get("memory"):
+        lines.append("%-*s %s" % (name_width, "bytes/entry",
+                                  " ".join("%12d" % m
+                                           for m in results["memory"])))
+    return "\n".join(lines)
+
+
+def main(args):
+    parser = ArgumentParser(prog="boom_bench",
+                            description="Boom scalability benchmarks")
+    parser.add_argument("--sizes", metavar="N[,N...]", type=str,
+                        default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma separated list of entry counts")
+    parser.add_argument("--profiles", metavar="M", type=int, default=4,
+                        help="Number of OsProfiles per fixture")
+    parser.add_argument("--hosts", metavar="H", type=int, default=4,
+                        help="Number of HostProfiles per fixture")
+    parser.add_argument("--no-os-identifier", action="store_true",
+                        help="Omit #OsIdentifier comments from entries")
+    parser.add_argument("--repeat", metavar="COUNT", type=int,
+                        default=DEFAULT_REPEAT,
+                        help="Number of timed runs per benchmark")
+    parser.add_argument("--bench", metavar="NAME[,NAME...]", type=str,
+                        help="Comma separated list of benchmarks to run")
+    parser.add_argument("--output", metavar="FILE", type=str,
+                        help="Save results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", type=str,
+                        help="Compare results to a JSON baseline")
+    parser.add_argument("--threshold", metavar="FACTOR", type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help="Slowdown factor reported as a regression")
+    parser.add_argument("--exponent-slack", metavar="DELTA", type=float,
+                        default=DEFAULT_EXPONENT_SLACK,
+                        help="Growth exponent increase reported as a "
+                        "regression")
+    parser.add_argument("--tmp-dir", metavar="PATH", type=str,
+                        help="Directory in which to create fixtures")
+    cmd_args = parser.parse_args(args[1:])
+
+    sizes = [int(s) for s in cmd_args.sizes.split(",")]
+    names = cmd_args.bench.split(",") if cmd_args.bench else None
+
+    results = run_benchmarks(sizes=sizes, nr_profiles=cmd_args.profiles,
+                             nr_hosts=cmd_args.hosts,
+                             os_identifier=not cmd_args.no_os_identifier,
+                             repeat=cmd_args.repeat, names=names,
+                             tmp_dir=cmd_args.tmp_dir)
+    print(format_results(results))
+
+    if cmd_args.output:
+        save_results(results, cmd_args.output)
+
+    if cmd_args.compare:
+        regressions = compare_results(load_results(cmd_args.compare),
+                                      results,
+                                      threshold=cmd_args.threshold,
+                                      exponent_slack=cmd_args.exponent_slack)
+        for regression in regressions:
+            print("REGRESSION: %s" % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,193 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# fixtures.py - Synthetic boot directory generator for boom benchmarks
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+"""Synthetic boot directory generator for boom benchmarks.
+
+Profiles, host profiles and boot entries are written directly in the
+on-disk formats used by boom rather than via the boom API, so that
+large fixtures can be generated quickly and without calling
+``fdatasync()`` for every file.
+"""
+from hashlib import sha1
+from os import makedirs
+from os.path import join
+
+#: Root device types used for synthetic entries.
+ROOT_LVM = "lvm"
+ROOT_BTRFS = "btrfs"
+ROOT_PLAIN = "plain"
+ROOT_TYPES = [ROOT_LVM, ROOT_BTRFS, ROOT_PLAIN]
+
+#: The machine_id used for entries when no host profiles are generated.
+BENCH_MACHINE_ID = "be0cbe0cbe0cbe0cbe0cbe0cbe0cbe0c"
+
+_boom_conf = """[global]
+boot_root = %s
+boom_root = %%(boot_root)s/boom
+
+[legacy]
+enable = False
+format = grub1
+sync = True
+"""
+
+_grub_conf = """default=0
+timeout=5
+"""
+
+
+def _sha(data):
+    return sha1(data.encode("utf-8")).hexdigest()
+
+
+def _write(path, lines):
+    with open(path, "w") as f:
+        f.write("".join(lines))
+
+
+def profile_os_id(index):
+    """Return the ``os_id`` of synthetic profile number ``index``.
+    """
+    return _sha("bench%d" % index + "%d (Bench)" % index + "%d" % index)
+
+
+def host_machine_id(index):
+    """Return the ``machine_id`` of synthetic host number ``index``.
+    """
+    return "%032x" % (0xb0000000 + index)
+
+
+def entry_version(index, profile):
+    """Return the kernel version of synthetic entry number ``index``,
+        using profile number ``profile``.
+    """
+    return "4.%d.%d-%d.bench%d.x86_64" % (index // 1000, index % 1000,
+                                          index % 7, profile)
+
+
+def _root_params(index, root_type):
+    """Return the ``(root_device, root_opts, lv)`` values for a synthetic
+        entry.
+    """
+    if root_type == ROOT_LVM:
+        lv = "vg%d/lv%d" % (index % 4, index)
+        return ("/dev/%s" % lv, " rd.lvm.lv=%s" % lv, lv)
+    if root_type == ROOT_BTRFS:
+        subvol = "/snapshots/snap%d" % index
+        return ("/dev/sda%d" % (index % 8 + 1),
+                " rootflags=subvol=%s" % subvol, None)
+    return ("/dev/sdb%d" % (index % 8 + 1), "", None)
+
+
+def make_profiles(profiles_path, nr_profiles):
+    """Write ``nr_profiles`` synthetic OsProfile files.
+    """
+    for i in range(nr_profiles):
+        os_id = profile_os_id(i)
+        _write(join(profiles_path, "%s-bench%d.profile" % (os_id, i)), [
+            'BOOM_OS_ID="%s"\n' % os_id,
+            'BOOM_OS_NAME="Bench Linux"\n',
+            'BOOM_OS_SHORT_NAME="bench%d"\n' % i,
+            'BOOM_OS_VERSION="%d (Bench)"\n' % i,
+            'BOOM_OS_VERSION_ID="%d"\n' % i,
+            'BOOM_OS_UNAME_PATTERN="bench%d"\n' % i,
+            'BOOM_OS_KERNEL_PATTERN="/vmlinuz-%{version}"\n',
+            'BOOM_OS_INITRAMFS_PATTERN="/initramfs-%{version}.img"\n',
+            'BOOM_OS_ROOT_OPTS_LVM2="rd.lvm.lv=%{lvm_root_lv}"\n',
+            'BOOM_OS_ROOT_OPTS_BTRFS="rootflags=%{btrfs_subvolume}"\n',
+            'BOOM_OS_OPTIONS="root=%{root_device} ro %{root_opts}"\n'
+        ])
+
+
+def make_hosts(hosts_path, nr_hosts, nr_profiles):
+    """Write ``nr_hosts`` synthetic HostProfile files.
+    """
+    for i in range(nr_hosts):
+        machine_id = host_machine_id(i)
+        host_id = _sha(machine_id)
+        _write(join(hosts_path, "%s-benchhost%d.host" % (host_id, i)), [
+            'BOOM_HOST_ID="%s"\n' % host_id,
+            'BOOM_HOST_NAME="benchhost%d"\n' % i,
+            'BOOM_ENTRY_MACHINE_ID="%s"\n' % machine_id,
+            'BOOM_OS_ID="%s"\n' % profile_os_id(i % nr_profiles),
+            'BOOM_HOST_LABEL=""\n'
+        ])
+
+
+def make_entries(entries_path, nr_entries, nr_profiles, nr_hosts,
+                 os_identifier=True, root_types=None):
+    """Write ``nr_entries`` synthetic BLS boot entry files.
+
+        Entries are distributed round-robin across profiles, hosts and
+        root device types.
+    """
+    root_types = root_types or ROOT_TYPES
+    for i in range(nr_entries):
+        profile = i % nr_profiles
+        if nr_hosts:
+            machine_id = host_machine_id(i % nr_hosts)
+        else:
+            machine_id = BENCH_MACHINE_ID
+        version = entry_version(i, profile)
+        root_type = root_types[i % len(root_types)]
+        (root_device, root_opts, _) = _root_params(i, root_type)
+
+        lines = [
+            "title Bench entry %d\n" % i,
+            "machine-id %s\n" % machine_id,
+            "version %s\n" % version,
+            "linux /vmlinuz-%s\n" % version,
+            "initrd /initramfs-%s.img\n" % version,
+            "options root=%s ro%s\n" % (root_device, root_opts)
+        ]
+        boot_id = _sha("".join(lines))
+        if os_identifier:
+            lines.insert(0, "#OsIdentifier: %s\n" % profile_os_id(profile))
+        file_name = "%s-%s-%s.conf" % (machine_id, boot_id[0:7], version)
+        _write(join(entries_path, file_name), lines)
+
+
+def make_boot_dir(boot_path, nr_entries, nr_profiles=4, nr_hosts=0,
+                  os_identifier=True, root_types=None):
+    """Generate a synthetic /boot directory at ``boot_path``.
+
+        :param boot_path: The directory to populate. It must not exist.
+        :param nr_entries: The number of boot entries to generate.
+        :param nr_profiles: The number of OsProfiles to generate.
+        :param nr_hosts: The number of HostProfiles to generate. If zero,
+                         all entries use ``BENCH_MACHINE_ID``.
+        :param os_identifier: Write ``#OsIdentifier`` comments to entry
+                              files. Entries without comments must be
+                              matched to a profile by uname pattern.
+        :param root_types: An optional list of ``ROOT_*`` types to use
+                           for entries (default: all types).
+        :returns: None
+    """
+    boom_path = join(boot_path, "boom")
+    profiles_path = join(boom_path, "profiles")
+    hosts_path = join(boom_path, "hosts")
+    entries_path = join(boot_path, "loader", "entries")
+    grub_path = join(boot_path, "grub")
+
+    for path in (profiles_path, hosts_path, entries_path, grub_path):
+        makedirs(path)
+
+    _write(join(boom_path, "boom.conf"), [_boom_conf % boot_path])
+    _write(join(grub_path, "grub.conf"), [_grub_conf])
+
+    make_profiles(profiles_path, nr_profiles)
+    make_hosts(hosts_path, nr_hosts, nr_profiles)
+    make_entries(entries_path, nr_entries, nr_profiles, nr_hosts,
+                 os_identifier=os_identifier, root_types=root_types)
+
+# vim: set et ts=4 sw=4 :
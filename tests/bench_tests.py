@@ -0,0 +1,86 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# bench_tests.py - Boom benchmark suite tests.
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+import unittest
+import logging
+from os import listdir
+from os.path import join
+
+log = logging.getLogger()
+log.level = logging.DEBUG
+log.addHandler(logging.FileHandler("test.log"))
+
+import boom
+
+from tests import *
+from tests.bench.fixtures import make_boot_dir
+from tests.bench.boom_bench import (run_benchmarks, compare_results,
+                                    growth_exponents)
+
+
+class BenchTests(unittest.TestCase):
+    """Tests for the boom scalability benchmark suite.
+    """
+    def setUp(self):
+        reset_sandbox()
+        self._config = boom.get_boom_config()
+
+    def tearDown(self):
+        boom.bootloader.drop_entries()
+        boom.hostprofile.drop_host_profiles()
+        boom.osprofile.drop_profiles()
+        rm_sandbox()
+        boom.set_boom_config(self._config)
+        reset_boom_paths()
+
+    def test_make_boot_dir(self):
+        boot_path = join(SANDBOX_PATH, "boot")
+        make_boot_dir(boot_path, 12, nr_profiles=3, nr_hosts=2)
+        self.assertEqual(len(listdir(join(boot_path, "loader/entries"))), 12)
+        self.assertEqual(len(listdir(join(boot_path, "boom/profiles"))), 3)
+        self.assertEqual(len(listdir(join(boot_path, "boom/hosts"))), 2)
+
+    def test_run_benchmarks(self):
+        names = ["load_entries", "find_all", "find_version"]
+        results = run_benchmarks(sizes=[4, 8], repeat=1, names=names,
+                                 tmp_dir=SANDBOX_PATH)
+        self.assertEqual(results["sizes"], [4, 8])
+        self.assertEqual(sorted(results["times"].keys()), sorted(names))
+        for times in results["times"].values():
+            self.assertEqual(len(times), 2)
+        self.assertEqual(len(results["memory"]), 2)
+        self.assertTrue(all(results["memory"]))
+        # Fixture directories are removed after each size.
+        self.assertEqual(listdir(SANDBOX_PATH), [])
+
+    def test_growth_exponents(self):
+        self.assertEqual(growth_exponents([10, 100], [1.0, 10.0]), [1.0])
+        self.assertEqual(growth_exponents([10, 100], [1.0, 100.0]), [2.0])
+
+    def test_compare_results_no_regression(self):
+        baseline = {"sizes": [100, 1000], "times": {"a": [0.1, 1.0]}}
+        results = {"sizes": [100, 1000], "times": {"a": [0.11, 1.05]}}
+        self.assertEqual(compare_results(baseline, results), [])
+
+    def test_compare_results_slowdown(self):
+        baseline = {"sizes": [100, 1000], "times": {"a": [0.1, 1.0]}}
+        results = {"sizes": [100, 1000], "times": {"a": [0.3, 3.0]}}
+        self.assertEqual(len(compare_results(baseline, results)), 2)
+
+    def test_compare_results_growth(self):
+        baseline = {"sizes": [100, 1000], "times": {"a": [0.1, 1.0]}}
+        results = {"sizes": [100, 1000], "times": {"a": [0.1, 10.0]}}
+        regressions = compare_results(baseline, results)
+        self.assertTrue(any("growth exponent" in r for r in regressions))
+
+# vim: set et ts=4 sw=4 :
@@ -14,17 +14,19 @@
 
 import unittest
 import logging
+import pickle
 import boom
 from sys import stdout
-from os.path import abspath
+from os.path import abspath, join
+from threading import Thread
 
 from tests import *
+from tests.bench.fixtures import make_boot_dir
 
 log = logging.getLogger()
 log.level = logging.DEBUG
 log.addHandler(logging.FileHandler("test.log"))
 
-BOOT_ROOT_TEST = abspath("./tests")
 # Override default BOOT_ROOT.
 boom.set_boot_path(BOOT_ROOT_TEST)
 
@@ -127,6 +129,50 @@ class BoomTests(unittest.TestCase):
         (name, value) = boom.parse_name_value('n v=v1', separator=None)
         self.assertEqual(value, "v=v1")
 
+    def test_intern_string(self):
+        a = "".join(["intern", "_test"])
+        b = "".join(["intern", "_test"])
+        self.assertFalse(a is b)
+        self.assertTrue(boom.intern_string(a) is boom.intern_string(b))
+        self.assertEqual(boom.intern_string(None), None)
+        self.assertEqual(boom.intern_string(1), 1)
+
+    def test_tokenize_name_values_default(self):
+        lines = ["n=v", "n='v'", 'n = "v"', "n=v # Qux.", "n=v=v1"]
+        tokens = boom.tokenize_name_values("\n".join(lines) + "\n")
+        self.assertEqual(len(tokens), len(lines))
+        for (line, token) in zip(lines, tokens):
+            self.assertEqual(token[0:2], boom.parse_name_value(line))
+            self.assertEqual(token[2], "")
+
+        # Assert that a malformed line raises ValueError
+        for data in ["n\n", "n==v\n", "n+=v\n"]:
+            with self.assertRaises(ValueError) as cm:
+                boom.tokenize_name_values(data)
+
+    def test_tokenize_name_values_whitespace(self):
+        lines = ["n v", "n 'v'", 'n   "v"', "n v # Qux.", "n v=v1"]
+        tokens = boom.tokenize_name_values("\n".join(lines),
+                                           separator=None)
+        self.assertEqual(len(tokens), len(lines))
+        for (line, token) in zip(lines, tokens):
+            self.assertEqual(token[0:2],
+                             boom.parse_name_value(line, separator=None))
+
+        # Assert that a malformed line raises ValueError
+        for data in ["n\n", "n =v\n", "n+ v\n", "n   \n"]:
+            with self.assertRaises(ValueError) as cm:
+                boom.tokenize_name_values(data, separator=None)
+
+    def test_tokenize_name_values_comments(self):
+        data = "# One\n\n  # Two\nn1=v1\nn2=v2\n#Three\nn3=v3\n# End\n"
+        tokens = boom.tokenize_name_values(data)
+        self.assertEqual(tokens, [
+            ("n1", "v1", "# One\n\n  # Two\n"),
+            ("n2", "v2", ""),
+            ("n3", "v3", "#Three\n")
+        ])
+
     def test_blank_or_comment(self):
         self.assertTrue(boom.blank_or_comment(""))
         self.assertTrue(boom.blank_or_comment("# this is a comment"))
@@ -158,6 +204,33 @@ class BoomTests(unittest.TestCase):
         bl.set_debug_mask(boom.BOOM_DEBUG_ENTRY)
         bl.debug_masked("qux")
 
+    def test_perf_metrics_disabled(self):
+        boom.set_debug_mask(0)
+        boom.reset_perf_metrics()
+        boom.perf_count(boom.PERF_FILES_OPENED)
+        with boom.PerfTimer(boom.PERF_ENTRY_LOAD):
+            pass
+        self.assertEqual(boom.get_perf_metrics(),
+                         {"times": {}, "counters": {}})
+
+    def test_perf_metrics(self):
+        boom.set_debug_mask(boom.BOOM_DEBUG_PERF)
+        boom.reset_perf_metrics()
+        try:
+            boom.perf_count(boom.PERF_FILES_OPENED)
+            boom.perf_count(boom.PERF_FILES_OPENED, 2)
+            with boom.PerfTimer(boom.PERF_ENTRY_LOAD):
+                pass
+            metrics = boom.get_perf_metrics()
+            self.assertEqual(metrics["counters"][boom.PERF_FILES_OPENED], 3)
+            self.assertTrue(boom.PERF_ENTRY_LOAD in metrics["times"])
+            summary = boom.format_perf_metrics()
+            self.assertTrue(boom.PERF_FILES_OPENED in summary)
+            self.assertTrue(boom.PERF_ENTRY_LOAD in summary)
+        finally:
+            boom.set_debug_mask(0)
+            boom.reset_perf_metrics()
+
     def test_BoomConfig__str__(self):
         bc = boom.BoomConfig(boot_path="/boot", legacy_enable=False)
         xstr = ('[defaults]\nboot_path = "/boot"\nboom_path = "/boot/boom"\n\n'
@@ -172,8 +245,11 @@ class BoomTests(unittest.TestCase):
         self.assertEqual(repr(bc), xrepr)
 
     def test_set_boom_config(self):
+        old_bc = boom.get_boom_config()
         bc = boom.BoomConfig(boot_path="/boot", legacy_enable=False)
         boom.set_boom_config(bc)
+        self.assertTrue(boom.get_boom_config() is bc)
+        boom.set_boom_config(old_bc)
 
     def test_set_boom_config_bad_config(self):
         class Qux(object):
@@ -234,6 +310,94 @@ class BoomTests(unittest.TestCase):
         s = boom.Selection(boot_id="1")
         self.assertFalse(s.is_null())
 
+    def test_Selection_from_cmd_args_select(self):
+        cmd_args = MockArgs()
+        cmd_args.select = "version=4.* or title=foo"
+        s = boom.Selection.from_cmd_args(cmd_args)
+        self.assertEqual(str(s.expr), "version=4.* or title=foo")
+
+    def test_Selection_from_expr(self):
+        s = boom.Selection.from_expr("version=1")
+        self.assertFalse(s.is_null())
+        self.assertEqual(s.expr.attrs, set(["version"]))
+        # An expression using OsProfile attributes is valid for profiles
+        s = boom.Selection.from_expr("os_name=Fedora or os_version_id=26")
+        s.check_valid_selection(profile=True)
+        # A version is invalid for an OsProfile select
+        s = boom.Selection.from_expr("os_name=Fedora or version=1")
+        with self.assertRaises(ValueError) as cm:
+            s.check_valid_selection(profile=True)
+
+    def test_Selection_pickle(self):
+        s = boom.Selection(boot_id="1234567", version="4.16*",
+                           lvm_root_lv="vg/lv", os_name="Fedora")
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            s2 = pickle.loads(pickle.dumps(s, protocol))
+            for attr in boom.Selection.__slots__:
+                self.assertEqual(getattr(s2, attr), getattr(s, attr))
+
+    def test_Selection_pickle_expr(self):
+        getters = {"version": lambda o: o}
+        s = boom.Selection.from_expr("version in (1, 2) and not version=2")
+        # Compile a predicate before pickling.
+        self.assertTrue(s.expr.match("1", getters))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            s2 = pickle.loads(pickle.dumps(s, protocol))
+            self.assertEqual(str(s2.expr), str(s.expr))
+            self.assertEqual(s2.expr.attrs, s.expr.attrs)
+            self.assertTrue(s2.expr.match("1", getters))
+            self.assertFalse(s2.expr.match("2", getters))
+
+    def test_Selection_from_expr_bad_expr(self):
+        bad_exprs = [
+            "", "version", "version=", "bogus=1", "version=1 and",
+            "(version=1", "version=1)", "version in (1,", "version=~'('",
+            "version=1 title=2", "and=1", "version='1"
+        ]
+        for expr in bad_exprs:
+            with self.assertRaises(ValueError) as cm:
+                boom.Selection.from_expr(expr)
+
+    def test_SelectionExpr_match(self):
+        getters = {
+            "version": lambda o: o[0],
+            "boot_id": lambda o: o[1],
+            "title": lambda o: o[2]
+        }
+        objs = [
+            ("4.16.1", "abcdef", "Fedora"),
+            ("4.18.0", "abd123", "Fedora (rescue)"),
+            ("4.17.3", "123456", None)
+        ]
+
+        def matches(expr):
+            pred = boom.SelectionExpr(expr).predicate(getters)
+            return [o[0] for o in objs if pred(o)]
+
+        self.assertEqual(matches("version=4.1[68].*"), ["4.16.1", "4.18.0"])
+        self.assertEqual(matches("version in (4.16.1, 4.17.3)"),
+                         ["4.16.1", "4.17.3"])
+        self.assertEqual(matches("boot_id=ab"), ["4.16.1", "4.18.0"])
+        self.assertEqual(matches("title =~ '\\(rescue\\)$'"), ["4.18.0"])
+        self.assertEqual(matches("title !~ rescue"), ["4.16.1", "4.17.3"])
+        self.assertEqual(matches("title != Fedora"), ["4.18.0", "4.17.3"])
+        self.assertEqual(matches("not version=4.16.1 and title=Fedora*"),
+                         ["4.18.0"])
+        self.assertEqual(matches("version=4.17.3 or (boot_id=abc and "
+                                 "title='Fedora')"), ["4.16.1", "4.17.3"])
+
+    def test_SelectionExpr_unknown(self):
+        # Conditions on attributes without an accessor are unknown.
+        getters = {"version": lambda o: o}
+        expr = boom.SelectionExpr("version=1 and title=foo")
+        self.assertEqual(expr.predicate(getters)("1"), None)
+        self.assertEqual(expr.predicate(getters)("2"), False)
+        self.assertTrue(expr.match("1", getters))
+        self.assertFalse(expr.match("2", getters))
+        expr = boom.SelectionExpr("version=1 or title=foo")
+        self.assertEqual(expr.predicate(getters)("1"), True)
+        self.assertEqual(expr.predicate(getters)("2"), None)
+
     def test__get_machine_id(self):
         # FIXME: does not cover _DBUS_MACHINE_ID hosts or exceptions
         # reading /etc/machine-id.
@@ -281,4 +445,248 @@ class BoomPathTests(unittest.TestCase):
         with self.assertRaises(ValueError) as cm:
             boom.set_boom_path("loader")
 
+
+class BoomContextTests(unittest.TestCase):
+    def setUp(self):
+        reset_sandbox()
+        self._config = boom.get_boom_config()
+        self._roots = []
+        for (i, nr_entries) in enumerate([3, 5]):
+            root = join(SANDBOX_PATH, "root%d" % i)
+            make_boot_dir(root, nr_entries)
+            self._roots.append(root)
+
+    def tearDown(self):
+        import boom.bootloader
+        import boom.osprofile
+        boom.bootloader.drop_entries()
+        boom.osprofile.drop_profiles()
+        rm_sandbox()
+        boom.set_boom_config(self._config)
+        reset_boom_paths()
+
+    def test_BoomContext_bad_args(self):
+        with self.assertRaises(ValueError) as cm:
+            boom.BoomContext()
+        with self.assertRaises(ValueError) as cm:
+            boom.BoomContext(boot_path="relative/boot")
+
+    def test_BoomContext_paths(self):
+        ctx = boom.BoomContext(boot_path=self._roots[0])
+        self.assertEqual(ctx.boot_path, self._roots[0])
+        self.assertEqual(ctx.boom_path, join(self._roots[0], "boom"))
+        self.assertEqual(ctx.config_path,
+                         join(self._roots[0], "boom", "boom.conf"))
+        self.assertFalse(ctx.active)
+        with ctx:
+            self.assertTrue(ctx.active)
+            self.assertEqual(boom.get_boom_context(), ctx)
+            self.assertEqual(boom.get_boot_path(), self._roots[0])
+            self.assertEqual(boom.get_boom_config_path(), ctx.config_path)
+        self.assertEqual(boom.get_boom_context(), None)
+        self.assertEqual(boom.get_boot_path(), BOOT_ROOT_TEST)
+
+    def test_BoomContext_isolation(self):
+        import boom.bootloader
+        from boom.bootloader import find_entries
+        default_entries = find_entries()
+        contexts = [boom.BoomContext(boot_path=root) for root in self._roots]
+        with contexts[0]:
+            self.assertEqual(len(find_entries()), 3)
+        with contexts[1]:
+            self.assertEqual(len(find_entries()), 5)
+            # Contexts may nest.
+            with contexts[0]:
+                self.assertEqual(len(find_entries()), 3)
+            self.assertEqual(boom.get_boot_path(), self._roots[1])
+        # Entries are retained by the context that loaded them.
+        with contexts[0]:
+            self.assertEqual(len(boom.bootloader._entries), 3)
+        # The default context is unchanged.
+        self.assertEqual(boom.bootloader._entries, default_entries)
+
+    def test_BoomContext_legacy_deferral(self):
+        import boom.command
+        ctx = boom.BoomContext(boot_path=self._roots[0])
+        with ctx:
+            self.assertFalse(boom.command._legacy_pending)
+            boom.command._legacy_deferred = True
+            boom.command._legacy_pending = True
+        self.assertFalse(boom.command._legacy_deferred)
+        self.assertFalse(boom.command._legacy_pending)
+        with ctx:
+            self.assertTrue(boom.command._legacy_pending)
+
+    def test_BoomContext_already_active(self):
+        ctx = boom.BoomContext(boot_path=self._roots[0])
+        with ctx:
+            with self.assertRaises(ValueError) as cm:
+                with ctx:
+                    pass
+        self.assertEqual(boom.get_boom_context(), None)
+
+    def test_BoomContext_default_context_lock(self):
+        from threading import Event
+        entered = Event()
+        release = Event()
+        locked = Event()
+        boot_paths = []
+
+        def use_context():
+            with boom.BoomContext(boot_path=self._roots[0]):
+                entered.set()
+                release.wait(5)
+
+        def use_default():
+            with boom.BoomLock():
+                locked.set()
+                boot_paths.append(boom.get_boot_path())
+
+        threads = [Thread(target=use_context), Thread(target=use_default)]
+        threads[0].start()
+        entered.wait(5)
+        threads[1].start()
+        # The default context waits for the active context to exit.
+        self.assertFalse(locked.wait(0.2))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(boot_paths, [BOOT_ROOT_TEST])
+
+    def test_BoomContext_threads(self):
+        from boom.bootloader import find_entries
+        results = {}
+
+        def count_entries(root):
+            for i in range(3):
+                with boom.BoomContext(boot_path=root):
+                    results[(root, i)] = len(find_entries())
+
+        threads = [Thread(target=count_entries, args=(root,))
+                   for root in self._roots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(3):
+            self.assertEqual(results[(self._roots[0], i)], 3)
+            self.assertEqual(results[(self._roots[1], i)], 5)
+
+
+class BoomLockTests(unittest.TestCase):
+    def setUp(self):
+        reset_sandbox()
+        self._config = boom.get_boom_config()
+        boom.set_boom_config(boom.BoomConfig(boot_path=SANDBOX_PATH,
+                                             boom_path=SANDBOX_PATH))
+        self.lock_path = join(SANDBOX_PATH, boom.BOOM_LOCK_FILE)
+
+    def tearDown(self):
+        boom.set_boom_config(self._config)
+        rm_sandbox()
+
+    def _try_lock(self, exclusive):
+        """Attempt a non-blocking lock on the lock file from a separate
+            open file description, as another process would.
+        """
+        import fcntl
+        op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        with open(self.lock_path, "r") as f:
+            try:
+                fcntl.flock(f.fileno(), op | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return False
+        return True
+
+    def test_BoomLock_shared(self):
+        with boom.BoomLock():
+            self.assertTrue(self._try_lock(False))
+            self.assertFalse(self._try_lock(True))
+        self.assertTrue(self._try_lock(True))
+
+    def test_BoomLock_exclusive(self):
+        with boom.BoomLock(exclusive=True):
+            self.assertFalse(self._try_lock(False))
+        self.assertTrue(self._try_lock(True))
+
+    def test_BoomLock_nested_upgrade(self):
+        with boom.BoomLock():
+            with boom.BoomLock(exclusive=True):
+                self.assertFalse(self._try_lock(False))
+            # Downgraded to the outer shared lock.
+            self.assertTrue(self._try_lock(False))
+            self.assertFalse(self._try_lock(True))
+        self.assertTrue(self._try_lock(True))
+
+    def test_BoomLock_timeout(self):
+        import fcntl
+        with boom.BoomLock():
+            pass
+        with open(self.lock_path, "r") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            with self.assertRaises(boom.BoomLockError) as cm:
+                with boom.BoomLock(exclusive=True, timeout=0.1):
+                    pass
+            # Shared locks do not conflict.
+            with boom.BoomLock(timeout=0):
+                pass
+
+    def test_BoomLock_upgrade_timeout_keeps_shared(self):
+        import fcntl
+        with boom.BoomLock():
+            with open(self.lock_path, "r") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+                with self.assertRaises(boom.BoomLockError):
+                    with boom.BoomLock(exclusive=True, timeout=0.1):
+                        pass
+            # The outer shared lock is still held.
+            self.assertFalse(self._try_lock(True))
+            self.assertTrue(self._try_lock(False))
+        self.assertTrue(self._try_lock(True))
+
+    def test_BoomLock_upgrade_lost_shared(self):
+        import fcntl
+        from errno import EAGAIN
+        from time import time
+
+        class ContendedFcntl(object):
+            """An ``fcntl`` whose non-blocking locks always fail, as if
+                another process took an exclusive lock during an upgrade.
+            """
+            LOCK_SH = fcntl.LOCK_SH
+            LOCK_EX = fcntl.LOCK_EX
+            LOCK_NB = fcntl.LOCK_NB
+
+            def flock(self, fd, operation):
+                if operation & fcntl.LOCK_NB:
+                    raise IOError(EAGAIN, "Resource temporarily unavailable")
+                fcntl.flock(fd, operation)
+
+        with boom.BoomLock():
+            boom._boom.fcntl = ContendedFcntl()
+            try:
+                start = time()
+                with self.assertRaises(boom.BoomLockError) as cm:
+                    with boom.BoomLock(exclusive=True, timeout=0.1):
+                        pass
+                # The shared lock is not re-taken by a blocking call.
+                self.assertTrue(time() - start < 1)
+                self.assertTrue("shared lock lost" in str(cm.exception))
+            finally:
+                boom._boom.fcntl = fcntl
+
+    def test_commit_entries_exclusive(self):
+        import fcntl
+        from boom.bootloader import commit_entries, remove_entries
+        config = boom.get_boom_config()
+        config.lock_timeout = 0.1
+        with boom.BoomLock():
+            pass
+        with open(self.lock_path, "r") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            with self.assertRaises(boom.BoomLockError):
+                commit_entries([])
+            with self.assertRaises(boom.BoomLockError):
+                remove_entries([])
+
 # vim: set et ts=4 sw=4 :
@@ -15,9 +15,10 @@ import unittest
 import logging
 from sys import stdout
 from os import listdir, makedirs, mknod, unlink
-from os.path import abspath, exists, join
+from os.path import abspath, basename, dirname, exists, join
 from stat import S_IFBLK, S_IFCHR
 import shutil
+import pickle
 
 # Test suite paths
 from tests import *
@@ -39,6 +40,41 @@ log.addHandler(logging.FileHandler("test.log"))
 
 _test_osp = None
 
+class KernelCmdlineTests(unittest.TestCase):
+    def test_KernelCmdline_str_preserves_order(self):
+        opts = "ro quiet console=tty0 console=ttyS0 rhgb quiet"
+        cmdline = KernelCmdline(opts)
+        self.assertEqual(str(cmdline), opts)
+        self.assertEqual(len(cmdline), 6)
+
+    def test_KernelCmdline_lookup(self):
+        cmdline = KernelCmdline(["ro", "console=tty0", "console=ttyS0"])
+        self.assertTrue("ro" in cmdline)
+        self.assertFalse("console" in cmdline)
+        self.assertTrue(cmdline.has_name("console"))
+        self.assertEqual(cmdline.get("console"),
+                         ["console=tty0", "console=ttyS0"])
+
+    def test_KernelCmdline_add(self):
+        cmdline = KernelCmdline("ro quiet")
+        cmdline.add("quiet")
+        cmdline.add("debug")
+        cmdline.append("debug")
+        self.assertEqual(str(cmdline), "ro quiet debug debug")
+
+    def test_KernelCmdline_drop(self):
+        cmdline = KernelCmdline("ro quiet console=tty0 console=ttyS0 rhgb")
+        cmdline.drop("console=tty0")
+        self.assertEqual(str(cmdline), "ro quiet console=ttyS0 rhgb")
+        cmdline.drop("rhgb")
+        cmdline.drop("quiet=")
+        self.assertEqual(str(cmdline), "ro console=ttyS0")
+        cmdline.drop("console=")
+        self.assertEqual(str(cmdline), "ro")
+        self.assertFalse(cmdline.has_name("console"))
+        cmdline.drop("nonexistent=")
+        self.assertEqual(list(cmdline), ["ro"])
+
 class BootParamsTests(unittest.TestCase):
     def test_BootParams_no_version_raises(self):
         with self.assertRaises(ValueError) as cm:
@@ -52,6 +88,15 @@ class BootParamsTests(unittest.TestCase):
                             btrfs_subvol_path="/snapshots/snap-1",
                             btrfs_subvol_id="232")
 
+    def test_BootParams_pickle(self):
+        bp = BootParams(version="1.1.1.x86_64", lvm_root_lv="vg00/lvol0",
+                        add_opts=["debug"], del_opts=["rhgb"])
+        bp2 = pickle.loads(pickle.dumps(bp, 2))
+        self.assertEqual(repr(bp2), repr(bp))
+        self.assertEqual(bp2.add_opts, ["debug"])
+        self.assertEqual(bp2.del_opts, ["rhgb"])
+        self.assertEqual(bp2.generation, bp.generation)
+
     def test_BootParams_plain__str__and__repr__(self):
         # Plain root_device
         bp = BootParams(version="1.1.1.x86_64", root_device="/dev/sda5")
@@ -381,6 +426,22 @@ class BootEntryTests(unittest.TestCase):
         self.test_osp = None
         self.test_bp = None
 
+    def test_BootEntry_pickle(self):
+        be = find_entries()[0]
+        be2 = pickle.loads(pickle.dumps(be, 2))
+        self.assertEqual(be2.boot_id, be.boot_id)
+        self.assertEqual(str(be2), str(be))
+        # The profile is re-bound rather than copied.
+        self.assertTrue(be2._osp is be._osp)
+
+    def test_BootEntry_pickle_unwritten(self):
+        be = self.test_be
+        be2 = pickle.loads(pickle.dumps(be, 2))
+        self.assertTrue(be2._osp is self.test_osp)
+        self.assertEqual(repr(be2.bp), repr(be.bp))
+        self.assertEqual(be2.options, be.options)
+        self.assertEqual(be2.boot_id, be.boot_id)
+
     # BootParams recovery tests
     def test_BootParams_from_entry_no_opts(self):
         osp = self.test_osp
@@ -722,13 +783,45 @@ class BootEntryTests(unittest.TestCase):
         be = self.test_be
         self.assertFalse(be == NotABootEntry())
 
-    def test__add_entry_loads_entries(self):
+    def test__add_entry_does_not_load_entries(self):
         boom.bootloader._entries = None
-        osp = self.test_osp
         be = self.test_be
+        boom.reset_io_counts()
         boom.bootloader._add_entry(be)
-        self.assertTrue(boom.bootloader._entries)
-        self.assertTrue(boom.osprofile._profiles)
+        self.assertFalse(boom.bootloader._entries)
+        self.assertEqual(boom.get_io_counts()[boom.IO_OPEN], 0)
+
+    def test__add_entry_adds_to_loaded_entries(self):
+        boom.bootloader.load_entries()
+        be = self.test_be
+        boom.bootloader._add_entry(be)
+        self.assertTrue(be in boom.bootloader._entries)
+
+    def test_find_profile_entries(self):
+        osp = get_os_profile_by_id("6bf746bb7231693b2903585f171e4290ff0602b5")
+        bes = find_profile_entries(osp)
+        self.assertEqual(len(bes), 10)
+        for be in bes:
+            self.assertTrue(be._osp is osp)
+        # The index follows entries as they are removed.
+        boom.bootloader._del_entry(bes[0])
+        self.assertEqual(len(find_profile_entries(osp)), 9)
+
+    def test__serialize_cached_until_profile_change(self):
+        osp = get_os_profile_by_id("6bf746bb7231693b2903585f171e4290ff0602b5")
+        be = [be for be in find_profile_entries(osp)
+              if BOOM_ENTRY_OPTIONS not in be._entry_data][0]
+        key_data = be._serialize()
+        self.assertTrue(be._serialize() is key_data)
+        self.assertTrue(str(be).startswith("title "))
+        self.assertTrue(be._serialize() is key_data)
+        options = osp.options
+        try:
+            osp.options = options + " serialize_test"
+            self.assertFalse(be._serialize() is key_data)
+            self.assertTrue("serialize_test" in str(be))
+        finally:
+            osp.options = options
 
     def test__del_entry_deletes_entry(self):
         boom.bootloader.load_entries()
@@ -759,6 +852,84 @@ class BootEntryTests(unittest.TestCase):
         bes = boom.bootloader.find_entries(Selection(boot_id=boot_id))
         self.assertEqual(len(bes), 1)
 
+    def test_find_entries_by_boot_id_pruned(self):
+        # Test that a boot_id search with no entries loaded only opens
+        # files with a matching name, and leaves the entries unloaded.
+        boot_id = "12a2696bf85cc33f42f0449fab5da64dac7aa10a"
+        boom.bootloader._entries = None
+        boom.reset_io_counts()
+        bes = boom.bootloader.find_entries(Selection(boot_id=boot_id[0:5]))
+        self.assertEqual(len(bes), 1)
+        self.assertEqual(bes[0].boot_id, boot_id)
+        self.assertFalse(boom.bootloader._entries)
+        # One directory listing and one entry file.
+        self.assertEqual(boom.get_io_counts()[boom.IO_OPEN], 2)
+
+    def test__entry_file_may_match(self):
+        may_match = boom.bootloader._entry_file_may_match
+        name = "ffffffff-5a19e74-3.3.60-12.fc24.x86_64.conf"
+        self.assertTrue(may_match(name))
+        self.assertTrue(may_match(name, machine_id="ffffffff"))
+        self.assertFalse(may_match(name, machine_id="fffffffe"))
+        self.assertTrue(may_match(name, version="3.3.60-12.fc24.x86_64"))
+        self.assertFalse(may_match(name, version="3.3.60"))
+        self.assertTrue(may_match(name, boot_id="5a1"))
+        self.assertTrue(may_match(name, boot_id="5a19e74ffff"))
+        self.assertFalse(may_match(name, boot_id="5a2"))
+        # Names not in boom format cannot be excluded.
+        self.assertTrue(may_match("other+entry.conf", machine_id="ff"))
+
+    def test_iter_entries(self):
+        boom.bootloader.load_entries()
+        version = "4.10.17-100.fc24.x86_64"
+        select = Selection(version=version)
+        bes = list(boom.bootloader.iter_entries(select))
+        self.assertEqual(bes, boom.bootloader.find_entries(select))
+        # Entries in memory are yielded in load order.
+        all_bes = list(boom.bootloader.iter_entries())
+        self.assertEqual(all_bes, boom.bootloader._entries)
+
+    def test_iter_entries_from_disk(self):
+        # Test that streaming from disk yields entries in file name
+        # order and does not populate the in-memory entries.
+        boom.bootloader.drop_entries()
+        bes = list(boom.bootloader.iter_entries(from_disk=True))
+        self.assertFalse(boom.bootloader._entries)
+        paths = [basename(be._last_path) for be in bes]
+        self.assertEqual(paths, sorted(paths))
+        boom.bootloader.load_entries()
+        self.assertEqual(len(bes), len(boom.bootloader._entries))
+
+    def test_iter_entries_bad_selection(self):
+        # Invalid selections are rejected when the iterator is created.
+        with self.assertRaises(ValueError) as cm:
+            boom.bootloader.iter_entries(Selection(host_id="12345"))
+
+    def test_find_entries_by_expr(self):
+        versions = ["4.10.17-100.fc24.x86_64", "4.11.12-100.fc24.x86_64"]
+        select = Selection.from_expr("version in (%s)" % ", ".join(versions))
+        boom.bootloader._entries = None
+        bes = boom.bootloader.find_entries(select)
+        path = boom_entries_path()
+        nr = len([p for p in listdir(path)
+                  if any(v in p for v in versions)])
+        self.assertEqual(len(bes), nr)
+        self.assertTrue(all(be.version in versions for be in bes))
+
+        # The same entries are found with entries loaded.
+        boom.bootloader.load_entries()
+        self.assertEqual(len(boom.bootloader.find_entries(select)), nr)
+
+    def test_find_entries_by_expr_params(self):
+        boom.bootloader.load_entries()
+        select = Selection.from_expr("lvm_root_lv=vg00/* and "
+                                     "not os_short_name=rhel")
+        bes = boom.bootloader.find_entries(select)
+        self.assertTrue(bes)
+        for be in bes:
+            self.assertTrue(be.bp.lvm_root_lv.startswith("vg00/"))
+            self.assertNotEqual(be._osp.os_short_name, "rhel")
+
     def test_find_entries_by_title(self):
         title = "Red Hat Enterprise Linux 7.2 (Maipo) 3.10-23.el7"
         boom.bootloader._entries = None
@@ -924,6 +1095,32 @@ class BootLoaderTests(unittest.TestCase):
                 entry_count += 1
         self.assertEqual(len(boom.bootloader._entries), entry_count)
 
+    def test_load_entries_interned(self):
+        # Test that repeated entry values are shared between entries.
+        boom.bootloader.load_entries()
+        entries = boom.bootloader._entries
+        by_machine_id = {}
+        for be in entries:
+            by_machine_id.setdefault(be.machine_id, []).append(be)
+        shared = [bes for bes in by_machine_id.values() if len(bes) > 1]
+        self.assertTrue(shared)
+        for bes in shared:
+            self.assertTrue(bes[0].machine_id is bes[1].machine_id)
+
+    def test_load_entries_perf(self):
+        # Test that entry loading records performance metrics.
+        boom.set_debug_mask(boom.BOOM_DEBUG_PERF)
+        boom.reset_perf_metrics()
+        try:
+            boom.bootloader.load_entries()
+            metrics = boom.get_perf_metrics()
+            self.assertTrue(boom.PERF_ENTRY_LOAD in metrics["times"])
+            self.assertEqual(metrics["counters"][boom.PERF_FILES_OPENED],
+                             len(boom.bootloader._entries))
+        finally:
+            boom.set_debug_mask(0)
+            boom.reset_perf_metrics()
+
     def test_load_entries_with_machine_id(self):
         # Test that loading the test entries by machine_id succeeds,
         # and returns the expected number of profiles.
@@ -950,6 +1147,187 @@ class BootLoaderTests(unittest.TestCase):
         entries = find_entries(Selection(machine_id="ffffffff"))
         self.assertEqual(len(entries), self._nr_machine_id("ffffffff"))
 
+    def test_remove_entries(self):
+        bes = find_entries(Selection(machine_id="ffffffff"))
+        paths = [be._entry_path for be in bes]
+        failed = boom.bootloader.remove_entries(bes)
+        self.assertEqual(failed, [])
+        for path in paths:
+            self.assertFalse(exists(path))
+        self.assertEqual(self._nr_machine_id("ffffffff"), 0)
+
+    def test_find_entries_foreign_file_name(self):
+        # Entry files that do not strictly follow the boom file name
+        # format must not be pruned from boot_id or version lookups.
+        be = find_entries(Selection(machine_id="ffffffff"))[0]
+        rescue_path = join(boom_entries_path(), "ffffffff-0-rescue.conf")
+        with open(be._last_path, "r") as src_f:
+            lines = src_f.readlines()
+        with open(rescue_path, "w") as dst_f:
+            for line in lines:
+                if line.startswith("title"):
+                    line = "title Rescue\n"
+                dst_f.write(line)
+        load_entries()
+        rescue = find_entries(Selection(title="Rescue"))[0]
+        self.assertEqual(rescue._last_path, rescue_path)
+        (boot_id, version) = (rescue.boot_id, rescue.version)
+        drop_entries()
+        bes = find_entries(Selection(boot_id=boot_id))
+        self.assertEqual([be._last_path for be in bes], [rescue_path])
+        drop_entries()
+        bes = find_entries(Selection(version=version))
+        self.assertTrue(rescue_path in [be._last_path for be in bes])
+
+    def test_remove_entries_missing(self):
+        be = find_entries()[0]
+        unlink(be._entry_path)
+        failed = boom.bootloader.remove_entries([be])
+        self.assertEqual(len(failed), 1)
+        self.assertTrue(isinstance(failed[0][1], ValueError))
+
+    def test_load_entries_profiles_on_demand(self):
+        from tests.bench.fixtures import make_boot_dir, profile_os_id
+        boot_path = join(SANDBOX_PATH, "ondemand")
+        make_boot_dir(boot_path, 6, nr_profiles=4)
+        with boom.BoomContext(boot_path=boot_path):
+            load_entries(machine_id=None)
+            bes = find_entries(Selection(os_id=profile_os_id(1)))
+            self.assertEqual(len(bes), 2)
+            # Entries with an OsIdentifier load only their own profiles.
+            self.assertFalse(profiles_loaded())
+            osp = bes[0]._osp
+            self.assertTrue(bes[1]._osp is osp)
+            # A full load retains the profiles bound to entries.
+            self.assertEqual(len(find_profiles()), 4)
+            self.assertTrue(get_os_profile_by_id(profile_os_id(1)) is osp)
+
+    def test_find_entries_cold_no_snapshot(self):
+        # Entries bound to the first profile loaded on demand must not
+        # be mistaken for entries bound to the Null Profile.
+        from tests.bench.fixtures import make_boot_dir
+        boot_path = join(SANDBOX_PATH, "cold")
+        make_boot_dir(boot_path, 6, nr_profiles=4)
+        boom_path = join(boot_path, "boom")
+        for name in listdir(boom_path):
+            if name.endswith(".snapshot"):
+                unlink(join(boom_path, name))
+        with boom.BoomContext(boot_path=boot_path):
+            # Return the profile list to its state at module import.
+            boom.osprofile._profiles = []
+            boom.osprofile._profiles_by_id = {}
+            self.assertEqual(len(find_entries(Selection())), 6)
+            self.assertFalse(profiles_loaded())
+
+    def test_load_entries_io_budget(self):
+        # Loading N entries with valid profile snapshots should open
+        # each entry file once, plus a small constant number of files
+        # and directories, and should never write.
+        with boom.BoomLock(exclusive=True):
+            load_profiles()
+            boom.hostprofile.load_host_profiles()
+        load_entries()
+        nr_files = len(listdir(boom_entries_path()))
+        drop_profiles()
+        boom.hostprofile.drop_host_profiles()
+        drop_entries()
+
+        boom.reset_io_counts()
+        load_entries()
+        counts = boom.get_io_counts()
+        self.assertTrue(counts[boom.IO_OPEN] <= nr_files + 5)
+        for op in (boom.IO_WRITE, boom.IO_FSYNC, boom.IO_RENAME,
+                   boom.IO_UNLINK):
+            self.assertEqual(counts[op], 0)
+
+    def test_commit_entries_io_budget(self):
+        # Committing N entries writes N files and synchronises the
+        # entries directory once.
+        bes = find_entries(Selection(machine_id="ffffffff"))
+        for be in bes:
+            be.title = be.title + " (committed)"
+        boom.reset_io_counts()
+        failed = boom.bootloader.commit_entries(bes)
+        self.assertEqual(failed, [])
+        counts = boom.get_io_counts()
+        self.assertEqual(counts[boom.IO_WRITE], len(bes))
+        self.assertEqual(counts[boom.IO_RENAME], len(bes))
+        self.assertEqual(counts[boom.IO_FSYNC], len(bes) + 1)
+        self.assertEqual(counts[boom.IO_OPEN], len(bes) + 1)
+
+    def test_commit_entries_unchanged_elides_writes(self):
+        # Re-committing unmodified entries reads each file back but
+        # never writes, renames or synchronises.
+        bes = find_entries(Selection(machine_id="ffffffff"))
+        for be in bes:
+            be.title = be.title + " (elided)"
+        self.assertEqual(boom.bootloader.commit_entries(bes), [])
+        boom.reset_io_counts()
+        self.assertEqual(boom.bootloader.commit_entries(bes), [])
+        counts = boom.get_io_counts()
+        self.assertEqual(counts[boom.IO_READ], len(bes))
+        for op in (boom.IO_WRITE, boom.IO_FSYNC, boom.IO_RENAME):
+            self.assertEqual(counts[op], 0)
+
+    def test_write_entry_unchanged_elides_write(self):
+        be = find_entries(Selection(machine_id="ffffffff"))[0]
+        be.title = be.title + " (elided)"
+        be.write_entry()
+        boom.reset_io_counts()
+        be.write_entry(force=True)
+        self.assertEqual(boom.get_io_counts()[boom.IO_RENAME], 0)
+
+    def _make_entry_root(self, nr_entries, move=True):
+        # Create a second entry root, "efi", containing the first
+        # nr_entries loaded entry files from the primary root.
+        entries_path = boom_entries_path()
+        efi_entries = join(boom.get_boot_path(), "efi", "loader/entries")
+        makedirs(efi_entries)
+        loaded = [basename(be._last_path) for be in find_entries()]
+        names = sorted(loaded)[:nr_entries]
+        for name in names:
+            copy = shutil.move if move else shutil.copy2
+            copy(join(entries_path, name), join(efi_entries, name))
+        boom.set_entry_roots([".", "efi"])
+        return (efi_entries, names)
+
+    def test_load_entries_multiple_roots(self):
+        nr_entries = len(boom.bootloader._entries)
+        (efi_entries, names) = self._make_entry_root(2)
+        self.assertEqual(len(boom_entries_paths()), 2)
+        load_entries()
+        self.assertEqual(len(boom.bootloader._entries), nr_entries)
+        moved = [be for be in boom.bootloader._entries
+                 if basename(be._last_path) in names]
+        self.assertEqual(len(moved), len(names))
+        for be in moved:
+            self.assertEqual(be._entry_path,
+                             join(efi_entries, basename(be._last_path)))
+
+    def test_write_entry_multiple_roots_keeps_origin(self):
+        (efi_entries, names) = self._make_entry_root(1)
+        load_entries()
+        be = [be for be in boom.bootloader._entries
+              if basename(be._last_path) == names[0]][0]
+        be.title = be.title + " (efi)"
+        be.write_entry()
+        # The new title changes the boot_id, and so the file name.
+        self.assertNotEqual(basename(be._entry_path), names[0])
+        self.assertEqual(dirname(be._entry_path), efi_entries)
+        self.assertTrue(exists(be._entry_path))
+        new_name = basename(be._entry_path)
+        self.assertFalse(exists(join(boom_entries_path(), new_name)))
+
+    def test_load_entries_multiple_roots_duplicate(self):
+        nr_entries = len(boom.bootloader._entries)
+        self._make_entry_root(1, move=False)
+        load_entries()
+        self.assertEqual(len(boom.bootloader._entries), nr_entries)
+
+    def test_set_entry_roots_nonexistent(self):
+        with self.assertRaises(ValueError):
+            boom.set_entry_roots(["nonexistent"])
+
     def test_Selection_no_osp_match(self):
         s = Selection(os_id="12345")
         self.assertFalse(find_entries(s))
@@ -1006,7 +1384,7 @@ class BootLoaderTestsCheckRootReal(BootLoaderTestsCheckRoot):
     add_devs = [("sda", "b")]
     def test_check_root_device_real(self):
         # Real block device node
-        boom.bootloader.check_root_device("tests/sandbox/dev/sda")
+        boom.bootloader.check_root_device(join(SANDBOX_PATH, "dev/sda"))
 
 
 class BootLoaderTestsCheckRootNonex(BootLoaderTestsCheckRoot):
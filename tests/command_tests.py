@@ -14,10 +14,11 @@
 import unittest
 import logging
 from sys import stdout
-from os import listdir, makedirs
-from os.path import abspath, exists, join
+from os import listdir, makedirs, utime
+from os.path import abspath, basename, exists, join
 import shutil
 import re
+import json
 
 # Python3 moves StringIO to io
 try:
@@ -41,14 +42,13 @@ import boom.command
 
 from tests import *
 
-BOOT_ROOT_TEST = abspath("./tests")
 config = BoomConfig()
 config.legacy_enable = False
 config.legacy_sync = False
 set_boom_config(config)
 set_boot_path(BOOT_ROOT_TEST)
 
-debug_masks = ['profile', 'entry', 'report', 'command', 'all']
+debug_masks = ['profile', 'entry', 'report', 'command', 'perf', 'all']
 
 
 class CommandHelperTests(unittest.TestCase):
@@ -86,6 +86,11 @@ class CommandHelperTests(unittest.TestCase):
         import boom.command
         self.assertEqual(boom.command._subvol_from_arg(None), (None, None))
 
+    def test_merge_add_del_opts_ordered(self):
+        import boom.command
+        merged = boom.command._merge_add_del_opts(["bar", "baz"], "foo bar")
+        self.assertEqual(merged, ["foo", "bar", "baz"])
+
     def test_str_indent(self):
         import boom.command
         instr = "1\n2\n3\n4"
@@ -431,6 +436,25 @@ class CommandTests(unittest.TestCase):
         delete_entries(Selection(boot_id=be.boot_id))
         self.assertFalse(exists(be._entry_path))
 
+    def test_create_entry_cold(self):
+        # Creating an entry with no entries or profiles in memory opens
+        # only the files needed, regardless of the number of entries.
+        import boom.bootloader
+        from tests.bench.fixtures import (make_boot_dir, profile_os_id,
+                                          BENCH_MACHINE_ID)
+        boot_path = join(SANDBOX_PATH, "cold")
+        make_boot_dir(boot_path, 50)
+        with BoomContext(boot_path=boot_path):
+            reset_io_counts()
+            osp = get_os_profile_by_id(profile_os_id(0))
+            be = create_entry("ATITLE", "2.6.0", BENCH_MACHINE_ID,
+                              "/dev/sda1", profile=osp, allow_no_dev=True)
+            self.assertTrue(exists(be._entry_path))
+            self.assertFalse(boom.bootloader._entries)
+            self.assertTrue(get_io_counts()[IO_OPEN] < 10)
+            bes = find_entries(Selection(boot_id=be.boot_id))
+            self.assertEqual(len(bes), 1)
+
     def test_create_delete_entry_with_legacy(self):
         config = BoomConfig()
         config.legacy_enable = True
@@ -448,10 +472,165 @@ class CommandTests(unittest.TestCase):
         self.assertFalse(exists(be._entry_path))
 
 
+    def test_create_entries(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        osp = get_os_profile_by_id(test_os_id)
+        specs = [
+            {"title": "Snap%d" % n, "version": "2.6.0",
+             "machine_id": "ffffffff", "root_device": "/dev/vg_hex/snap%d" % n,
+             "lvm_root_lv": "vg_hex/snap%d" % n, "profile": osp}
+            for n in range(0, 4)
+        ]
+        results = create_entries(specs, allow_no_dev=True)
+        self.assertEqual(len(results), 4)
+        for (be, error) in results:
+            self.assertEqual(error, None)
+            self.assertTrue(exists(be._entry_path))
+            self.assertTrue(find_entries(Selection(boot_id=be.boot_id)))
+
+    def test_create_entries_os_id_profile(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        specs = [{"title": "Snap", "version": "2.6.0",
+                  "machine_id": "ffffffff", "root_device": "/dev/vg_hex/snap",
+                  "profile": test_os_id[0:7]}]
+        ((be, error),) = create_entries(specs, allow_no_dev=True)
+        self.assertEqual(error, None)
+        self.assertEqual(be._osp.os_id, test_os_id)
+
+    def test_create_entries_ambiguous_profile(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        spec = {"title": "Snap", "version": "2.6.0",
+                "machine_id": "ffffffff", "root_device": "/dev/vg_hex/snap",
+                "profile": "6b"}
+        results = create_entries([spec, dict(spec, title="Snap2")],
+                                 allow_no_dev=True)
+        for (be, error) in results:
+            self.assertEqual(be, None)
+            self.assertTrue(isinstance(error, ValueError))
+            self.assertTrue("ambiguous" in str(error))
+
+    def test_create_entries_dupe(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        osp = get_os_profile_by_id(test_os_id)
+        spec = {"title": "Snap", "version": "2.6.0",
+                "machine_id": "ffffffff", "root_device": "/dev/vg_hex/snap",
+                "profile": osp}
+        results = create_entries([spec, spec], allow_no_dev=True)
+        self.assertEqual(results[0][1], None)
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(isinstance(results[1][1], ValueError))
+
+    def test_create_entries_bad_spec(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        osp = get_os_profile_by_id(test_os_id)
+        specs = [
+            {"title": "Snap", "version": "2.6.0", "machine_id": "ffffffff",
+             "root_device": "/dev/vg_hex/snap", "profile": osp},
+            {"title": "NoRoot", "version": "2.6.0", "machine_id": "ffffffff",
+             "profile": osp},
+            {"title": "NoDev", "version": "2.6.0", "machine_id": "ffffffff",
+             "root_device": "/dev/qux/quux", "profile": osp}
+        ]
+        results = create_entries(specs)
+        self.assertTrue(isinstance(results[1][1], ValueError))
+        self.assertTrue(isinstance(results[2][1], BoomRootDeviceError))
+
+    def test__create_cmd_manifest(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        manifest = join(SANDBOX_PATH, "manifest.json")
+        with open(manifest, "w") as mfile:
+            mfile.write('{"title": "Snap0", "lvm_root_lv": "vg_hex/snap0"}\n')
+            mfile.write('{"title": "Snap1", "lvm_root_lv": "vg_hex/snap1"}\n')
+        args = MockArgs()
+        args.manifest = manifest
+        args.version = "2.6.0"
+        args.machine_id = "ffffffff"
+        args.profile = test_os_id
+        args.no_dev = True
+        r = boom.command._create_cmd(args, None, None, None)
+        self.assertEqual(r, 0)
+        self.assertEqual(len(find_entries(Selection(title="Snap1"))), 1)
+
     def test_delete_entries_no_matching_raises(self):
         with self.assertRaises(IndexError) as cm:
             delete_entries(Selection(boot_id="thereisnospoon"))
 
+    def test_delete_entries_multi(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        bes = find_entries(Selection(boot_id="6"))
+        paths = [be._entry_path for be in bes]
+        nr = delete_entries(Selection(boot_id="6"))
+        self.assertEqual(nr, len(bes))
+        for path in paths:
+            self.assertFalse(exists(path))
+        self.assertFalse(find_entries(Selection(boot_id="6")))
+
+    def _create_retention_entries(self, count):
+        osp = get_os_profile_by_id(test_os_id)
+        specs = [{"title": "Snap%d" % n, "version": "2.6.%d" % (n * 5),
+                  "machine_id": "fefefefe", "root_device": "/dev/vg/snap",
+                  "lvm_root_lv": "vg/snap", "profile": osp}
+                 for n in range(0, count)]
+        bes = [r[0] for r in create_entries(specs, allow_no_dev=True)]
+        # Entry age follows the version, not the file modification time:
+        # make the oldest versions the most recently modified.
+        for (n, be) in enumerate(bes):
+            utime(be._entry_path, (1000000 - n, 1000000 - n))
+        return bes
+
+    def test_find_retention_victims(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        bes = self._create_retention_entries(4)
+        victims = find_retention_victims(1, Selection(machine_id="fefefefe"))
+        self.assertEqual(len(victims), 3)
+        self.assertFalse(bes[3] in victims)
+
+    def test_find_retention_victims_negative(self):
+        with self.assertRaises(ValueError) as cm:
+            find_retention_victims(-1)
+
+    def test_retain_entries(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        bes = self._create_retention_entries(4)
+        nr = retain_entries(2, Selection(machine_id="fefefefe"))
+        self.assertEqual(nr, 2)
+        remaining = find_entries(Selection(machine_id="fefefefe"))
+        self.assertEqual(sorted([be.title for be in remaining]),
+                         ["Snap2", "Snap3"])
+
+    def test__delete_cmd_keep(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        bes = self._create_retention_entries(3)
+        args = MockArgs()
+        args.boot_id = None
+        args.keep = 1
+        select = Selection(machine_id="fefefefe")
+        r = boom.command._delete_cmd(args, select, None, None)
+        self.assertEqual(r, 0)
+        remaining = find_entries(Selection(machine_id="fefefefe"))
+        self.assertEqual([be.title for be in remaining], ["Snap2"])
+
+    def test__delete_cmd_keep_no_criteria(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        nr_entries = len(find_entries())
+        args = MockArgs()
+        args.boot_id = None
+        args.keep = 0
+        r = boom.command._delete_cmd(args, Selection(), None, None)
+        self.assertEqual(r, 1)
+        self.assertEqual(len(find_entries()), nr_entries)
+
     def test_clone_entry_no_boot_id(self):
         with self.assertRaises(ValueError) as cm:
             bad_be = clone_entry(Selection())
@@ -728,6 +907,90 @@ class CommandTests(unittest.TestCase):
         be.delete_entry()
         self.assertFalse(exists(be._entry_path))
 
+    def test_edit_entries_add_opts(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        bes = find_entries(Selection(boot_id="6"))
+        old_paths = [be._entry_path for be in bes]
+        edited = edit_entries(Selection(boot_id="6"), add_opts="audit=1")
+        self.assertEqual(len(edited), len(bes))
+        for be in edited:
+            self.assertTrue("audit=1" in be.options)
+            self.assertTrue(exists(be._entry_path))
+        for path in old_paths:
+            self.assertFalse(exists(path))
+        entries_path = boom_entries_path()
+        for be in edited:
+            entry_file = join(entries_path, basename(be._entry_path))
+            reloaded = BootEntry(entry_file=entry_file)
+            self.assertEqual(reloaded.boot_id, be.boot_id)
+
+    def test_edit_entries_no_args(self):
+        with self.assertRaises(ValueError) as cm:
+            edit_entries(Selection(boot_id="6"))
+
+    def test_edit_entries_no_matching(self):
+        with self.assertRaises(ValueError) as cm:
+            edit_entries(Selection(boot_id="qux"), add_opts="audit=1")
+
+    def test_edit_entries_dupe(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        osp = get_os_profile_by_id(test_os_id)
+        specs = [{"title": title, "version": "2.6.0",
+                  "machine_id": "ffffffff", "root_device": "/dev/vg_hex/snap",
+                  "profile": osp} for title in ["Snap0", "Snap1"]]
+        bes = [r[0] for r in create_entries(specs, allow_no_dev=True)]
+        paths = [be._entry_path for be in bes]
+        with self.assertRaises(ValueError) as cm:
+            edit_entries(Selection(version="2.6.0"), title="Same")
+        for path in paths:
+            self.assertTrue(exists(path))
+        self.assertEqual(len(find_entries(Selection(title="Same"))), 0)
+
+    def test__edit_cmd_all(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        args = MockArgs()
+        args.all = True
+        args.boot_id = "6"
+        args.add_opts = "audit=1"
+        r = boom.command._edit_cmd(args, None, None, None)
+        self.assertEqual(r, 0)
+        for be in find_entries(Selection(boot_id="6")):
+            self.assertTrue("audit=1" in be.options)
+
+    def test__edit_cmd_all_select(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        version = "2.2.2-2.fc24.x86_64"
+        nr_match = len(find_entries(Selection.from_expr("version=%s" %
+                                                        version)))
+        self.assertTrue(0 < nr_match < len(find_entries()))
+        args = MockArgs()
+        args.all = True
+        args.boot_id = None
+        args.add_opts = "audit=1"
+        args.select = "version=%s" % version
+        select = Selection.from_cmd_args(args)
+        r = boom.command._edit_cmd(args, select, None, None)
+        self.assertEqual(r, 0)
+        for be in find_entries():
+            self.assertEqual("audit=1" in be.options,
+                             be.version == version)
+
+    def test__edit_cmd_all_no_criteria(self):
+        # Disable legacy synchronisation
+        set_boom_config(config)
+        args = MockArgs()
+        args.all = True
+        args.boot_id = None
+        args.add_opts = "audit=1"
+        r = boom.command._edit_cmd(args, Selection(), None, None)
+        self.assertEqual(r, 1)
+        for be in find_entries():
+            self.assertFalse("audit=1" in be.options)
+
     def test_edit_delete_entry(self):
         # Fedora 24 (Workstation Edition)
         osp = get_os_profile_by_id(test_os_id)
@@ -969,6 +1232,33 @@ class CommandTests(unittest.TestCase):
         osp.delete_profile()
         edit_osp.delete_profile()
 
+    def test_edit_profile_updates_entries(self):
+        osp = create_profile("Test2", "test", "2 (Test)", "2",
+                             uname_pattern="t2",
+                             options="root=%{root_device} ro %{root_opts}")
+        bes = [create_entry("ATITLE", "2.6.%d" % i, "ffffffff",
+                            "/dev/vg_hex/root", lvm_root_lv="vg_hex/root",
+                            profile=osp, allow_no_dev=True)
+               for i in range(2)]
+        other_ids = set(be.boot_id for be in find_entries()
+                        if be._osp is not osp)
+        self.assertEqual(len(find_profile_entries(osp)), 2)
+
+        edit_profile(Selection(os_id=osp.os_id),
+                     options="root=%{root_device} ro %{root_opts} edited")
+
+        # Updated entries are rewritten with the new options.
+        load_entries()
+        bes = find_entries(Selection(os_id=osp.os_id))
+        self.assertEqual(len(bes), 2)
+        for be in bes:
+            self.assertTrue(be.options.endswith(" edited"))
+        # Entries using other profiles are unchanged.
+        self.assertEqual(set(be.boot_id for be in find_entries()
+                             if be._osp is not osp), other_ids)
+        delete_entries(Selection(os_id=osp.os_id))
+        osp.delete_profile()
+
     def test_edit_no_matching_os_id(self):
         with self.assertRaises(ValueError) as cm:
             edit_osp = edit_profile(Selection(os_id="notfound"),
@@ -1543,6 +1833,184 @@ class CommandTests(unittest.TestCase):
         r = boom.command._edit_cmd(args, None, opts, None)
         self.assertEqual(r, 1)
 
+
+class CommandBatchTests(unittest.TestCase):
+    """Test the boom batch command mode.
+    """
+    def _run_batch(self, lines):
+        out = StringIO()
+        status = run_batch(lines, out_file=out)
+        results = [json.loads(l) for l in out.getvalue().splitlines()]
+        return (status, results)
+
+    def test_insert_default_type(self):
+        args = ["boom", "list"]
+        boom.command._insert_default_type(args)
+        self.assertEqual(args, ["boom", "entry", "list"])
+
+    def test_insert_default_type_batch(self):
+        args = ["boom", "batch", "cmds.txt"]
+        boom.command._insert_default_type(args)
+        self.assertEqual(args, ["boom", "batch", "run", "cmds.txt"])
+
+    def test_run_batch(self):
+        lines = ["list", "# comment", "", "show 61bcc49"]
+        (status, results) = self._run_batch(lines)
+        self.assertEqual(status, 0)
+        self.assertEqual([r["line"] for r in results], [1, 4])
+        self.assertEqual([r["status"] for r in results], [0, 0])
+        self.assertTrue("boot_id=61bcc49" in results[1]["output"])
+
+    def test_run_batch_json(self):
+        lines = ['{"command": "list", "boot_id": "61bcc49", '
+                 '"options": "bootid", "tag": "one"}']
+        (status, results) = self._run_batch(lines)
+        self.assertEqual(status, 0)
+        self.assertEqual(results[0]["tag"], "one")
+        self.assertTrue("61bcc49" in results[0]["output"])
+
+    def test_run_batch_json_bad_arg(self):
+        lines = ['{"command": "list", "qux": "quux"}']
+        (status, results) = self._run_batch(lines)
+        self.assertEqual(status, 1)
+        self.assertTrue("qux" in results[0]["error"])
+
+    def test_run_batch_bad_commands(self):
+        lines = ["qux quux", "list --nonsense", "list --boot-dir /boot",
+                 "batch run", "list"]
+        (status, results) = self._run_batch(lines)
+        self.assertEqual(status, 1)
+        self.assertEqual([r["status"] for r in results], [1, 1, 1, 1, 0])
+        for result in results[0:4]:
+            self.assertTrue(result["error"])
+
+    def test_run_batch_commits_once(self):
+        from tests.bench.fixtures import make_boot_dir, profile_os_id
+        reset_sandbox()
+        boot_path = join(SANDBOX_PATH, "batch")
+        make_boot_dir(boot_path, 3, nr_profiles=2)
+        create = ("create --title Batch%d --version 5.0.%d -m ffffffff "
+                  "--root-device /dev/sda%d --profile %s --no-dev")
+        lines = [create % (n, n, n, profile_os_id(0)) for n in range(3)]
+        lines += ["delete --title Batch1", "delete --title 'Bench entry 0'"]
+        try:
+            with boom.BoomContext(boot_path=boot_path):
+                # Load entries and profiles before counting.
+                self._run_batch(["list"])
+                bench0 = find_entries(Selection(title="Bench entry 0"))
+                reset_io_counts()
+                (status, results) = self._run_batch(lines)
+                counts = get_io_counts()
+                self.assertEqual(status, 0)
+                self.assertEqual([r["status"] for r in results], [0] * 5)
+                # Two new entries, with one synchronisation of the
+                # entries directory for the whole batch.
+                self.assertEqual(counts[boom.IO_RENAME], 2)
+                self.assertEqual(counts[boom.IO_FSYNC], 3)
+                self.assertEqual(counts[boom.IO_UNLINK], len(bench0))
+                entries_path = join(boot_path, "loader", "entries")
+                titles = []
+                for name in listdir(entries_path):
+                    with open(join(entries_path, name)) as entry_f:
+                        titles += [l.split(None, 1)[1].strip()
+                                   for l in entry_f if l.startswith("title")]
+                self.assertTrue("Batch0" in titles)
+                self.assertTrue("Batch2" in titles)
+                self.assertFalse("Batch1" in titles)
+                self.assertFalse("Bench entry 0" in titles)
+                self.assertTrue("Bench entry 1" in titles)
+        finally:
+            rm_sandbox()
+
+    def _batch_boot_dir(self, nr_entries):
+        from tests.bench.fixtures import make_boot_dir
+        reset_sandbox()
+        boot_path = join(SANDBOX_PATH, "batch")
+        make_boot_dir(boot_path, nr_entries, nr_profiles=2)
+        return boot_path
+
+    def _batch_create(self, title, version="5.0.0"):
+        from tests.bench.fixtures import profile_os_id
+        return ("create --title %s --version %s -m ffffffff "
+                "--root-device /dev/sda1 --profile %s --no-dev" %
+                (title, version, profile_os_id(0)))
+
+    def test_run_batch_empty_entries(self):
+        boot_path = self._batch_boot_dir(0)
+        lines = [self._batch_create("Batch0"), self._batch_create("Batch0"),
+                 "list --title Batch0 -o title"]
+        try:
+            with boom.BoomContext(boot_path=boot_path):
+                (status, results) = self._run_batch(lines)
+                self.assertEqual(status, 1)
+                self.assertEqual([r["status"] for r in results], [0, 1, 0])
+                self.assertTrue("already exists" in results[1]["output"])
+                self.assertTrue("Batch0" in results[2]["output"])
+                entries_path = join(boot_path, "loader", "entries")
+                self.assertEqual(len(listdir(entries_path)), 1)
+        finally:
+            rm_sandbox()
+
+    def test_run_batch_edit_dupe_keeps_queued(self):
+        boot_path = self._batch_boot_dir(1)
+        lines = [self._batch_create("Batch0", "2.6.0"),
+                 self._batch_create("Batch1", "2.6.0"),
+                 "edit --all --select version=2.6.0 --title Same",
+                 "list --version 2.6.0 -o title"]
+        try:
+            with boom.BoomContext(boot_path=boot_path):
+                (status, results) = self._run_batch(lines)
+                self.assertEqual(status, 1)
+                self.assertEqual([r["status"] for r in results],
+                                 [0, 0, 1, 0])
+                self.assertTrue("duplicate" in results[2]["output"])
+                self.assertTrue("Batch0" in results[3]["output"])
+                self.assertTrue("Batch1" in results[3]["output"])
+                self.assertFalse("Same" in results[3]["output"])
+                entries_path = join(boot_path, "loader", "entries")
+                self.assertEqual(len(listdir(entries_path)), 3)
+        finally:
+            rm_sandbox()
+
+    def test_run_batch_commit_failure(self):
+        boot_path = self._batch_boot_dir(0)
+        lines = ["list", self._batch_create("Batch0"), "list",
+                 self._batch_create("Batch1")]
+
+        def fail_commit(bes, unlink_paths=None):
+            return [(be, OSError("Injected failure")) for be in bes]
+
+        commit_entries = boom.command.commit_entries
+        boom.command.commit_entries = fail_commit
+        try:
+            with boom.BoomContext(boot_path=boot_path):
+                (status, results) = self._run_batch(lines)
+                self.assertEqual(status, 1)
+                self.assertEqual([r["line"] for r in results],
+                                 [1, 2, 3, 4, None])
+                self.assertEqual(results[-1]["status"], 1)
+                self.assertEqual(results[-1]["lines"], [2, 4])
+                self.assertTrue("2, 4" in results[-1]["error"])
+        finally:
+            boom.command.commit_entries = commit_entries
+            rm_sandbox()
+
+    def test_write_legacy_deferred(self):
+        write_legacy = getattr(boom.command, "__write_legacy")
+        old_config = get_boom_config()
+        legacy_config = BoomConfig()
+        legacy_config.legacy_enable = True
+        legacy_config.legacy_sync = True
+        set_boom_config(legacy_config)
+        boom.command._legacy_deferred = True
+        try:
+            write_legacy()
+            self.assertTrue(boom.command._legacy_pending)
+        finally:
+            boom.command._legacy_deferred = False
+            boom.command._legacy_pending = False
+            set_boom_config(old_config)
+
 # Calling the main() entry point from the test suite causes a SysExit
 # exception in ArgParse() (too few arguments).
 #    def test_boom_main_noargs(self):
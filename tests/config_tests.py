@@ -33,7 +33,6 @@ from tests import *
 
 from boom import *
 from boom.config import *
-BOOT_ROOT_TEST = abspath("./tests")
 set_boot_path(BOOT_ROOT_TEST)
 
 class ConfigBasicTests(unittest.TestCase):
@@ -68,6 +67,24 @@ class ConfigBasicTests(unittest.TestCase):
         self.assertEqual(cfg.get("global", "boot_root"), boot_path)
         self.assertEqual(cfg.get("global", "boom_root"), boom_path)
 
+    def test_sync_config_lock_timeout(self):
+        """Test that _sync_config() writes only a non-default lock
+            timeout.
+        """
+        import boom.config # for _sync_config()
+        cfg = ConfigParser()
+        bc = BoomConfig()
+
+        cfg.add_section("global")
+        cfg.add_section("legacy")
+
+        boom.config._sync_config(bc, cfg)
+        self.assertFalse(cfg.has_option("global", "lock_timeout"))
+
+        bc.lock_timeout = 5
+        boom.config._sync_config(bc, cfg)
+        self.assertEqual(cfg.get("global", "lock_timeout"), "5")
+
 
 class ConfigTests(unittest.TestCase):
     # The set of configuration files to use for this test class
@@ -116,6 +133,36 @@ class ConfigTests(unittest.TestCase):
         """
         load_boom_config()
 
+    def test_load_boom_config_lock_timeout(self):
+        """Test that `load_boom_config()` reads the lock_timeout key.
+        """
+        with open(self.boom_conf, "w") as f:
+            f.write("[global]\nboot_root = %s\nboom_root = %s/boom\n"
+                    "lock_timeout = 2.5\n" % (self.boot_path, self.boot_path))
+
+        config = get_boom_config()
+        try:
+            load_boom_config()
+            self.assertEqual(get_boom_config().lock_timeout, 2.5)
+        finally:
+            set_boom_config(config)
+
+    def test_load_boom_config_entry_roots(self):
+        """Test that `load_boom_config()` reads the entry_roots key.
+        """
+        with open(self.boom_conf, "w") as f:
+            f.write("[global]\nboot_root = %s\nboom_root = %s/boom\n"
+                    "entry_roots = /efi, /boot\n" %
+                    (self.boot_path, self.boot_path))
+
+        config = get_boom_config()
+        try:
+            load_boom_config()
+            self.assertEqual(get_boom_config().entry_roots,
+                             ["/efi", "/boot"])
+        finally:
+            set_boom_config(config)
+
 class BadConfigTests(ConfigTests):
     # The set of configuration files to use for this test class
     conf_path = join(BOOT_ROOT_TEST, "boom_configs/badconfig/boot")
@@ -17,6 +17,7 @@ from sys import stdout
 from os import listdir, makedirs
 from os.path import abspath, exists, join
 import shutil
+import pickle
 
 log = logging.getLogger()
 log.level = logging.DEBUG
@@ -29,7 +30,6 @@ from boom import *
 
 from tests import *
 
-BOOT_ROOT_TEST = abspath("./tests")
 set_boot_path(BOOT_ROOT_TEST)
 
 BOOM_ENTRY_MACHINE_ID="BOOM_ENTRY_MACHINE_ID"
@@ -117,6 +117,54 @@ class HostProfileTests(unittest.TestCase):
         # Test that loading the test profiles succeeds.
         load_host_profiles()
 
+    def test_get_host_profile_by_host_id_on_demand(self):
+        import boom.hostprofile
+        from os import unlink
+        # Remove any snapshots to force profiles to be parsed.
+        for path in (boom_host_profiles_path(), boom_profiles_path()):
+            if exists(path + ".snapshot"):
+                unlink(path + ".snapshot")
+        host_id = "2b4048d37f3c42b1d5e2a9ede501b2815fac9c69"
+        hp = get_host_profile_by_host_id(host_id)
+        self.assertEqual(hp.host_id, host_id)
+        self.assertEqual(hp.osp.os_id,
+                         "d4439b7d2f928c39f1160c0b0291407e5990b9e0")
+        # Only the requested host profile and its OsProfile are loaded.
+        self.assertFalse(host_profiles_loaded())
+        self.assertFalse(profiles_loaded())
+        self.assertEqual(len(boom.hostprofile._host_profiles), 1)
+        # A full load retains the host profile loaded on demand.
+        load_host_profiles()
+        self.assertTrue(get_host_profile_by_host_id(host_id) is hp)
+
+    def test_HostProfile_pickle(self):
+        import boom.hostprofile
+        hp = find_host_profiles()[0]
+        nr_hosts = len(boom.hostprofile._host_profiles)
+        hp2 = pickle.loads(pickle.dumps(hp, 2))
+        self.assertEqual(hp2.host_id, hp.host_id)
+        self.assertEqual(str(hp2), str(hp))
+        # The OsProfile is re-bound rather than copied.
+        self.assertTrue(hp2.osp is hp.osp)
+        self.assertEqual(len(boom.hostprofile._host_profiles), nr_hosts)
+
+    def test_load_host_profiles_snapshot(self):
+        import boom.hostprofile
+        snapshot_path = boom_host_profiles_path() + ".snapshot"
+        with BoomLock(exclusive=True):
+            load_profiles()
+            load_host_profiles()
+        self.assertTrue(exists(snapshot_path))
+        host_ids = sorted(hp.host_id for hp in boom.hostprofile._host_profiles)
+
+        # Reload from the snapshot and check OsProfile binding
+        load_host_profiles()
+        hps = boom.hostprofile._host_profiles
+        self.assertEqual(host_ids, sorted(hp.host_id for hp in hps))
+        for hp in hps:
+            self.assertTrue(hp.osp in boom.osprofile._profiles)
+            self.assertTrue(hp.osp.os_id.startswith(hp.os_id))
+
     # HostProfile tests
 
     def test_HostProfile__str__(self):
@@ -420,6 +468,14 @@ class HostProfileTests(unittest.TestCase):
         width = boom.hostprofile.min_machine_id_width()
         self.assertEqual(xwidth, width)
 
+    def test_iter_host_profiles(self):
+        select = Selection(host_name="localhost.localdomain")
+        hps = list(iter_host_profiles(select))
+        self.assertTrue(hps)
+        found = find_host_profiles(select)
+        self.assertEqual(sorted(hp.host_id for hp in hps),
+                         sorted(hp.host_id for hp in found))
+
     def test_find_host_host_id(self):
         # Non-existent host_id
         hps = find_host_profiles(Selection(host_id="fffffff"))
@@ -0,0 +1,78 @@
+# Copyright (C) 2017 Red Hat, Inc., Bryn M. Reeves <bmr@redhat.com>
+#
+# legacy_tests.py - Boom legacy boot loader tests.
+#
+# This file is part of the boom project.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+import unittest
+import logging
+from os.path import abspath, exists, join
+
+log = logging.getLogger()
+log.level = logging.DEBUG
+log.addHandler(logging.FileHandler("test.log"))
+
+import boom
+from boom import *
+from boom.bootloader import *
+from boom.legacy import *
+
+from tests import *
+
+set_boot_path(BOOT_ROOT_TEST)
+
+
+class Grub2LegacyTests(unittest.TestCase):
+    """Tests for the pre-rendered Grub2 menu fragment format.
+    """
+    def setUp(self):
+        reset_sandbox()
+        reset_boom_paths()
+        self.cfg_path = join(SANDBOX_PATH, "boom.cfg")
+
+    def tearDown(self):
+        rm_sandbox()
+        reset_boom_paths()
+
+    def test_Grub2BootEntry__str__(self):
+        bp = BootParams("4.11.5-100.fc24.x86_64", root_device="/dev/sda5")
+        be = BootEntry(title="Fedora's kernel", machine_id="ffffffff",
+                       boot_params=bp, allow_no_dev=True)
+        be.linux = "/vmlinuz-4.11.5-100.fc24.x86_64"
+        be.options = "root=/dev/sda5 ro"
+        xstr = ("menuentry 'Fedora'\\''s kernel' --id 'boom-%s' {\n"
+                "        linux /vmlinuz-4.11.5-100.fc24.x86_64"
+                " root=/dev/sda5 ro\n"
+                "        initrd /initramfs-4.11.5-100.fc24.x86_64.img\n"
+                "}" % be.boot_id)
+        self.assertEqual(str(Grub2BootEntry(be)), xstr)
+
+    def test_sync_legacy_loader_grub2_creates_fragment(self):
+        selection = Selection(machine_id="ffffffff")
+        sync_legacy_loader(selection=selection, loader=BOOM_LOADER_GRUB2,
+                           cfg_path=self.cfg_path)
+        self.assertTrue(exists(self.cfg_path))
+        with open(self.cfg_path, "r") as cfg_f:
+            cfg = cfg_f.read()
+        nr_entries = len(find_entries(selection))
+        self.assertEqual(cfg.count("menuentry "), nr_entries)
+        self.assertTrue(cfg.startswith("#--- BOOM_Grub2_BEGIN ---\n"))
+
+    def test_sync_legacy_loader_grub2_unchanged_elides_write(self):
+        sync_legacy_loader(loader=BOOM_LOADER_GRUB2, cfg_path=self.cfg_path)
+        boom.reset_io_counts()
+        sync_legacy_loader(loader=BOOM_LOADER_GRUB2, cfg_path=self.cfg_path)
+        self.assertEqual(boom.get_io_counts()[boom.IO_RENAME], 0)
+
+    def test_clear_legacy_loader_grub2_missing_fragment(self):
+        clear_legacy_loader(loader=BOOM_LOADER_GRUB2, cfg_path=self.cfg_path)
+        self.assertFalse(exists(self.cfg_path))
+
+# vim: set et ts=4 sw=4 :
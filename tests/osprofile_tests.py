@@ -15,8 +15,9 @@ import unittest
 import logging
 from sys import stdout
 from os import listdir, makedirs
-from os.path import abspath, join
+from os.path import abspath, join, exists
 import shutil
+import pickle
 
 log = logging.getLogger()
 log.level = logging.DEBUG
@@ -25,11 +26,10 @@ log.addHandler(logging.FileHandler("test.log"))
 from boom.osprofile import *
 from boom import *
 
-BOOT_ROOT_TEST = abspath("./tests")
-set_boot_path(BOOT_ROOT_TEST)
-
 from tests import *
 
+set_boot_path(BOOT_ROOT_TEST)
+
 class OsProfileTests(unittest.TestCase):
     """Test OsProfile basic methods
     """
@@ -68,6 +68,98 @@ class OsProfileTests(unittest.TestCase):
 
         # Add profile content tests
 
+    def test_get_os_profile_by_id_on_demand(self):
+        import boom.osprofile
+        from os import unlink
+        # Remove any snapshot to force profiles to be parsed.
+        if exists(boom_profiles_path() + ".snapshot"):
+            unlink(boom_profiles_path() + ".snapshot")
+        os_id = "9cb53ddda889d6285fd9ab985a4c47025884999f"
+        nr_profiles = len(boom.osprofile._profiles)
+        osp = get_os_profile_by_id(os_id)
+        self.assertEqual(osp.os_id, os_id)
+        # Only the requested profile is loaded.
+        self.assertFalse(profiles_loaded())
+        self.assertEqual(len(boom.osprofile._profiles), nr_profiles + 1)
+        # A full load retains the profile loaded on demand.
+        load_profiles()
+        self.assertTrue(profiles_loaded())
+        self.assertTrue(get_os_profile_by_id(os_id) is osp)
+        self.assertTrue(osp in find_profiles())
+
+    def test_get_os_profile_by_id_on_demand_missing(self):
+        from os import unlink
+        if exists(boom_profiles_path() + ".snapshot"):
+            unlink(boom_profiles_path() + ".snapshot")
+        # No file is named for a prefix: fall back to a full load.
+        self.assertEqual(get_os_profile_by_id("9cb53dd"), None)
+        self.assertTrue(profiles_loaded())
+
+    def test_OsProfile_pickle(self):
+        import boom.osprofile
+        osp = find_profiles(Selection(os_short_name="fedora"))[0]
+        nr_profiles = len(boom.osprofile._profiles)
+        osp2 = pickle.loads(pickle.dumps(osp, 2))
+        self.assertEqual(osp2.os_id, osp.os_id)
+        self.assertEqual(repr(osp2), repr(osp))
+        # Unpickled profiles are not added to the profile list.
+        self.assertEqual(len(boom.osprofile._profiles), nr_profiles)
+        self.assertTrue(get_os_profile_by_id(osp.os_id) is osp)
+
+    def test_iter_profiles(self):
+        select = Selection(os_short_name="fedora")
+        osps = list(iter_profiles(select))
+        self.assertTrue(osps)
+        self.assertEqual(sorted(osp.os_id for osp in osps),
+                         sorted(osp.os_id for osp in find_profiles(select)))
+
+    def test_load_profiles_snapshot(self):
+        from os import unlink
+        snapshot_path = boom_profiles_path() + ".snapshot"
+        if exists(snapshot_path):
+            unlink(snapshot_path)
+        # Commands that only read profiles do not write a snapshot.
+        load_profiles()
+        self.assertFalse(exists(snapshot_path))
+        with BoomLock(exclusive=True):
+            load_profiles()
+        self.assertTrue(exists(snapshot_path))
+        os_ids = sorted(osp.os_id for osp in find_profiles())
+        comments = dict((osp.os_id, osp._comments) for osp in find_profiles())
+
+        # Reload from the snapshot and compare
+        load_profiles()
+        self.assertEqual(os_ids, sorted(osp.os_id for osp in find_profiles()))
+        for osp in find_profiles():
+            self.assertFalse(osp._unwritten)
+            self.assertEqual(osp._comments, comments[osp.os_id])
+            self.assertTrue(isinstance(osp.os_name, str))
+
+    def test_load_profiles_snapshot_invalidated(self):
+        import boom.osprofile
+        load_profiles()
+        nr_profiles = len(boom.osprofile._profiles)
+        osp = OsProfile(name="Snapshot OS", short_name="snapos",
+                        version="1 (Snapshot)", version_id="1",
+                        uname_pattern="snap1")
+        osp.write_profile()
+
+        # The new profile file invalidates the existing snapshot
+        load_profiles()
+        self.assertEqual(len(boom.osprofile._profiles), nr_profiles + 1)
+        self.assertTrue(find_profiles(Selection(os_short_name="snapos")))
+
+    def test_load_profiles_snapshot_corrupt(self):
+        import boom.osprofile
+        snapshot_path = boom_profiles_path() + ".snapshot"
+        with BoomLock(exclusive=True):
+            load_profiles()
+        nr_profiles = len(boom.osprofile._profiles)
+        with open(snapshot_path, "w") as f:
+            f.write("{not json")
+        load_profiles()
+        self.assertEqual(len(boom.osprofile._profiles), nr_profiles)
+
     # OsProfile tests
 
     def test_OsProfile__str__(self):
@@ -260,6 +352,18 @@ class OsProfileTests(unittest.TestCase):
                             "%s-fedora1.profile" % osp.os_id)
         self.assertTrue(exists(profile_path))
 
+    def test_OsProfile_write_unchanged_elides_write(self):
+        import boom
+        osp = OsProfile(name="Fedora Core", short_name="fedora",
+                        version="2 (Workstation Edition)", version_id="2")
+        osp.uname_pattern = "fc2"
+        osp.write_profile()
+        boom.reset_io_counts()
+        osp.write_profile(force=True)
+        counts = boom.get_io_counts()
+        self.assertEqual(counts[boom.IO_WRITE], 0)
+        self.assertEqual(counts[boom.IO_RENAME], 0)
+
     def test_osprofile_write_profiles(self):
         import boom
         boom.osprofile.load_profiles()
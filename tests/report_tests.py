@@ -28,7 +28,7 @@ log.level = logging.DEBUG
 log.addHandler(logging.FileHandler("test.log"))
 
 import boom
-BOOT_ROOT_TEST = abspath("./tests")
+from tests import BOOT_ROOT_TEST
 boom.set_boot_path(BOOT_ROOT_TEST)
 
 import boom.report
@@ -118,4 +118,21 @@ class ReportTests(unittest.TestCase):
 
         self.assertEqual(output.getvalue(), xoutput)
 
+    def test_BoomReport_unbuffered_report(self):
+        bf_name = BoomFieldType(BR_STR, "name", "Name", "Nothing", 8,
+                                REP_STR, lambda f, d: f.report_str(d))
+
+        output = StringIO()
+        opts = BoomReportOpts(report_file=output, buffered=False)
+
+        br = BoomReport(_test_obj_types, [bf_name], "name",
+                        opts, None, None)
+
+        # Each row is written once, as it is reported.
+        br.report_object(_report_objs[0])
+        self.assertEqual(output.getvalue(), "Name    \nfoo     \n")
+        br.report_object(_report_objs[1])
+        self.assertEqual(output.getvalue(),
+                         "Name    \nfoo     \nbar     \n")
+
 # vim: set et ts=4 sw=4 :